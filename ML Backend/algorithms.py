@@ -0,0 +1,56 @@
+"""
+Optional algorithm libraries
+
+xgboost, catboost and lightgbm are only imported when a model that needs
+them is trained. Availability is checked without importing the package, so
+/health can report it at startup for free.
+"""
+
+import importlib
+import importlib.util
+import logging
+import threading
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# algorithm name -> (package, classifier class)
+OPTIONAL_LIBRARIES = {
+    "xgboost": ("xgboost", "XGBClassifier"),
+    "catboost": ("catboost", "CatBoostClassifier"),
+    "lightgbm": ("lightgbm", "LGBMClassifier"),
+}
+
+_loaded: Dict[str, Optional[Any]] = {}
+_lock = threading.Lock()
+
+
+def is_available(algorithm: str) -> bool:
+    """Whether the library behind an optional algorithm is installed (and importable, once tried)."""
+    with _lock:
+        if algorithm in _loaded:
+            return _loaded[algorithm] is not None
+    package, _ = OPTIONAL_LIBRARIES[algorithm]
+    try:
+        return importlib.util.find_spec(package) is not None
+    except (ImportError, ValueError):
+        return False
+
+
+def load_classifier(algorithm: str) -> Optional[Any]:
+    """Import and return the classifier class for an optional algorithm, or None if it is unavailable."""
+    with _lock:
+        if algorithm not in _loaded:
+            package, class_name = OPTIONAL_LIBRARIES[algorithm]
+            try:
+                _loaded[algorithm] = getattr(importlib.import_module(package), class_name)
+                logger.info(f"Loaded {package} for {algorithm} models")
+            except Exception as e:
+                logger.warning(f"{package} not available ({str(e)}). Install with: pip install {package}")
+                _loaded[algorithm] = None
+        return _loaded[algorithm]
+
+
+def availability() -> Dict[str, bool]:
+    """Availability of every optional algorithm library, for /health."""
+    return {algorithm: is_available(algorithm) for algorithm in OPTIONAL_LIBRARIES}
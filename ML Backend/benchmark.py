@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+"""
+Benchmarks of training and prediction through the API
+
+Builds Moodle datasets of the requested sizes with
+generate_synthetic_moodle_data (moodle_dataset_generator.py) from a fixed
+seed, and drives the FastAPI app in-process through a test client:
+
+- ``POST /train`` with ``wait=true`` for every algorithm: the request's wall
+  time and the training run's peak RSS (from its profile);
+- ``POST /predict`` with single rows: p50 / p95 / p99 latency;
+- ``POST /predict`` with batches: rows scored per second;
+- the serving process's peak RSS while predicting.
+
+Results are written as JSON and compared against a stored baseline. A
+metric regresses when it is worse than the baseline's by more than its
+threshold, a fraction of the baseline value (lower is better for times and
+memory, higher for throughput). Exits with code 1 on any regression, so it
+can gate a deploy. Timings are only comparable on the same hardware: when
+the CPU count, platform or settings differ from the baseline's, the
+comparison is skipped with a warning (--force-compare runs it anyway).
+
+Generated datasets are cached in --data-dir. The generator builds each row
+in Python, so sizes above --max-generated-rows are drawn with replacement
+(from the same seed) from a dataset of that many rows.
+
+    python benchmark.py --sizes 1000,10000,100000
+    python benchmark.py --sizes 1000,10000 --save-baseline
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import math
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BACKEND_DIR))
+
+from faker import Faker
+from moodle_dataset_generator import generate_synthetic_moodle_data
+
+RESULTS_VERSION = 1
+API_KEY = "benchmark"
+DEFAULT_BASELINE = os.path.join(BACKEND_DIR, "benchmarks", "baseline.json")
+DEFAULT_ALGORITHMS = "randomforest,extratrees,xgboost,lightgbm"
+# Identifying and free-text columns of the generated data
+ID_COLUMNS = "user_id,firstname,lastname,email"
+TARGET_COLUMN = "final_outcome"
+# Rows of the dataset every algorithm is trained on once before the benchmarks
+WARMUP_ROWS = 500
+# Environment keys that must match the baseline's for timings to be comparable
+COMPARABLE_ENVIRONMENT = ("cpus", "platform")
+# Per-run values left out of a stored baseline
+UNSTORED_METRICS = ("model_id",)
+
+# Metrics and whether lower or higher values are better
+METRICS = {
+    "train_seconds": "lower",
+    "train_peak_rss_mb": "lower",
+    "predict_p50_ms": "lower",
+    "predict_p95_ms": "lower",
+    "predict_p99_ms": "lower",
+    "batch_rows_per_second": "higher",
+    "serving_peak_rss_mb": "lower",
+}
+# Largest tolerated regression per metric, as a fraction of the baseline value
+DEFAULT_THRESHOLDS = {
+    "train_seconds": 0.25,
+    "train_peak_rss_mb": 0.15,
+    "predict_p50_ms": 0.25,
+    "predict_p95_ms": 0.5,
+    "predict_p99_ms": 1.0,
+    "batch_rows_per_second": 0.25,
+    "serving_peak_rss_mb": 0.15,
+}
+
+
+def _seed(seed):
+    np.random.seed(seed)
+    random.seed(seed)
+    Faker.seed(seed)
+
+
+def generate_dataset(rows, seed):
+    """Exactly ``rows`` rows of synthetic Moodle data, the same for the same seed."""
+    _seed(seed)
+    students = max(1, math.ceil(rows / 4))
+    while True:
+        with contextlib.redirect_stdout(io.StringIO()):
+            df = generate_synthetic_moodle_data(num_students=students)
+        if len(df) >= rows:
+            return df.head(rows).reset_index(drop=True)
+        # Students are enrolled in a random number of courses
+        _seed(seed)
+        students = math.ceil(students * rows / len(df) * 1.1)
+
+
+def load_dataset(rows, seed, data_dir, max_generated_rows):
+    """The dataset of a size as a CSV file in ``data_dir``, generated on first use."""
+    path = os.path.join(data_dir, f"moodle_{rows}_{seed}.csv")
+    if os.path.exists(path):
+        return path
+    os.makedirs(data_dir, exist_ok=True)
+    if rows <= max_generated_rows:
+        df = generate_dataset(rows, seed)
+    else:
+        base = pd.read_csv(load_dataset(max_generated_rows, seed, data_dir, max_generated_rows))
+        rng = np.random.default_rng(seed)
+        df = base.iloc[rng.integers(0, len(base), size=rows)].reset_index(drop=True)
+        df["user_id"] = np.arange(1, rows + 1)
+    tmp_path = f"{path}.tmp"
+    df.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, path)
+    return path
+
+
+def _percentiles_ms(latencies):
+    p50, p95, p99 = np.percentile(np.asarray(latencies) * 1000, [50, 95, 99])
+    return round(float(p50), 3), round(float(p95), 3), round(float(p99), 3)
+
+
+def train(client, dataset_path, courseid, algorithm, compile_models=False):
+    """Train a model through POST /train with wait=true; returns the TrainResponse and the request's seconds."""
+    form = {"courseid": str(courseid), "algorithm": algorithm, "target_column": TARGET_COLUMN,
+            "id_columns": ID_COLUMNS, "wait": "true"}
+    if compile_models:
+        form["compile_model"] = "true"
+    start = time.perf_counter()
+    with open(dataset_path, "rb") as f:
+        response = client.post("/train", headers={"X-API-Key": API_KEY}, data=form,
+                               files={"dataset_file": (os.path.basename(dataset_path), f, "text/csv")})
+    seconds = time.perf_counter() - start
+    if response.status_code != 200:
+        raise RuntimeError(f"Training failed with {response.status_code}: {response.text[:500]}")
+    return response.json(), seconds
+
+
+def benchmark_case(client, dataset_path, courseid, algorithm, records, args, profile_cls):
+    """Train one model on a dataset and measure predictions with it."""
+    headers = {"X-API-Key": API_KEY}
+    trained, request_seconds = train(client, dataset_path, courseid, algorithm, args.compile_models)
+    model_id = trained["model_id"]
+    profile = trained["metrics"].get("profile") or {}
+
+    # Warm the model cache, so the latencies do not include loading the model
+    client.post("/predict", headers=headers, json={"model_id": model_id, "features": records[0]})
+    serving = profile_cls()
+    serving.start("predict_single")
+    latencies = []
+    for i in range(args.single_requests):
+        record = records[i % len(records)]
+        start = time.perf_counter()
+        response = client.post("/predict", headers=headers, json={"model_id": model_id, "features": record})
+        latencies.append(time.perf_counter() - start)
+        if response.status_code != 200:
+            raise RuntimeError(f"Prediction failed with {response.status_code}: {response.text[:500]}")
+    serving.start("predict_batch")
+    batch = [records[i % len(records)] for i in range(args.batch_rows)]
+    start = time.perf_counter()
+    for _ in range(args.batch_requests):
+        response = client.post("/predict", headers=headers, json={"model_id": model_id, "features": batch})
+        if response.status_code != 200:
+            raise RuntimeError(f"Batch prediction failed with {response.status_code}: {response.text[:500]}")
+    batch_seconds = time.perf_counter() - start
+    serving.stop()
+
+    p50, p95, p99 = _percentiles_ms(latencies)
+    return {
+        "model_id": model_id,
+        # The training run itself; the request adds the upload and the wait for the job
+        "train_seconds": profile.get("wall_seconds"),
+        "train_request_seconds": round(request_seconds, 3),
+        "train_peak_rss_mb": profile.get("peak_rss_mb"),
+        "predict_p50_ms": p50,
+        "predict_p95_ms": p95,
+        "predict_p99_ms": p99,
+        "batch_rows_per_second": round(args.batch_rows * args.batch_requests / batch_seconds, 1),
+        "serving_peak_rss_mb": serving.to_dict()["peak_rss_mb"],
+    }
+
+
+def compare(results, baseline, thresholds):
+    """Metrics of ``results`` that are worse than ``baseline``'s by more than their threshold."""
+    regressions = []
+    for case, metrics in results["cases"].items():
+        expected = baseline.get("cases", {}).get(case)
+        if not expected or "error" in metrics or "error" in expected:
+            continue
+        for metric, direction in METRICS.items():
+            value, reference = metrics.get(metric), expected.get(metric)
+            if value is None or not reference:
+                continue
+            change = value / reference - 1 if direction == "lower" else reference / max(value, 1e-12) - 1
+            if change > thresholds[metric]:
+                regressions.append({"case": case, "metric": metric, "baseline": reference, "value": value,
+                                    "change": round(change, 4), "threshold": thresholds[metric]})
+    return regressions
+
+
+def mismatches(results, baseline):
+    """Environment and settings of ``results`` that differ from ``baseline``'s, as {key: [baseline, results]}."""
+    differences = {}
+    for section, keys in (("environment", COMPARABLE_ENVIRONMENT), ("settings", None)):
+        ours, theirs = results.get(section, {}), baseline.get(section, {})
+        for key in keys or sorted(set(ours) | set(theirs)):
+            if ours.get(key) != theirs.get(key):
+                differences[f"{section}.{key}"] = [theirs.get(key), ours.get(key)]
+    return differences
+
+
+def _baseline_cases(cases):
+    return {case: {metric: value for metric, value in metrics.items() if metric not in UNSTORED_METRICS}
+            for case, metrics in cases.items()}
+
+
+def _thresholds(args, baseline):
+    thresholds = dict(DEFAULT_THRESHOLDS)
+    thresholds.update((baseline or {}).get("thresholds", {}))
+    if args.max_regression is not None:
+        thresholds = {metric: args.max_regression for metric in thresholds}
+    for item in args.threshold:
+        metric, _, fraction = item.partition("=")
+        if metric not in METRICS:
+            raise SystemExit(f"Unknown metric '{metric}', expected one of {list(METRICS)}")
+        thresholds[metric] = float(fraction)
+    return thresholds
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark training and prediction through the API')
+    parser.add_argument('--sizes', type=str, default="1000,10000,100000", help='Comma-separated dataset sizes in rows')
+    parser.add_argument('--algorithms', type=str, default=DEFAULT_ALGORITHMS, help='Comma-separated algorithms to train')
+    parser.add_argument('--seed', type=int, default=42, help='Seed of the generated datasets')
+    parser.add_argument('--single-requests', type=int, default=200, help='Single-row predictions per model')
+    parser.add_argument('--batch-rows', type=int, default=1000, help='Rows per batch prediction')
+    parser.add_argument('--batch-requests', type=int, default=10, help='Batch predictions per model')
+    parser.add_argument('--compile-models', action='store_true', help='Train models with compiled inference')
+    parser.add_argument('--data-dir', type=str, default=os.path.join(tempfile.gettempdir(), "spp-benchmark-data"),
+                        help='Directory the generated datasets are cached in')
+    parser.add_argument('--max-generated-rows', type=int, default=200000,
+                        help='Larger datasets are resampled from one of this many generated rows')
+    parser.add_argument('--output', type=str, default="benchmark-results.json", help='File the results are written to')
+    parser.add_argument('--baseline', type=str, default=DEFAULT_BASELINE, help='Baseline results to compare against')
+    parser.add_argument('--save-baseline', action='store_true', help='Write the results as the new baseline')
+    parser.add_argument('--force-compare', action='store_true',
+                        help='Compare against a baseline recorded on other hardware or with other settings')
+    parser.add_argument('--max-regression', type=float, default=None,
+                        help='Threshold for every metric, as a fraction of the baseline value')
+    parser.add_argument('--threshold', action='append', default=[], metavar='METRIC=FRACTION',
+                        help='Threshold of one metric, e.g. predict_p95_ms=0.3 (repeatable)')
+    args = parser.parse_args()
+
+    baseline = None
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+    thresholds = _thresholds(args, baseline)
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    algorithms = [a.strip() for a in args.algorithms.split(",") if a.strip()]
+    datasets = {rows: load_dataset(rows, args.seed, args.data_dir, args.max_generated_rows) for rows in sizes}
+
+    workdir = tempfile.mkdtemp(prefix="spp-benchmark-")
+    # Read by ml_backend at import. One training slot, so every run uses the same warmed-up worker;
+    # every prediction is scored, none served from the prediction cache
+    os.environ.update(API_KEY=API_KEY, MODELS_DIR=os.path.join(workdir, "models"),
+                      DATASETS_DIR=os.path.join(workdir, "datasets"), PRELOAD_MODELS="",
+                      PRELOAD_RECENT_PER_COURSE="0", PREDICTION_CACHE_MAX_ENTRIES="0", TRAINING_SLOTS="1")
+    from fastapi.testclient import TestClient
+    import ml_backend
+    from algorithms import OPTIONAL_LIBRARIES, is_available
+    from training_profile import TrainingProfile
+
+    results = {
+        "version": RESULTS_VERSION,
+        "created_at": datetime.now().isoformat(),
+        "seed": args.seed,
+        "settings": {"single_requests": args.single_requests, "batch_rows": args.batch_rows,
+                     "batch_requests": args.batch_requests, "compile_models": args.compile_models},
+        "environment": {"python": platform.python_version(), "platform": platform.platform(),
+                        "cpus": os.cpu_count()},
+        "cases": {},
+    }
+    with TestClient(ml_backend.app) as client:
+        # Start the training worker and import every algorithm's library before timing anything
+        warmup_path = load_dataset(WARMUP_ROWS, args.seed, args.data_dir, args.max_generated_rows)
+        for algorithm in algorithms:
+            if algorithm not in OPTIONAL_LIBRARIES or is_available(algorithm):
+                with contextlib.suppress(RuntimeError):
+                    train(client, warmup_path, 0, algorithm)
+        for courseid, (rows, dataset_path) in enumerate(datasets.items(), start=1):
+            df = pd.read_csv(dataset_path, nrows=max(args.batch_rows, args.single_requests))
+            records = json.loads(df.drop(columns=[TARGET_COLUMN]).to_json(orient="records"))
+            for algorithm in algorithms:
+                case = f"{rows}/{algorithm}"
+                if algorithm in OPTIONAL_LIBRARIES and not is_available(algorithm):
+                    results["cases"][case] = {"error": "not installed"}
+                    continue
+                print(f"Benchmarking {case}", file=sys.stderr)
+                try:
+                    results["cases"][case] = benchmark_case(client, dataset_path, courseid, algorithm,
+                                                            records, args, TrainingProfile)
+                except Exception as e:
+                    results["cases"][case] = {"error": f"{type(e).__name__}: {str(e)}"}
+
+    errors = {case: metrics["error"] for case, metrics in results["cases"].items()
+              if "error" in metrics and metrics["error"] != "not installed"}
+    if baseline is not None:
+        results["baseline"] = {"path": args.baseline, "created_at": baseline.get("created_at"),
+                               "thresholds": thresholds, "mismatches": mismatches(results, baseline)}
+        if results["baseline"]["mismatches"] and not args.force_compare:
+            print(f"Warning: not comparing against {args.baseline}, recorded with a different "
+                  f"{', '.join(results['baseline']['mismatches'])}; record a baseline here with "
+                  f"--save-baseline or pass --force-compare", file=sys.stderr)
+            results["baseline"]["skipped"] = True
+        else:
+            results["baseline"]["regressions"] = compare(results, baseline, thresholds)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=1)
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(args.baseline)), exist_ok=True)
+        with open(args.baseline, "w") as f:
+            json.dump(dict(results, cases=_baseline_cases(results["cases"]), thresholds=thresholds), f, indent=1)
+
+    regressions = results.get("baseline", {}).get("regressions", [])
+    print(json.dumps({"output": args.output, "cases": len(results["cases"]), "errors": errors,
+                      "baseline_skipped": results.get("baseline", {}).get("skipped", False),
+                      "regressions": regressions}, indent=1))
+    return 1 if regressions or errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
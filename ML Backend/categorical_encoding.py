@@ -0,0 +1,121 @@
+"""
+Categorical encoding for the training pipeline
+
+Categorical features are encoded by cardinality. Columns with few
+categories are one-hot encoded into a sparse matrix. Columns with many
+categories would add a column per category, so they are instead encoded
+into one column each (one per class for multiclass targets):
+
+- ``target``: the smoothed mean target of the category, fitted out of fold
+  on the training rows (scikit-learn's TargetEncoder), so a row's own
+  target never feeds its encoding.
+- ``frequency``: the category's share of the training rows.
+
+Near-unique text columns (emails, names) are dropped during feature
+screening (see feature_screening.py). The ColumnTransformer returns a
+sparse matrix when the one-hot columns make it sparse enough, and every
+supported algorithm is fitted on it as is.
+"""
+
+import logging
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+from sklearn.base import BaseEstimator, OneToOneFeatureMixin, TransformerMixin
+from sklearn.compose import ColumnTransformer
+from sklearn.impute import SimpleImputer
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import OneHotEncoder, RobustScaler, TargetEncoder
+from sklearn.utils.validation import check_is_fitted
+
+logger = logging.getLogger(__name__)
+
+HIGH_CARDINALITY_ENCODINGS = ("target", "frequency")
+# Categorical columns with more distinct values than this are not one-hot encoded
+ONEHOT_MAX_CATEGORIES = 15
+# ColumnTransformer output is sparse when less than this share of it is non-zero
+SPARSE_THRESHOLD = 0.3
+TARGET_ENCODER_FOLDS = 5
+
+
+class FrequencyEncoder(OneToOneFeatureMixin, TransformerMixin, BaseEstimator):
+    """Replace each category by its share of the training rows; unseen categories become 0."""
+
+    def fit(self, X: Any, y: Any = None) -> "FrequencyEncoder":
+        frame = self._frame(X)
+        self.n_features_in_ = frame.shape[1]
+        self.frequencies_ = [frame[col].value_counts(normalize=True, dropna=False).to_dict() for col in frame.columns]
+        return self
+
+    def transform(self, X: Any) -> np.ndarray:
+        check_is_fitted(self, "frequencies_")
+        frame = self._frame(X)
+        encoded = np.zeros(frame.shape, dtype=np.float32)
+        for i, col in enumerate(frame.columns):
+            encoded[:, i] = frame[col].map(self.frequencies_[i]).to_numpy(dtype=np.float32, na_value=0.0)
+        return encoded
+
+    @staticmethod
+    def _frame(X: Any) -> pd.DataFrame:
+        return X if isinstance(X, pd.DataFrame) else pd.DataFrame(np.asarray(X, dtype=object))
+
+
+def split_by_cardinality(X: pd.DataFrame, categorical_cols: List[str],
+                         max_onehot: int = ONEHOT_MAX_CATEGORIES) -> Tuple[List[str], Dict[str, int]]:
+    """One-hot columns, and the high-cardinality columns with their number of categories."""
+    onehot, high_cardinality = [], {}
+    for col in categorical_cols:
+        n_categories = int(X[col].nunique())
+        if n_categories > max_onehot:
+            high_cardinality[col] = n_categories
+        else:
+            onehot.append(col)
+    return onehot, high_cardinality
+
+
+def _high_cardinality_encoder(encoding: str) -> Any:
+    if encoding == "target":
+        return TargetEncoder(target_type="auto", cv=TARGET_ENCODER_FOLDS, shuffle=True, random_state=42)
+    if encoding == "frequency":
+        return FrequencyEncoder()
+    raise ValueError(f"Unknown high-cardinality encoding '{encoding}', expected one of {list(HIGH_CARDINALITY_ENCODINGS)}")
+
+
+def build_preprocessor(numeric_cols: List[str], onehot_cols: List[str], high_cardinality_cols: List[str],
+                       high_cardinality_encoding: str = "target") -> ColumnTransformer:
+    """ColumnTransformer for the training pipeline."""
+    transformers = [
+        ('num', Pipeline([
+            ('imputer', SimpleImputer(strategy='median')),
+            # Use RobustScaler for better handling of outliers
+            ('scaler', RobustScaler())
+        ]), numeric_cols),
+        ('cat', Pipeline([
+            ('imputer', SimpleImputer(strategy='most_frequent')),
+            ('encoder', OneHotEncoder(drop='first', sparse_output=True, handle_unknown='ignore', dtype=np.float32))
+        ]), onehot_cols)
+    ]
+    if high_cardinality_cols:
+        transformers.append(('cat_high', Pipeline([
+            ('imputer', SimpleImputer(strategy='most_frequent')),
+            ('encoder', _high_cardinality_encoder(high_cardinality_encoding))
+        ]), high_cardinality_cols))
+    return ColumnTransformer(transformers=transformers, remainder='drop', sparse_threshold=SPARSE_THRESHOLD)
+
+
+def encoding_summary(preprocessor: ColumnTransformer, onehot_cols: List[str], high_cardinality: Dict[str, int],
+                     high_cardinality_encoding: str) -> Dict[str, Any]:
+    """How a fitted preprocessor encodes the categorical columns and the shape of its output."""
+    try:
+        width = len(preprocessor.get_feature_names_out())
+    except Exception:
+        width = None
+    return {
+        "onehot_columns": list(onehot_cols),
+        "high_cardinality_columns": dict(high_cardinality),
+        "high_cardinality_encoding": high_cardinality_encoding if high_cardinality else None,
+        "onehot_max_categories": ONEHOT_MAX_CATEGORIES,
+        "sparse_output": bool(getattr(preprocessor, "sparse_output_", False)),
+        "output_features": width,
+    }
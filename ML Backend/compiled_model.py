@@ -0,0 +1,429 @@
+"""
+Compiled inference for tree-ensemble models
+
+After training, the fitted preprocessor, the RandomForest / ExtraTrees
+trees and the sigmoid calibrators of a pipeline can be exported into flat
+NumPy arrays. The CompiledModel evaluates those arrays directly, walking all
+trees of all calibration folds for all rows together, which avoids
+scikit-learn's per-call validation and thread dispatch overhead for the
+small batches the API serves. Large batches are better served by
+scikit-learn's multithreaded predict, so callers route by batch size.
+
+An export is only kept if its probabilities match the scikit-learn pipeline
+within ``PARITY_TOLERANCE`` on a check sample.
+"""
+
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# 2: the trees of all members are stored as one set of flat node arrays
+COMPILED_VERSION = 2
+PARITY_TOLERANCE = 1e-6
+# Rows evaluated together; bounds the (rows x trees) working arrays
+ROW_BLOCK_SIZE = 1024
+
+
+class CompileError(ValueError):
+    """The pipeline contains a step the compiled engine does not support."""
+
+
+# --------------------------------------------------------------------------- #
+# Export                                                                      #
+# --------------------------------------------------------------------------- #
+
+def _export_step(step: Any) -> Dict[str, Any]:
+    name = type(step).__name__
+    if name == "SimpleImputer":
+        statistics = np.asarray(step.statistics_)
+        if statistics.dtype.kind == "f":
+            keep = ~np.isnan(statistics)
+        else:
+            keep = ~pd.isna(statistics)
+        if getattr(step, "add_indicator", False):
+            raise CompileError("SimpleImputer with add_indicator is not supported")
+        if getattr(step, "keep_empty_features", False):
+            keep = np.ones_like(keep, dtype=bool)
+        return {"op": "impute", "fill": statistics, "keep": keep.astype(bool)}
+    if name == "RobustScaler":
+        return {"op": "scale", "center": step.center_, "scale": step.scale_}
+    if name == "StandardScaler":
+        return {"op": "scale", "center": step.mean_ if step.with_mean else None, "scale": step.scale_}
+    if name == "OneHotEncoder":
+        # Sparse output is evaluated densely; the values the trees see are the same
+        if getattr(step, "_infrequent_enabled", False):
+            raise CompileError("OneHotEncoder infrequent categories are not supported")
+        if step.handle_unknown not in ("ignore", "infrequent_if_exist", "warn"):
+            # handle_unknown='error' raises in scikit-learn; keep that behaviour there
+            raise CompileError(f"OneHotEncoder handle_unknown='{step.handle_unknown}' is not supported")
+        drop_idx = getattr(step, "drop_idx_", None)
+        tables, width = [], 0
+        for i, categories in enumerate(step.categories_):
+            dropped = None if drop_idx is None or drop_idx[i] is None else int(drop_idx[i])
+            table = {}
+            for j, category in enumerate(categories.tolist()):
+                if j == dropped:
+                    continue
+                table[category] = width
+                width += 1
+            tables.append(table)
+        return {"op": "onehot", "tables": tables, "width": width}
+    if name == "TargetEncoder":
+        n_classes = len(step.classes_) if step.target_type_ == "multiclass" else 1
+        fallback = np.atleast_1d(np.asarray(step.target_mean_, dtype=np.float64))
+        tables = []
+        for i, categories in enumerate(step.categories_):
+            # encodings_ holds one array per (feature, class) for multiclass targets
+            encodings = np.column_stack([step.encodings_[i * n_classes + k] for k in range(n_classes)])
+            tables.append({category: encodings[j] for j, category in enumerate(categories.tolist())})
+        return {"op": "lookup", "tables": tables, "defaults": [fallback] * len(tables), "columns_per_feature": n_classes}
+    if name == "FrequencyEncoder":
+        tables = [{category: np.array([frequency]) for category, frequency in frequencies.items()}
+                  for frequencies in step.frequencies_]
+        return {"op": "lookup", "tables": tables, "defaults": [np.zeros(1)] * len(tables), "columns_per_feature": 1}
+    raise CompileError(f"Preprocessing step {name} is not supported")
+
+
+def _export_preprocessor(preprocessor: Any) -> List[Dict[str, Any]]:
+    if type(preprocessor).__name__ != "ColumnTransformer":
+        raise CompileError("Only ColumnTransformer preprocessors are supported")
+    blocks = []
+    for name, transformer, columns in preprocessor.transformers_:
+        if transformer == "drop" or len(columns) == 0:
+            continue
+        if transformer == "passthrough":
+            raise CompileError(f"Passthrough columns ('{name}') are not supported")
+        steps = transformer.steps if hasattr(transformer, "steps") else [(name, transformer)]
+        blocks.append({
+            "name": name,
+            "columns": [str(c) for c in columns],
+            "steps": [_export_step(step) for _, step in steps],
+        })
+    return blocks
+
+
+def _export_forest(forest: Any) -> Dict[str, Any]:
+    name = type(forest).__name__
+    if name not in ("RandomForestClassifier", "ExtraTreesClassifier"):
+        raise CompileError(f"Classifier {name} is not supported")
+    if getattr(forest, "n_outputs_", 1) != 1:
+        raise CompileError("Multi-output forests are not supported")
+    left, right, feature, threshold, value, roots = [], [], [], [], [], []
+    offset = 0
+    for tree in forest.estimators_:
+        t = tree.tree_
+        is_leaf = t.children_left == -1
+        node_ids = np.arange(t.node_count)
+        # Leaves point at themselves, which is how the evaluator recognises them
+        left.append(np.where(is_leaf, node_ids, t.children_left) + offset)
+        right.append(np.where(is_leaf, node_ids, t.children_right) + offset)
+        feature.append(np.where(is_leaf, 0, t.feature))
+        threshold.append(np.where(is_leaf, np.inf, t.threshold))
+        leaf_value = t.value[:, 0, :].astype(np.float64)
+        totals = leaf_value.sum(axis=1, keepdims=True)
+        totals[totals == 0.0] = 1.0
+        value.append(leaf_value / totals)
+        roots.append(offset)
+        offset += t.node_count
+    return {
+        "left": np.concatenate(left).astype(np.int32),
+        "right": np.concatenate(right).astype(np.int32),
+        "feature": np.concatenate(feature).astype(np.int32),
+        "threshold": np.concatenate(threshold).astype(np.float64),
+        "value": np.concatenate(value),
+        "roots": np.asarray(roots, dtype=np.int32),
+        "classes": np.asarray(forest.classes_),
+    }
+
+
+def _export_calibrated(calibrated: Any) -> List[Dict[str, Any]]:
+    members = []
+    classes = list(calibrated.classes_)
+    for member in calibrated.calibrated_classifiers_:
+        if getattr(member, "method", "sigmoid") != "sigmoid":
+            raise CompileError(f"Calibration method '{member.method}' is not supported")
+        estimator = getattr(member, "estimator", None) or getattr(member, "base_estimator", None)
+        if type(estimator).__name__ == "FrozenEstimator":
+            # Calibrators refitted around an already fitted model (see retraining.py)
+            estimator = estimator.estimator
+        forest = _export_forest(estimator)
+        # Column of the forest output fed to each calibrator and the class it calibrates
+        targets = [classes.index(c) for c in forest["classes"].tolist()]
+        if len(classes) == 2:
+            columns, targets = [1], [1]
+        else:
+            columns = list(range(len(targets)))
+        calibrators = []
+        for column, target, calibrator in zip(columns, targets, member.calibrators):
+            if not hasattr(calibrator, "a_"):
+                raise CompileError(f"Calibrator {type(calibrator).__name__} is not supported")
+            calibrators.append((column, target, float(calibrator.a_), float(calibrator.b_)))
+        members.append({"forest": forest, "calibrators": calibrators})
+    return members
+
+
+def _flatten_members(members: List[Dict[str, Any]]) -> Dict[str, np.ndarray]:
+    """One set of node arrays for the trees of all members, in member order."""
+    left, right, feature, threshold, value, roots = [], [], [], [], [], []
+    offset = 0
+    for member in members:
+        forest = member["forest"]
+        left.append(forest["left"] + offset)
+        right.append(forest["right"] + offset)
+        feature.append(forest["feature"])
+        threshold.append(forest["threshold"])
+        value.append(forest["value"])
+        roots.append(forest["roots"] + offset)
+        offset += len(forest["left"])
+    left, right = np.concatenate(left), np.concatenate(right)
+    return {
+        "children": np.stack([left, right], axis=1).ravel(),
+        "is_leaf": left == np.arange(len(left)),
+        "feature": np.concatenate(feature),
+        "threshold": np.concatenate(threshold),
+        "value": np.concatenate(value),
+        "roots": np.concatenate(roots),
+        "tree_counts": np.array([len(m["forest"]["roots"]) for m in members]),
+    }
+
+
+# --------------------------------------------------------------------------- #
+# Evaluation                                                                  #
+# --------------------------------------------------------------------------- #
+
+class CompiledModel:
+    """
+    Array-only evaluator for an exported preprocessor + forest (+ calibrators).
+
+    The trees of all members are walked together from one set of flat node
+    arrays (``nodes``). They are built from the members' forests, or passed
+    in as they were stored (possibly memory-mapped, see model_artifact.py),
+    in which case the members only carry their calibrators.
+    """
+
+    def __init__(self, blocks: List[Dict[str, Any]], members: List[Dict[str, Any]],
+                 classes: np.ndarray, calibrated: bool, parity: Optional[Dict[str, Any]] = None,
+                 nodes: Optional[Dict[str, np.ndarray]] = None):
+        self.blocks = blocks
+        self.members = [{"calibrators": member["calibrators"]} for member in members]
+        self.classes_ = np.asarray(classes)
+        self.calibrated = calibrated
+        self.parity = parity or {}
+        if nodes is None:
+            nodes = _flatten_members(members)
+        self.nodes = nodes
+        self._feature = nodes["feature"]
+        self._threshold = nodes["threshold"]
+        self._value = nodes["value"]
+        self._roots = nodes["roots"]
+        self._is_leaf = nodes["is_leaf"]
+        # children[2 * node + go_right]
+        self._children = nodes["children"]
+        self._tree_counts = np.asarray(nodes["tree_counts"])
+        self._member_starts = np.concatenate([[0], np.cumsum(self._tree_counts)[:-1]])
+
+    @classmethod
+    def from_pipeline(cls, pipeline: Any) -> "CompiledModel":
+        """Export the calibrated pipeline of a trained model, or the plain pipeline if it has none."""
+        target = getattr(pipeline, "calibrated_pipeline", None) or pipeline
+        steps = dict(target.named_steps)
+        blocks = _export_preprocessor(steps["preprocessor"])
+        if "calibrated_classifier" in steps:
+            calibrated = steps["calibrated_classifier"]
+            return cls(blocks, _export_calibrated(calibrated), calibrated.classes_, calibrated=True)
+        forest = _export_forest(steps["classifier"])
+        return cls(blocks, [{"forest": forest, "calibrators": None}], forest["classes"], calibrated=False)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "CompiledModel":
+        version = data.get("version")
+        if version == 1:
+            # Per-member forests, flattened on load
+            return cls(data["blocks"], data["members"], data["classes"], data["calibrated"], data.get("parity"))
+        if version != COMPILED_VERSION:
+            raise CompileError(f"Unsupported compiled model version {version}")
+        return cls(data["blocks"], data["members"], data["classes"], data["calibrated"], data.get("parity"),
+                   nodes=data["nodes"])
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "version": COMPILED_VERSION,
+            "blocks": self.blocks,
+            "members": self.members,
+            "nodes": self.nodes,
+            "classes": self.classes_,
+            "calibrated": self.calibrated,
+            "parity": self.parity,
+        }
+
+    @property
+    def n_trees(self) -> int:
+        return int(self._tree_counts.sum())
+
+    @property
+    def n_nodes(self) -> int:
+        return int(len(self._feature))
+
+    def transform(self, X: pd.DataFrame) -> np.ndarray:
+        """Preprocessed float32 feature matrix, as the trees see it."""
+        outputs = []
+        for block in self.blocks:
+            values = X[block["columns"]].to_numpy()
+            for step in block["steps"]:
+                values = _apply_step(step, values)
+            outputs.append(np.asarray(values, dtype=np.float64))
+        matrix = np.hstack(outputs) if outputs else np.empty((len(X), 0))
+        # scikit-learn trees compare float32 inputs against float64 thresholds
+        return matrix.astype(np.float32)
+
+    def predict_proba(self, X: pd.DataFrame) -> np.ndarray:
+        features = self.transform(X)
+        if len(features) <= ROW_BLOCK_SIZE:
+            return self._predict_proba_block(features)
+        return np.vstack([
+            self._predict_proba_block(features[start:start + ROW_BLOCK_SIZE])
+            for start in range(0, len(features), ROW_BLOCK_SIZE)
+        ])
+
+    def predict(self, X: pd.DataFrame) -> np.ndarray:
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
+
+    def _leaves(self, features: np.ndarray) -> np.ndarray:
+        """Leaf node reached by every (row, tree) pair, shape (rows, trees)."""
+        n_rows, n_features = features.shape
+        n_trees = len(self._roots)
+        flat = np.ascontiguousarray(features).ravel()
+        nodes = np.tile(self._roots, n_rows)
+        leaves = nodes.copy()
+        # Only (row, tree) pairs that have not reached a leaf are advanced
+        base = np.repeat(np.arange(n_rows) * n_features, n_trees)
+        position = np.arange(len(nodes))
+        while len(nodes):
+            go_right = ~(flat[base + self._feature[nodes]] <= self._threshold[nodes])
+            nodes = self._children[2 * nodes + go_right]
+            done = self._is_leaf[nodes]
+            if done.any():
+                leaves[position[done]] = nodes[done]
+                active = ~done
+                nodes, base, position = nodes[active], base[active], position[active]
+        return leaves.reshape(n_rows, n_trees)
+
+    def _predict_proba_block(self, features: np.ndarray) -> np.ndarray:
+        n_rows = len(features)
+        # (rows, trees, classes) -> per-member mean over its trees
+        leaf_values = self._value[self._leaves(features)]
+        member_probs = np.add.reduceat(leaf_values, self._member_starts, axis=1) / self._tree_counts[None, :, None]
+
+        proba = np.zeros((n_rows, len(self.classes_)))
+        for i, member in enumerate(self.members):
+            forest_proba = member_probs[:, i, :]
+            if member["calibrators"] is None:
+                proba += forest_proba
+                continue
+            proba += _calibrate(forest_proba, member["calibrators"], len(self.classes_))
+        proba /= len(self.members)
+        return proba
+
+
+def _apply_step(step: Dict[str, Any], values: np.ndarray) -> np.ndarray:
+    op = step["op"]
+    if op == "impute":
+        fill, keep = step["fill"], step["keep"]
+        if fill.dtype.kind == "f":
+            values = values.astype(np.float64)
+            missing = np.isnan(values)
+        else:
+            values = values.astype(object)
+            missing = pd.isna(values)
+        if missing.any():
+            values = np.where(missing, fill[None, :], values)
+        return values if keep.all() else values[:, keep]
+    if op == "scale":
+        values = values.astype(np.float64)
+        if step["center"] is not None:
+            values = values - step["center"]
+        if step["scale"] is not None:
+            values = values / step["scale"]
+        return values
+    if op == "onehot":
+        encoded = np.zeros((len(values), step["width"]))
+        for i, table in enumerate(step["tables"]):
+            for row, value in enumerate(values[:, i].tolist()):
+                column = table.get(value)
+                if column is not None:
+                    encoded[row, column] = 1.0
+        return encoded
+    if op == "lookup":
+        width = step["columns_per_feature"]
+        encoded = np.empty((len(values), width * len(step["tables"])))
+        for i, (table, default) in enumerate(zip(step["tables"], step["defaults"])):
+            encoded[:, i * width:(i + 1) * width] = [table.get(value, default) for value in values[:, i].tolist()]
+        return encoded
+    raise CompileError(f"Unknown compiled step '{op}'")
+
+
+def _calibrate(forest_proba: np.ndarray, calibrators: List[Tuple[int, int, float, float]], n_classes: int) -> np.ndarray:
+    proba = np.zeros((len(forest_proba), n_classes))
+    for column, target, a, b in calibrators:
+        proba[:, target] = 1.0 / (1.0 + np.exp(a * forest_proba[:, column] + b))
+    if n_classes == 2:
+        proba[:, 0] = 1.0 - proba[:, 1]
+    else:
+        denominator = proba.sum(axis=1, keepdims=True)
+        proba = np.divide(proba, denominator, out=np.full_like(proba, 1.0 / n_classes), where=denominator != 0)
+    proba[(1.0 < proba) & (proba <= 1.0 + 1e-5)] = 1.0
+    return proba
+
+
+# --------------------------------------------------------------------------- #
+# Export with parity check                                                    #
+# --------------------------------------------------------------------------- #
+
+def export_compiled_model(pipeline: Any, X_check: pd.DataFrame,
+                          tolerance: float = PARITY_TOLERANCE) -> Tuple[Optional[Dict[str, Any]], Dict[str, Any]]:
+    """
+    Compile a trained pipeline and check it against scikit-learn on ``X_check``.
+
+    Returns ``(compiled_dict, parity_report)``. ``compiled_dict`` is None when
+    the pipeline cannot be compiled or its probabilities differ from the
+    scikit-learn pipeline by more than ``tolerance``.
+    """
+    report = {"compiled": False, "tolerance": tolerance, "rows_checked": int(len(X_check))}
+    try:
+        compiled = CompiledModel.from_pipeline(pipeline)
+    except CompileError as e:
+        report["reason"] = str(e)
+        logger.info(f"Model not compiled: {str(e)}")
+        return None, report
+
+    reference_pipeline = getattr(pipeline, "calibrated_pipeline", None) or pipeline
+    expected = reference_pipeline.predict_proba(X_check)
+    actual = compiled.predict_proba(X_check)
+    max_abs_diff = float(np.max(np.abs(expected - actual))) if len(X_check) else 0.0
+    report.update(max_abs_diff=max_abs_diff, n_trees=compiled.n_trees, n_nodes=compiled.n_nodes)
+    if len(X_check) == 0 or not max_abs_diff <= tolerance:
+        report["reason"] = "no rows to check" if len(X_check) == 0 else "parity check failed"
+        logger.warning(f"Compiled model rejected: {report['reason']} (max abs diff {max_abs_diff:.3g})")
+        return None, report
+
+    report["compiled"] = True
+    compiled.parity = report
+    logger.info(f"Compiled model: {compiled.n_trees} trees, {compiled.n_nodes} nodes, max abs diff {max_abs_diff:.3g}")
+    return compiled.to_dict(), report
+
+
+def get_compiled_model(model_data: Dict[str, Any]) -> Optional[CompiledModel]:
+    """Compiled engine for a loaded model, built once and kept alongside it; None if it has none."""
+    if "_compiled_engine" not in model_data:
+        engine = None
+        if model_data.get("compiled_model"):
+            try:
+                engine = CompiledModel.from_dict(model_data["compiled_model"])
+            except (CompileError, KeyError) as e:
+                logger.warning(f"Ignoring unusable compiled model: {str(e)}")
+        model_data["_compiled_engine"] = engine
+    return model_data["_compiled_engine"]
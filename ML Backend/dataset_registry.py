@@ -0,0 +1,255 @@
+"""
+Dataset registry for the Student Performance Predictor API
+
+Training datasets are stored once under the hash of their content, course
+and ingestion options, so /train can refer to a dataset by ID instead of
+receiving the whole file again. Every upload is parsed once per set of
+ingestion options (see ingestion.py) and kept as a Parquet segment; a
+dataset is an ordered list of segments. Appending rows creates a
+new dataset from the parent's segments plus one new segment, and the parent
+stays unchanged. Feature screening results are cached per dataset and
+screening options.
+
+Layout of DATASETS_DIR::
+
+    segments/<sha256 of the uploaded bytes and ingestion options>.parquet
+    <dataset_id>.json                  dataset metadata
+    screening/<dataset_id>-<key>.json  cached screening results
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from feature_screening import SCREENING_VERSION
+from ingestion import PeakMemory, concat_chunks, dataset_format, read_dataset
+from model_registry import atomic_write_json, to_jsonable
+
+logger = logging.getLogger(__name__)
+
+SEGMENTS_DIRNAME = "segments"
+SCREENING_DIRNAME = "screening"
+_ID_LENGTH = 32
+_HASH_CHUNK_BYTES = 1024 * 1024
+
+
+class DatasetError(ValueError):
+    """A dataset request that cannot be served; carries the HTTP status code."""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def save_hashed(upload: Any, path: str) -> str:
+    """Copy an uploaded file to ``path`` and return the SHA-256 of its bytes."""
+    digest = hashlib.sha256()
+    source = upload.file
+    source.seek(0)
+    with open(path, "wb") as target:
+        while True:
+            block = source.read(_HASH_CHUNK_BYTES)
+            if not block:
+                break
+            digest.update(block)
+            target.write(block)
+    return digest.hexdigest()
+
+
+def ingestion_options(dtypes: Optional[Dict[str, str]], compact: bool) -> Dict[str, Any]:
+    """The options an upload is parsed with, which its segment depends on."""
+    return {"dtypes": dict(sorted((dtypes or {}).items())), "compact": bool(compact)}
+
+
+def _options_hash(content_hash: str, options: Dict[str, Any]) -> str:
+    payload = json.dumps(options, sort_keys=True)
+    return hashlib.sha256(f"{content_hash}:{payload}".encode("utf-8")).hexdigest()
+
+
+def screening_key(options: Dict[str, Any]) -> str:
+    """Cache key of a set of screening options."""
+    payload = json.dumps(dict(options, version=SCREENING_VERSION), sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+class DatasetRegistry:
+    """Content-addressed, append-only store of parsed training datasets."""
+
+    def __init__(self, datasets_dir: str):
+        self.datasets_dir = datasets_dir
+        self.segments_dir = os.path.join(datasets_dir, SEGMENTS_DIRNAME)
+        self.screening_dir = os.path.join(datasets_dir, SCREENING_DIRNAME)
+
+    def _meta_path(self, dataset_id: str) -> str:
+        if not dataset_id.isalnum():
+            raise DatasetError(400, f"Invalid dataset ID {dataset_id}")
+        return os.path.join(self.datasets_dir, f"{dataset_id}.json")
+
+    def _segment_path(self, segment: str) -> str:
+        return os.path.join(self.segments_dir, f"{segment}.parquet")
+
+    def get(self, dataset_id: str) -> Optional[Dict[str, Any]]:
+        """Metadata of a dataset, or None if it is unknown."""
+        try:
+            with open(self._meta_path(dataset_id), "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def list(self, course_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        datasets = []
+        for filename in sorted(os.listdir(self.datasets_dir)) if os.path.isdir(self.datasets_dir) else []:
+            if not filename.endswith(".json"):
+                continue
+            meta = self.get(filename[:-len(".json")])
+            if meta and (course_id is None or meta.get("course_id") == course_id):
+                datasets.append(meta)
+        return sorted(datasets, key=lambda m: m["created_at"], reverse=True)
+
+    def add(self, path: str, filename: str, content_hash: str, course_id: Optional[int] = None,
+            parent_id: Optional[str] = None, dtypes: Optional[Dict[str, str]] = None,
+            compact: bool = True) -> Tuple[Dict[str, Any], bool]:
+        """
+        Register the dataset file at ``path``, or append its rows to ``parent_id``.
+
+        Returns the dataset metadata and whether an identical dataset (same
+        content, course and ingestion options) was already registered, in
+        which case the file is not parsed again.
+        """
+        options = ingestion_options(dtypes, compact)
+        segment = _options_hash(content_hash, options)
+        parent = None
+        if parent_id is not None:
+            parent = self.get(parent_id)
+            if parent is None:
+                raise DatasetError(404, f"Dataset with ID {parent_id} not found")
+            course_id = parent.get("course_id")
+            key = f"{parent_id}:{segment}"
+        else:
+            key = f"{course_id}:{segment}"
+        dataset_id = hashlib.sha256(key.encode("utf-8")).hexdigest()[:_ID_LENGTH]
+
+        existing = self.get(dataset_id)
+        if existing is not None:
+            logger.info(f"Dataset {dataset_id} already registered, skipping parse")
+            return existing, True
+
+        if dataset_format(filename) is None:
+            raise DatasetError(400, f"Unsupported file format: {os.path.splitext(filename)[1].lower()}")
+        os.makedirs(self.segments_dir, exist_ok=True)
+        segment_path = self._segment_path(segment)
+        ingestion, df = None, None
+        if os.path.exists(segment_path):
+            # The same file was parsed the same way before, possibly for another dataset or course
+            columns, segment_dtypes, rows = self._segment_schema(segment_path)
+        else:
+            try:
+                df, ingestion = read_dataset(path, filename, dtypes=dtypes, compact=compact)
+            except Exception as e:
+                raise DatasetError(400, f"Error loading dataset: {str(e)}")
+            columns = [str(c) for c in df.columns]
+            segment_dtypes = {str(c): str(t) for c, t in df.dtypes.items()}
+            rows = len(df)
+        if parent is not None:
+            extra = sorted(set(columns) - set(parent["columns"]))
+            absent = sorted(set(parent["columns"]) - set(columns))
+            if extra or absent:
+                raise DatasetError(400, f"Appended rows must have the dataset's columns "
+                                        f"(unexpected: {extra}, missing: {absent})")
+        if df is not None:
+            self._write_segment(df, segment_path)
+            del df
+
+        segments = (parent["segments"] if parent else []) + [segment]
+        meta = {
+            "dataset_id": dataset_id,
+            "parent_id": parent_id,
+            "course_id": course_id,
+            "filename": filename,
+            "segments": segments,
+            "rows": (parent["rows"] if parent else 0) + rows,
+            "appended_rows": rows if parent else None,
+            "columns": parent["columns"] if parent else columns,
+            "dtypes": parent["dtypes"] if parent else segment_dtypes,
+            "size_bytes": sum(os.path.getsize(self._segment_path(s)) for s in segments),
+            "created_at": datetime.now().isoformat(),
+            "ingestion": ingestion,
+            "ingestion_options": options,
+        }
+        os.makedirs(self.datasets_dir, exist_ok=True)
+        atomic_write_json(self._meta_path(dataset_id), to_jsonable(meta))
+        logger.info(f"Registered dataset {dataset_id} with {meta['rows']} rows in {len(segments)} segments")
+        return meta, False
+
+    def load_frame(self, dataset_id: str) -> Tuple[pd.DataFrame, Dict[str, Any]]:
+        """Read a dataset's segments back into one frame; returns it with an ingestion report."""
+        import pyarrow.parquet as pq
+
+        meta = self.get(dataset_id)
+        if meta is None:
+            raise DatasetError(404, f"Dataset with ID {dataset_id} not found")
+        start = time.time()
+        with PeakMemory() as memory:
+            frames = []
+            for segment in meta["segments"]:
+                path = self._segment_path(segment)
+                if not os.path.exists(path):
+                    raise DatasetError(410, f"Segment {segment} of dataset {dataset_id} is missing")
+                frames.append(pq.read_table(path).to_pandas())
+            df = concat_chunks(frames)[meta["columns"]]
+            del frames
+        report = {
+            "format": "registry",
+            "dataset_id": dataset_id,
+            "segments": len(meta["segments"]),
+            "rows": int(len(df)),
+            "columns": int(len(df.columns)),
+            "dtypes": {str(dtype): int(count) for dtype, count in df.dtypes.astype(str).value_counts().items()},
+            "dataframe_mb": round(int(df.memory_usage(deep=True).sum()) / (1024 * 1024), 2),
+            "read_seconds": round(time.time() - start, 3),
+        }
+        report.update(memory.report())
+        return df, report
+
+    def get_screening(self, dataset_id: str, options: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Cached screening results of a dataset for the given options, or None."""
+        path = os.path.join(self.screening_dir, f"{dataset_id}-{screening_key(options)}.json")
+        try:
+            with open(path, "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Unreadable screening cache {path}: {str(e)}")
+            return None
+
+    def put_screening(self, dataset_id: str, options: Dict[str, Any], screening: Dict[str, Any]) -> None:
+        os.makedirs(self.screening_dir, exist_ok=True)
+        path = os.path.join(self.screening_dir, f"{dataset_id}-{screening_key(options)}.json")
+        atomic_write_json(path, to_jsonable(screening))
+
+    def _segment_schema(self, path: str) -> Tuple[List[str], Dict[str, str], int]:
+        import pyarrow.parquet as pq
+
+        parquet = pq.ParquetFile(path)
+        schema = parquet.schema_arrow.empty_table().to_pandas()
+        return list(map(str, schema.columns)), {str(c): str(t) for c, t in schema.dtypes.items()}, parquet.metadata.num_rows
+
+    def _write_segment(self, df: pd.DataFrame, path: str) -> None:
+        fd, tmp_path = tempfile.mkstemp(dir=self.segments_dir, prefix=".tmp-", suffix=".parquet")
+        os.close(fd)
+        try:
+            df.to_parquet(tmp_path, index=False)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
@@ -0,0 +1,252 @@
+"""
+Feature screening for the Student Performance Predictor API
+
+Decides which columns training drops before it builds the feature matrix:
+columns with too many missing values, leaky columns (by name, or by their
+correlation with the target), constant columns, near-unique text columns
+such as emails, and columns highly correlated with an earlier feature.
+
+The numeric columns are screened in two passes over blocks of rows, each
+block converted to float32 once: the first collects missing counts, sums,
+minima and maxima per column, the second accumulates the centred cross
+products of all columns with each other and with the target. One matrix
+product per block replaces a pandas ``corr()`` in float64 and the Python
+loops over columns. Missing values count as the column mean in the
+correlations, so the pairs are not restricted to rows where both are present.
+"""
+
+import logging
+import re
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Bump when screening decisions change, so results cached by older code are not reused
+SCREENING_VERSION = 3
+
+MISSING_THRESHOLD = 0.5
+# Features correlated with the target beyond this are treated as leaky
+TARGET_CORRELATION_THRESHOLD = 0.9
+# A feature correlated beyond this with an earlier feature is dropped
+CORRELATION_THRESHOLD = 0.85
+# Correlation pruning only runs with more numeric features than this
+MIN_FEATURES_FOR_PRUNING = 10
+# Target correlation is only checked with more rows than this
+MIN_ROWS_FOR_TARGET_CORRELATION = 10
+# Text / categorical columns with more distinct values than this share of their rows (and at
+# least NEAR_UNIQUE_MIN_VALUES of them) identify rows rather than describe them
+NEAR_UNIQUE_RATIO = 0.5
+NEAR_UNIQUE_MIN_VALUES = 20
+# Rows per block are chosen so a float32 block stays around this size
+BLOCK_BYTES = 32 * 1024 * 1024
+
+# Known patterns for leaky features
+LEAKY_PATTERNS = [
+    r'final.*score',
+    r'final.*grade',
+    r'letter_grade',
+    r'pass[_\s]?fail',
+    r'outcome',
+    r'result',
+    r'grade$',
+    r'total.*grade',
+    r'overall.*score',
+    r'final.*result',
+    r'completion.*status'
+]
+_LEAKY_NAME = re.compile("|".join(f"(?:{pattern})" for pattern in LEAKY_PATTERNS))
+
+
+def missing_columns(df: pd.DataFrame, threshold: float = MISSING_THRESHOLD) -> Dict[str, float]:
+    """Columns with more than ``threshold`` missing values, with their missing fraction."""
+    if not len(df):
+        return {}
+    missing = df.isna().mean()
+    return {str(col): round(float(fraction), 4) for col, fraction in missing[missing > threshold].items()}
+
+
+def leaky_names(columns: Sequence[Any]) -> List[Any]:
+    """Columns whose name matches one of the known leaky patterns."""
+    return [col for col in columns if _LEAKY_NAME.search(str(col).lower())]
+
+
+def _block_rows(n_columns: int) -> int:
+    return max(1024, BLOCK_BYTES // (4 * max(n_columns, 1)))
+
+
+def column_statistics(df: pd.DataFrame, columns: List[Any],
+                      target: Optional[np.ndarray] = None) -> Dict[str, np.ndarray]:
+    """
+    Missing counts, means and correlations of numeric columns in blocked float32 passes.
+
+    Returns ``missing``, ``mean`` and ``varying`` (more than one distinct
+    value) per column, the column x column correlation matrix under
+    ``correlation`` and, with a numeric ``target``, each column's
+    correlation with it under ``target_correlation``. Columns that do not
+    vary have zero correlations.
+    """
+    n_rows, n_columns = len(df), len(columns)
+    block = _block_rows(n_columns)
+    frame = df[columns]
+
+    def blocks():
+        for start in range(0, n_rows, block):
+            # A copy, so centring in place never writes through to a float32 column of ``df``
+            yield start, frame.iloc[start:start + block].to_numpy(dtype=np.float32, na_value=np.nan, copy=True)
+
+    missing = np.zeros(n_columns, dtype=np.int64)
+    sums = np.zeros(n_columns)
+    minimum = np.full(n_columns, np.inf, dtype=np.float32)
+    maximum = np.full(n_columns, -np.inf, dtype=np.float32)
+    for _, values in blocks():
+        missing += np.isnan(values).sum(axis=0)
+        sums += np.nansum(values, axis=0, dtype=np.float64)
+        # fmin / fmax skip missing values
+        minimum = np.fmin(minimum, np.fmin.reduce(values, axis=0))
+        maximum = np.fmax(maximum, np.fmax.reduce(values, axis=0))
+    present = n_rows - missing
+    mean = np.divide(sums, present, out=np.zeros(n_columns), where=present > 0)
+
+    mean32 = mean.astype(np.float32)
+    cross = np.zeros((n_columns, n_columns), dtype=np.float32)
+    if target is not None:
+        target_centred = np.asarray(target, dtype=np.float64)
+        target_centred = (target_centred - target_centred.mean()).astype(np.float32)
+        target_cross = np.zeros(n_columns, dtype=np.float32)
+    for start, values in blocks():
+        values -= mean32
+        np.nan_to_num(values, copy=False, nan=0.0)
+        cross += values.T @ values
+        if target is not None:
+            target_cross += values.T @ target_centred[start:start + block]
+
+    norm = np.sqrt(np.clip(np.diag(cross), 0, None))
+    varying = (maximum > minimum) & (norm > 0)
+    scale = np.divide(1.0, norm, out=np.zeros(n_columns, dtype=np.float32), where=varying)
+    # Scale the cross products into correlations in place
+    cross *= scale[:, None]
+    cross *= scale[None, :]
+    stats = {"missing": missing, "mean": mean, "varying": varying, "correlation": cross}
+    if target is not None:
+        target_norm = float(np.sqrt(target_centred.astype(np.float64) @ target_centred))
+        stats["target_correlation"] = (target_cross * scale / target_norm
+                                       if target_norm > 0 else np.zeros(n_columns, dtype=np.float32))
+    return stats
+
+
+def correlated_columns(correlation: np.ndarray, threshold: float = CORRELATION_THRESHOLD) -> Dict[int, int]:
+    """
+    Columns correlated beyond ``threshold`` with an earlier column, as column -> earlier column.
+
+    Each column is checked against every column before it, whether or not
+    that column is itself dropped; the earlier column with the strongest
+    correlation is reported.
+    """
+    upper = np.triu(np.abs(correlation), k=1)
+    strongest = upper.argmax(axis=0)
+    flagged = np.flatnonzero(upper[strongest, np.arange(len(upper))] > threshold)
+    return {int(j): int(strongest[j]) for j in flagged}
+
+
+def screen(df: pd.DataFrame, target_column: str, id_columns: Sequence[str],
+           target: Optional[np.ndarray] = None) -> Dict[str, Any]:
+    """
+    Screen the feature columns of ``df`` against ``target_column``.
+
+    ``target`` is the encoded (numeric) target used for the correlation
+    leakage check. Returns the dropped columns by reason, plus a ``report``
+    with the thresholds, the reason for every dropped column and the time
+    each pass took.
+    """
+    timings = {}
+    start = time.time()
+    excluded = set(id_columns) | {target_column}
+    features = [col for col in df.columns if col not in excluded]
+    leaky = leaky_names(features)
+    leaky_set = set(leaky)
+    details = {col: {"reason": "name_pattern"} for col in leaky}
+    if leaky:
+        logger.warning(f"Identified {len(leaky)} potentially leaky features: {leaky}")
+    timings["names"] = time.time() - start
+
+    start = time.time()
+    candidates = [col for col in features if col not in leaky_set]
+    numeric = [col for col in candidates if pd.api.types.is_numeric_dtype(df[col].dtype)
+               and not pd.api.types.is_bool_dtype(df[col].dtype)]
+    use_target = target is not None and len(df) > MIN_ROWS_FOR_TARGET_CORRELATION
+    stats = column_statistics(df, numeric, target if use_target else None) if numeric else None
+    timings["statistics"] = time.time() - start
+
+    start = time.time()
+    numeric_index = {col: i for i, col in enumerate(numeric)}
+    if stats is not None and use_target:
+        for i in np.flatnonzero(np.abs(stats["target_correlation"]) > TARGET_CORRELATION_THRESHOLD):
+            col = numeric[i]
+            leaky.append(col)
+            details[col] = {"reason": "target_correlation", "correlation": round(float(stats["target_correlation"][i]), 4)}
+            logger.warning(f"Detected highly correlated feature: {col} "
+                           f"(correlation: {stats['target_correlation'][i]:.4f})")
+    leaky_set = set(leaky)
+
+    constant, near_unique = [], []
+    for col in candidates:
+        if col in leaky_set:
+            continue
+        if col in numeric_index:
+            is_constant = not stats["varying"][numeric_index[col]]
+        else:
+            distinct = df[col].nunique()
+            is_constant = distinct <= 1
+            present = int(df[col].notna().sum())
+            if distinct >= NEAR_UNIQUE_MIN_VALUES and distinct > NEAR_UNIQUE_RATIO * present:
+                near_unique.append(col)
+                details[col] = {"reason": "near_unique", "distinct_ratio": round(distinct / present, 4)}
+                continue
+        if is_constant:
+            constant.append(col)
+            details[col] = {"reason": "constant"}
+    if constant:
+        logger.info(f"Removing {len(constant)} constant features")
+    if near_unique:
+        logger.info(f"Removing {len(near_unique)} near-unique categorical features: {near_unique}")
+    timings["leakage_and_constancy"] = time.time() - start
+
+    start = time.time()
+    correlated = []
+    constant_set = set(constant)
+    remaining = [numeric_index[col] for col in numeric if col not in leaky_set and col not in constant_set]
+    if len(remaining) > MIN_FEATURES_FOR_PRUNING:
+        correlation = stats["correlation"][np.ix_(remaining, remaining)]
+        for j, i in sorted(correlated_columns(correlation).items()):
+            col, other = numeric[remaining[j]], numeric[remaining[i]]
+            correlated.append(col)
+            details[col] = {"reason": "correlated", "correlated_with": other,
+                            "correlation": round(float(correlation[i, j]), 4)}
+        if correlated:
+            logger.info(f"Removing {len(correlated)} highly correlated features")
+    timings["correlation_pruning"] = time.time() - start
+
+    return {
+        "leaky_features": leaky,
+        "constant_features": constant,
+        "near_unique_features": near_unique,
+        "correlated_features": correlated,
+        "report": {
+            "version": SCREENING_VERSION,
+            "rows": int(len(df)),
+            "features_screened": len(features),
+            "numeric_features": len(numeric),
+            "thresholds": {
+                "missing": MISSING_THRESHOLD,
+                "target_correlation": TARGET_CORRELATION_THRESHOLD,
+                "correlation": CORRELATION_THRESHOLD,
+                "near_unique_ratio": NEAR_UNIQUE_RATIO,
+            },
+            "dropped": {str(col): detail for col, detail in details.items()},
+            "pass_seconds": {name: round(seconds, 4) for name, seconds in timings.items()},
+        },
+    }
@@ -0,0 +1,54 @@
+"""
+Gunicorn configuration for multi-worker serving
+
+    gunicorn -c gunicorn.conf.py ml_backend:app
+
+Runs WEB_CONCURRENCY uvicorn workers. The app is imported once in the
+master process, so the workers share its modules. With SHARED_MODELS=true
+(the default) the models in PRELOAD_MODELS / PRELOAD_RECENT_PER_COURSE are
+loaded there too, before the workers are forked. Each worker then shares the
+master's copy of those models instead of loading its own:
+
+- the scikit-learn pipelines and their tree arrays are shared copy-on-write;
+  garbage collection is disabled while the master loads them and the loaded
+  objects are frozen before the fork, so collections in the workers do not
+  write to (and so copy) the pages they live on;
+- the compiled node arrays are memory-mapped from the artifacts
+  (see model_artifact.py) and live in the page cache once for all workers.
+
+Models loaded after the fork (cache misses in a worker) are private to that
+worker, apart from their memory-mapped arrays. With SHARED_MODELS=false
+every worker preloads the models itself after the fork.
+
+Training jobs run in the worker that accepted them. Their status is written
+to MODELS_DIR/jobs (see training_jobs.py), so any worker answers
+/jobs/{job_id} and can cancel the job.
+"""
+
+import gc
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+worker_class = "uvicorn.workers.UvicornWorker"
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+preload_app = True
+shared_models = os.getenv("SHARED_MODELS", "true").lower() == "true"
+
+# Collections in the master would leave freed slots in pages the workers then write into
+gc.disable()
+
+
+def when_ready(server):
+    """Runs in the master once the app is imported, before any worker is forked."""
+    import ml_backend
+
+    if shared_models:
+        ml_backend.preload_shared_models()
+    # Move everything loaded so far out of the collector's reach in the workers
+    gc.freeze()
+    server.log.info(f"Forking {workers} workers, preload {ml_backend.PRELOAD_STATE}")
+
+
+def post_fork(server, worker):
+    gc.enable()
@@ -0,0 +1,239 @@
+"""
+Budgeted hyperparameter search for the Student Performance Predictor API
+
+Successive halving over a per-algorithm parameter space. Many sampled
+configurations are scored with few trees on shared, already preprocessed
+cross-validation folds; only the best 1/eta of them move on to the next rung
+with eta times more trees. Forests that support warm starts keep their trees
+between rungs and only fit the new ones.
+
+The search is bounded by a fit budget (number of (configuration, fold) fits)
+planned up front and, optionally, by a wall-clock budget checked before each
+rung.
+"""
+
+import logging
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from joblib import Parallel, delayed
+from sklearn.base import clone
+from sklearn.metrics import accuracy_score, roc_auc_score
+
+logger = logging.getLogger(__name__)
+
+# Parameter grids sampled by the search; the resource parameter is set by the rung
+PARAM_SPACES = {
+    "randomforest": {
+        "max_depth": [None, 8, 12, 20],
+        "min_samples_split": [2, 5, 10],
+        "min_samples_leaf": [1, 2, 4],
+        "max_features": ["sqrt", 0.5, None],
+    },
+    "extratrees": {
+        "max_depth": [None, 8, 12, 20],
+        "min_samples_split": [2, 5, 10],
+        "min_samples_leaf": [1, 2, 4],
+        "max_features": ["sqrt", 0.5, None],
+    },
+    "adaboost": {
+        "learning_rate": [0.03, 0.1, 0.3, 1.0],
+    },
+    "xgboost": {
+        "max_depth": [3, 4, 6, 8],
+        "learning_rate": [0.03, 0.1, 0.3],
+        "subsample": [0.7, 0.8, 1.0],
+        "colsample_bytree": [0.6, 0.8, 1.0],
+        "min_child_weight": [1, 3, 5],
+    },
+    "lightgbm": {
+        "num_leaves": [15, 31, 63],
+        "max_depth": [-1, 6, 10],
+        "learning_rate": [0.03, 0.1, 0.3],
+        "subsample": [0.7, 0.8, 1.0],
+        "subsample_freq": [1],
+        "colsample_bytree": [0.6, 0.8, 1.0],
+        "min_child_samples": [10, 20, 40],
+    },
+    "catboost": {
+        "depth": [4, 6, 8],
+        "learning_rate": [0.03, 0.1, 0.3],
+        "l2_leaf_reg": [1, 3, 10],
+    },
+}
+
+# Parameter that controls the number of trees / boosting rounds
+RESOURCE_PARAMS = {"catboost": "iterations"}
+DEFAULT_RESOURCE_PARAM = "n_estimators"
+
+DEFAULT_MAX_FITS = 60
+ETA = 3
+MIN_RESOURCE = 25
+MAX_RESOURCE = 225
+
+
+def resource_param(algorithm: str) -> str:
+    return RESOURCE_PARAMS.get(algorithm, DEFAULT_RESOURCE_PARAM)
+
+
+def plan_rungs(max_fits: int, n_folds: int, eta: int = ETA, min_resource: int = MIN_RESOURCE,
+               max_resource: int = MAX_RESOURCE, space_size: Optional[int] = None) -> List[Tuple[int, int]]:
+    """
+    (configurations, resource) per rung for the largest bracket that fits ``max_fits``.
+
+    Every configuration in a rung is fitted once per fold, so a rung with n
+    configurations costs n * n_folds fits.
+    """
+    resources = [min_resource]
+    while resources[-1] * eta <= max_resource:
+        resources.append(resources[-1] * eta)
+
+    def bracket(n: int) -> List[Tuple[int, int]]:
+        rungs = []
+        for i, resource in enumerate(resources):
+            rungs.append((max(n // eta ** i, 1), resource))
+            if rungs[-1][0] == 1:
+                break
+        return rungs
+
+    def cost(n: int) -> int:
+        return sum(configurations * n_folds for configurations, _ in bracket(n))
+
+    n_configs = 1
+    while cost(n_configs + 1) <= max_fits and (space_size is None or n_configs + 1 <= space_size):
+        n_configs += 1
+    return bracket(n_configs)
+
+
+def sample_configurations(space: Dict[str, Sequence[Any]], n: int, random_state: int = 42) -> List[Dict[str, Any]]:
+    """Up to ``n`` distinct random configurations from a parameter grid."""
+    rng = np.random.RandomState(random_state)
+    names = sorted(space)
+    size = int(np.prod([len(space[name]) for name in names])) if names else 1
+    configurations, seen = [], set()
+    while len(configurations) < min(n, size):
+        choice = tuple(int(rng.randint(len(space[name]))) for name in names)
+        if choice in seen:
+            continue
+        seen.add(choice)
+        configurations.append({name: space[name][i] for name, i in zip(names, choice)})
+    return configurations
+
+
+def _fit_and_score(estimator: Any, fold_data: Tuple[Any, Any, Any, Any], binary: bool) -> Tuple[Any, Dict[str, Any]]:
+    X_fold_train, y_fold_train, X_fold_test, y_fold_test = fold_data
+    try:
+        fit_start = time.time()
+        estimator.fit(X_fold_train, y_fold_train)
+        result = {"fit_seconds": time.time() - fit_start}
+        result["accuracy"] = accuracy_score(y_fold_test, estimator.predict(X_fold_test))
+        if binary and hasattr(estimator, "predict_proba"):
+            result["roc_auc"] = roc_auc_score(y_fold_test, estimator.predict_proba(X_fold_test)[:, 1])
+        return estimator, result
+    except Exception as e:
+        return None, {"error": str(e)}
+
+
+def _score(trial: Dict[str, Any]) -> Tuple[float, float]:
+    return trial["cv_accuracy"], trial["cv_roc_auc"] or 0.0
+
+
+def successive_halving(estimator: Any, algorithm: str, fold_data: List[Tuple[Any, Any, Any, Any]], binary: bool,
+                       max_fits: int = DEFAULT_MAX_FITS, time_budget: Optional[float] = None,
+                       cpu_budget: int = 1, eta: int = ETA, random_state: int = 42) -> Dict[str, Any]:
+    """
+    Tune ``estimator`` (limited to one thread) on preprocessed CV folds.
+
+    Returns the best parameters (including the number of trees it was scored
+    with), its CV metrics, the per-rung history and the fits and seconds used.
+    """
+    start = time.time()
+    space = PARAM_SPACES.get(algorithm, {})
+    resource_name = resource_param(algorithm)
+    space_size = int(np.prod([len(v) for v in space.values()])) if space else 1
+    rungs = plan_rungs(max_fits, len(fold_data), eta=eta, space_size=space_size)
+    configurations = sample_configurations(space, rungs[0][0], random_state)
+    warm_start = "warm_start" in estimator.get_params()
+
+    survivors = [{"params": params, "models": [None] * len(fold_data)} for params in configurations]
+    history, fits_used, best = [], 0, None
+    for rung, (n_keep, resource) in enumerate(rungs):
+        survivors = survivors[:n_keep]
+        if time_budget and history:
+            elapsed = time.time() - start
+            # Rough cost of the next rung from the previous one: linear in trees and fits
+            previous = history[-1]
+            estimate = previous["seconds"] * (resource / previous["resource"]) * (len(survivors) / previous["configurations"])
+            if elapsed + estimate > time_budget:
+                logger.info(f"Search stopped before rung {rung}: {elapsed:.1f}s used, next rung ~{estimate:.1f}s")
+                break
+
+        rung_start = time.time()
+        tasks = []
+        for trial in survivors:
+            for fold, data in enumerate(fold_data):
+                model = trial["models"][fold] if warm_start else None
+                if model is None:
+                    model = clone(estimator).set_params(**trial["params"])
+                    if warm_start:
+                        model.set_params(warm_start=True)
+                model.set_params(**{resource_name: resource})
+                tasks.append((trial, fold, model, data))
+
+        results = Parallel(n_jobs=cpu_budget, prefer="threads")(
+            delayed(_fit_and_score)(model, data, binary) for _, _, model, data in tasks
+        )
+        fits_used += len(tasks)
+
+        fold_results = {}
+        for (trial, fold, _, _), (model, result) in zip(tasks, results):
+            # Only forests that warm start reuse their trees in the next rung
+            trial["models"][fold] = model if warm_start else None
+            fold_results.setdefault(id(trial), []).append(result)
+        scored = []
+        for trial in survivors:
+            results_for_trial = fold_results[id(trial)]
+            if any("error" in r for r in results_for_trial):
+                logger.warning(f"Search configuration {trial['params']} failed: {results_for_trial[0].get('error')}")
+                continue
+            roc_aucs = [r["roc_auc"] for r in results_for_trial if "roc_auc" in r]
+            trial.update(
+                cv_accuracy=float(np.mean([r["accuracy"] for r in results_for_trial])),
+                cv_roc_auc=float(np.mean(roc_aucs)) if len(roc_aucs) == len(results_for_trial) else None,
+                resource=resource
+            )
+            scored.append(trial)
+        if not scored:
+            break
+        scored.sort(key=_score, reverse=True)
+        survivors = scored
+        best = scored[0]
+        history.append({
+            "rung": rung,
+            "resource": resource,
+            "configurations": len(tasks) // len(fold_data),
+            "fits": len(tasks),
+            "best_cv_accuracy": best["cv_accuracy"],
+            "seconds": round(time.time() - rung_start, 3),
+        })
+        logger.info(f"Search rung {rung}: {history[-1]['configurations']} configurations at {resource} trees, "
+                    f"best cv accuracy {best['cv_accuracy']:.4f}")
+
+    if best is None:
+        return {"algorithm": algorithm, "best_params": None, "fits_used": fits_used, "rungs": history,
+                "seconds": round(time.time() - start, 3), "error": "no configuration could be trained"}
+    return {
+        "algorithm": algorithm,
+        "best_params": dict(best["params"], **{resource_name: best["resource"]}),
+        "best_cv_accuracy": best["cv_accuracy"],
+        "best_cv_roc_auc": best["cv_roc_auc"],
+        "configurations_sampled": len(configurations),
+        "max_fits": max_fits,
+        "fits_used": fits_used,
+        "time_budget_seconds": time_budget,
+        "cpu_budget": cpu_budget,
+        "folds": len(fold_data),
+        "rungs": history,
+        "seconds": round(time.time() - start, 3),
+    }
@@ -0,0 +1,265 @@
+"""
+Dataset ingestion for the Student Performance Predictor API
+
+Reads uploaded training datasets (CSV, JSON / JSON lines, Excel, Parquet and
+Arrow IPC / Feather) in chunks and stores every column in a compact dtype as
+it goes: floats as float32, integers downcast to the smallest type that holds
+them and low-cardinality strings as categories. Explicit dtypes can be given
+per column. Peak resident memory is measured while a file is read and
+reported with the other ingestion statistics.
+"""
+
+import logging
+import os
+import shutil
+import sys
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# File extension -> format
+SUPPORTED_FORMATS = {
+    ".csv": "csv",
+    ".json": "json",
+    ".jsonl": "jsonl",
+    ".ndjson": "jsonl",
+    ".xlsx": "excel",
+    ".xls": "excel",
+    ".parquet": "parquet",
+    ".pq": "parquet",
+    ".arrow": "arrow",
+    ".feather": "arrow",
+    ".ipc": "arrow",
+}
+
+CHUNK_ROWS = 100_000
+# Text columns with at most this share of distinct values (in the first chunk) become categories
+CATEGORY_MAX_UNIQUE_RATIO = 0.5
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def dataset_format(filename: str) -> Optional[str]:
+    """Format of a dataset file from its extension, or None if it is not supported."""
+    return SUPPORTED_FORMATS.get(os.path.splitext(filename)[1].lower())
+
+
+def current_rss() -> Optional[int]:
+    """Resident memory of this process in bytes, where the platform exposes it cheaply."""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _max_rss() -> Optional[int]:
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class PeakMemory:
+    """
+    Peak resident memory of the process while a block runs.
+
+    A background thread samples the RSS every ``interval`` seconds. Where
+    the RSS cannot be sampled the process-lifetime peak is reported instead.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.start_bytes = None
+        self.peak_bytes = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self) -> "PeakMemory":
+        self.start_bytes = current_rss()
+        self.peak_bytes = self.start_bytes
+        if self.start_bytes is not None:
+            self._thread = threading.Thread(target=self._sample, name="peak-memory", daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._record(current_rss())
+        else:
+            self.peak_bytes = _max_rss()
+
+    def _sample(self) -> None:
+        while not self._stop.wait(self.interval):
+            self._record(current_rss())
+
+    def _record(self, rss: Optional[int]) -> None:
+        if rss is not None and (self.peak_bytes is None or rss > self.peak_bytes):
+            self.peak_bytes = rss
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "peak_rss_mb": _mb(self.peak_bytes),
+            "rss_increase_mb": _mb(self.peak_bytes - self.start_bytes) if self.start_bytes is not None else None,
+        }
+
+
+def _mb(size: Optional[int]) -> Optional[float]:
+    return round(size / (1024 * 1024), 2) if size is not None else None
+
+
+def save_upload(upload: Any, path: str) -> str:
+    """
+    Write an uploaded file to ``path`` for a training worker to read.
+
+    Uploads that the server already spooled to disk are copied inside the
+    kernel (copy_file_range, a copy-on-write clone on filesystems that
+    support it) instead of being streamed through Python buffers.
+    """
+    source = upload.file
+    source.seek(0)
+    with open(path, "wb") as target:
+        if getattr(source, "_rolled", False) and hasattr(os, "copy_file_range"):
+            in_fd, out_fd = source.fileno(), target.fileno()
+            size = os.fstat(in_fd).st_size
+            offset = 0
+            try:
+                while offset < size:
+                    copied = os.copy_file_range(in_fd, out_fd, size - offset, offset, offset)
+                    if copied == 0:
+                        break
+                    offset += copied
+                if offset == size:
+                    return path
+            except OSError as e:
+                logger.debug(f"copy_file_range unavailable ({str(e)}), copying through Python")
+            source.seek(0)
+            target.seek(0)
+            target.truncate()
+        shutil.copyfileobj(source, target, 1024 * 1024)
+    return path
+
+
+def _iter_chunks(path: str, file_format: str, dtypes: Optional[Dict[str, str]], chunk_rows: int) -> Iterator[pd.DataFrame]:
+    if file_format == "csv":
+        yield from pd.read_csv(path, dtype=dtypes or None, chunksize=chunk_rows)
+    elif file_format == "jsonl":
+        yield from pd.read_json(path, lines=True, chunksize=chunk_rows)
+    elif file_format == "json":
+        yield pd.read_json(path)
+    elif file_format == "excel":
+        yield pd.read_excel(path)
+    elif file_format == "parquet":
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_rows):
+            yield batch.to_pandas()
+    elif file_format == "arrow":
+        import pyarrow as pa
+        source = pa.memory_map(path, "r")
+        try:
+            reader = pa.ipc.open_file(source)
+            batches = (reader.get_batch(i) for i in range(reader.num_record_batches))
+        except pa.ArrowInvalid:
+            # Arrow IPC stream rather than file (Feather v2) format
+            source.seek(0)
+            batches = pa.ipc.open_stream(source)
+        for batch in batches:
+            yield batch.to_pandas()
+    else:
+        raise ValueError(f"Unsupported file format: {file_format}")
+
+
+def compact_dtypes(df: pd.DataFrame, categorical: List[str], skip: Any = ()) -> pd.DataFrame:
+    """Store the columns of a chunk in compact dtypes, leaving the ``skip`` columns alone."""
+    for col in df.columns:
+        if col in skip:
+            continue
+        series = df[col]
+        kind = series.dtype.kind
+        if kind == "f" and series.dtype.itemsize > 4:
+            df[col] = series.astype(np.float32)
+        elif kind == "i" and series.dtype.itemsize > 1:
+            df[col] = pd.to_numeric(series, downcast="integer")
+        elif kind == "u" and series.dtype.itemsize > 1:
+            df[col] = pd.to_numeric(series, downcast="unsigned")
+        elif col in categorical and _is_text(series):
+            df[col] = series.astype("category")
+    return df
+
+
+def _categorical_columns(chunk: pd.DataFrame, skip: Any = ()) -> List[str]:
+    """Text columns of the first chunk with few enough distinct values to store as categories."""
+    limit = max(1, int(len(chunk) * CATEGORY_MAX_UNIQUE_RATIO))
+    return [
+        col for col in chunk.columns
+        if col not in skip and _is_text(chunk[col]) and chunk[col].nunique(dropna=True) <= limit
+    ]
+
+
+def _is_text(series: pd.Series) -> bool:
+    # object columns, and pandas' string dtype (the default for text from pandas 3)
+    return series.dtype == object or isinstance(series.dtype, pd.StringDtype)
+
+
+def concat_chunks(chunks: List[pd.DataFrame]) -> pd.DataFrame:
+    """Concatenate compacted chunks, keeping category columns categorical."""
+    if len(chunks) == 1:
+        return chunks[0]
+    # Chunks only concatenate as categories when they share the same categories
+    for col in chunks[0].columns:
+        if all(isinstance(chunk[col].dtype, pd.CategoricalDtype) for chunk in chunks):
+            categories = pd.Index(np.concatenate([chunk[col].cat.categories.to_numpy(dtype=object) for chunk in chunks])).unique()
+            for chunk in chunks:
+                chunk[col] = chunk[col].cat.set_categories(categories)
+    return pd.concat(chunks, ignore_index=True)
+
+
+def read_dataset(path: str, filename: str, dtypes: Optional[Dict[str, str]] = None, compact: bool = True,
+                 chunk_rows: int = CHUNK_ROWS) -> Tuple[pd.DataFrame, Dict[str, Any]]:
+    """
+    Read a dataset file into a DataFrame with compact dtypes.
+
+    ``dtypes`` maps column names to explicit dtypes (e.g. "float64",
+    "category"); every other column gets an inferred compact dtype unless
+    ``compact`` is false. Returns the frame and an ingestion report with the
+    format, size, dtypes, timing and peak memory of the read.
+    """
+    file_format = dataset_format(filename)
+    if file_format is None:
+        raise ValueError(f"Unsupported file format: {os.path.splitext(filename)[1].lower()}")
+
+    start = time.time()
+    with PeakMemory() as memory:
+        chunks, categorical = [], None
+        for chunk in _iter_chunks(path, file_format, dtypes, chunk_rows):
+            if dtypes and file_format != "csv":
+                chunk = chunk.astype({col: dtype for col, dtype in dtypes.items() if col in chunk.columns})
+            if compact:
+                if categorical is None:
+                    categorical = _categorical_columns(chunk, skip=dtypes or ())
+                chunk = compact_dtypes(chunk, categorical, skip=dtypes or ())
+            chunks.append(chunk)
+        df = concat_chunks(chunks) if chunks else pd.DataFrame()
+        del chunks
+
+    report = {
+        "format": file_format,
+        "file_mb": _mb(os.path.getsize(path)),
+        "rows": int(len(df)),
+        "columns": int(len(df.columns)),
+        "compact_dtypes": compact,
+        "dtypes": {str(dtype): int(count) for dtype, count in df.dtypes.astype(str).value_counts().items()},
+        "dataframe_mb": _mb(int(df.memory_usage(deep=True).sum())),
+        "read_seconds": round(time.time() - start, 3),
+    }
+    report.update(memory.report())
+    return df, report
@@ -0,0 +1,179 @@
+"""
+Input schemas for prediction requests
+
+Each model records, at training time, the ordered columns it was trained on,
+how each column is treated by the preprocessor, its training dtype and the
+value to use when a request leaves it out. Prediction requests are aligned
+against the schema in a single pass instead of dropping and adding columns
+one at a time.
+"""
+
+import logging
+from typing import Any, Dict, Iterable, List
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_VERSION = 1
+
+NUMERIC = "numeric"
+CATEGORICAL = "categorical"
+BOOLEAN = "boolean"
+PASSTHROUGH = "passthrough"
+
+_TRUE_STRINGS = {"true", "t", "yes", "y", "1"}
+_FALSE_STRINGS = {"false", "f", "no", "n", "0"}
+
+
+def _default_for(kind: str) -> Any:
+    # Missing numeric features have always been sent as 0; missing categories
+    # are left to the pipeline's most-frequent imputer.
+    return 0 if kind == NUMERIC else None
+
+
+class InputSchema:
+    """Ordered, typed description of a model's input columns."""
+
+    def __init__(self, columns: List[str], kinds: Dict[str, str], dtypes: Dict[str, str],
+                 defaults: Dict[str, Any], ignored: Iterable[str] = ()):
+        self.columns = list(columns)
+        self.kinds = dict(kinds)
+        self.dtypes = dict(dtypes)
+        self.defaults = dict(defaults)
+        self.ignored = sorted(set(ignored))
+
+    @classmethod
+    def from_training_frame(cls, X: pd.DataFrame, numeric_cols: List[str], categorical_cols: List[str],
+                            ignored: Iterable[str] = ()) -> "InputSchema":
+        """Schema for the feature frame a pipeline is about to be fitted on."""
+        numeric, categorical = set(numeric_cols), set(categorical_cols)
+        kinds = {}
+        for col in X.columns:
+            if col in numeric:
+                kinds[col] = NUMERIC
+            elif col in categorical:
+                kinds[col] = BOOLEAN if X[col].dtype == bool else CATEGORICAL
+            else:
+                kinds[col] = PASSTHROUGH
+        return cls(
+            columns=X.columns.tolist(),
+            kinds=kinds,
+            dtypes={col: str(X[col].dtype) for col in X.columns},
+            defaults={col: _default_for(kind) for col, kind in kinds.items()},
+            ignored=ignored
+        )
+
+    @classmethod
+    def from_model_data(cls, model_data: Dict[str, Any]) -> "InputSchema":
+        """
+        Schema for a stored model.
+
+        Uses the compiled schema when the model has one; for older models it is
+        inferred from the fitted ColumnTransformer.
+        """
+        if model_data.get("input_schema"):
+            return cls.from_dict(model_data["input_schema"])
+
+        feature_names = list(model_data["feature_names"])
+        kinds = {col: PASSTHROUGH for col in feature_names}
+        try:
+            preprocessor = model_data["pipeline"].named_steps["preprocessor"]
+            for name, _, cols in preprocessor.transformers_:
+                kind = {"num": NUMERIC, "cat": CATEGORICAL}.get(name)
+                if kind is not None:
+                    for col in cols:
+                        kinds[col] = kind
+        except (AttributeError, KeyError, TypeError, ValueError) as e:
+            logger.warning(f"Could not infer input schema from preprocessor: {str(e)}")
+        return cls(
+            columns=feature_names,
+            kinds=kinds,
+            dtypes={col: "float64" if kind == NUMERIC else "object" for col, kind in kinds.items()},
+            defaults={col: _default_for(kind) for col, kind in kinds.items()},
+            ignored=model_data.get("leaky_features", [])
+        )
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "InputSchema":
+        return cls(data["columns"], data["kinds"], data["dtypes"], data["defaults"], data.get("ignored", []))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "version": SCHEMA_VERSION,
+            "columns": self.columns,
+            "kinds": self.kinds,
+            "dtypes": self.dtypes,
+            "defaults": self.defaults,
+            "ignored": self.ignored,
+        }
+
+    def build_frame(self, records: List[Dict[str, Any]]) -> pd.DataFrame:
+        """Aligned, typed input frame for a list of feature records, built in one pass."""
+        data = {}
+        for col in self.columns:
+            default = self.defaults.get(col)
+            data[col] = self._coerce(col, [record.get(col, default) for record in records])
+        return pd.DataFrame(data, columns=self.columns)
+
+    def align_frame(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Aligned, typed input frame for a whole dataset; absent columns get their defaults."""
+        data = {}
+        for col in self.columns:
+            values = df[col].tolist() if col in df.columns else [self.defaults.get(col)] * len(df)
+            data[col] = self._coerce(col, values)
+        return pd.DataFrame(data, columns=self.columns, index=df.index)
+
+    def missing_columns(self, records: List[Dict[str, Any]]) -> List[str]:
+        """Schema columns that none of the records provide."""
+        present = set()
+        for record in records:
+            present.update(record.keys())
+        return [col for col in self.columns if col not in present]
+
+    def _coerce(self, col: str, values: List[Any]) -> np.ndarray:
+        kind = self.kinds.get(col, PASSTHROUGH)
+        if kind == NUMERIC:
+            try:
+                array = np.array(values, dtype=np.float64)
+            except (TypeError, ValueError):
+                array = pd.to_numeric(pd.Series(values, dtype=object), errors="coerce").to_numpy(dtype=np.float64)
+            dtype = self.dtypes.get(col, "float64")
+            if dtype.startswith("int") and not np.isnan(array).any():
+                # int64 rather than the (possibly downcast) training dtype, which new values may overflow
+                return array.astype(np.int64)
+            return array
+        if kind == CATEGORICAL:
+            return np.array([np.nan if _is_missing(v) else str(v) for v in values], dtype=object)
+        if kind == BOOLEAN:
+            return np.array([_to_bool(v) for v in values], dtype=object)
+        return np.array([np.nan if v is None else v for v in values], dtype=object)
+
+
+def _is_missing(value: Any) -> bool:
+    return value is None or (isinstance(value, float) and np.isnan(value))
+
+
+def _to_bool(value: Any) -> Any:
+    if _is_missing(value):
+        return np.nan
+    if isinstance(value, (bool, np.bool_)):
+        return bool(value)
+    if isinstance(value, str):
+        lowered = value.strip().lower()
+        if lowered in _TRUE_STRINGS:
+            return True
+        if lowered in _FALSE_STRINGS:
+            return False
+        return value
+    return bool(value)
+
+
+def get_input_schema(model_data: Dict[str, Any]) -> InputSchema:
+    """Compiled schema for a loaded model, built once and kept alongside it."""
+    schema = model_data.get("_compiled_input_schema")
+    if schema is None:
+        schema = InputSchema.from_model_data(model_data)
+        model_data["_compiled_input_schema"] = schema
+    return schema
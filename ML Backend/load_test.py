@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""
+Load generator that replays Moodle refresh traffic against a running backend
+
+Stands in for the PHP plugin. A prediction refresh runs one ``/predict`` per
+student in a tight loop, one request after the other, on a new connection
+every time (the plugin creates a new curl handle per request).
+``--concurrency`` refreshes run at once, each starting at a different student
+and starting over when it has gone through all of them, so repeated
+refreshes send the same features again. Alongside them an admin lists the
+course's models (``GET /models/{course_id}``) every ``--list-every``
+seconds, and a teacher uploads a dataset to ``/train`` every
+``--train-every`` seconds.
+
+Student records come from ``--dataset`` (a CSV such as
+moodle_dataset_generator.py writes) or are generated as in benchmark.py.
+Without ``--model-id`` a model is trained on them first.
+
+Reports, per endpoint, the requests, throughput, error rate with the status
+codes, and p50 / p95 / p99 latency, plus the server's prediction batching
+and prediction cache counters over the run. Exits with code 1 if an
+endpoint's error rate exceeds ``--max-error-rate``.
+
+    python load_test.py --url http://localhost:8000 --api-key $API_KEY --duration 60 --concurrency 16
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+
+import httpx
+import numpy as np
+import pandas as pd
+
+from benchmark import ID_COLUMNS, TARGET_COLUMN, load_dataset
+
+
+class EndpointStats:
+    """Latencies and outcomes of the requests to one endpoint."""
+
+    def __init__(self):
+        self.latencies = []
+        self.statuses = Counter()
+        self.errors = 0
+
+    def record(self, seconds, status_code, ok):
+        self.latencies.append(seconds)
+        self.statuses[str(status_code)] += 1
+        if not ok:
+            self.errors += 1
+
+    def report(self, duration):
+        requests = len(self.latencies)
+        report = {
+            "requests": requests,
+            "throughput_rps": round(requests / duration, 2) if duration > 0 else None,
+            "errors": self.errors,
+            "error_rate": round(self.errors / requests, 4) if requests else 0.0,
+            "status_codes": dict(self.statuses),
+        }
+        if requests:
+            latencies_ms = np.asarray(self.latencies) * 1000
+            p50, p95, p99 = np.percentile(latencies_ms, [50, 95, 99])
+            report["latency_ms"] = {"p50": round(float(p50), 2), "p95": round(float(p95), 2),
+                                    "p99": round(float(p99), 2), "max": round(float(latencies_ms.max()), 2),
+                                    "mean": round(float(latencies_ms.mean()), 2)}
+        return report
+
+
+async def timed_request(client, stats, method, url, ok_statuses=(200,), **kwargs):
+    """Send one request and record it; connection errors and timeouts count as errors."""
+    start = time.perf_counter()
+    try:
+        response = await client.request(method, url, **kwargs)
+    except httpx.HTTPError as e:
+        stats.record(time.perf_counter() - start, type(e).__name__, False)
+        return None
+    stats.record(time.perf_counter() - start, response.status_code, response.status_code in ok_statuses)
+    return response
+
+
+async def refresh_loop(client, stats, model_id, records, first, deadline):
+    """One course refresh after another: a /predict per student, in order, as the plugin's task sends them."""
+    i = first
+    while time.perf_counter() < deadline:
+        await timed_request(client, stats, "POST", "/predict", json={"model_id": model_id, "features": records[i]})
+        i = (i + 1) % len(records)
+
+
+async def admin_loop(client, stats, course_id, every, deadline):
+    while time.perf_counter() + every < deadline:
+        await asyncio.sleep(every)
+        await timed_request(client, stats, "GET", f"/models/{course_id}")
+
+
+async def training_loop(client, stats, course_id, dataset_path, every, deadline):
+    """Dataset uploads queued as training jobs; only the upload is timed, not the training."""
+    while time.perf_counter() + every < deadline:
+        await asyncio.sleep(every)
+        with open(dataset_path, "rb") as f:
+            await timed_request(client, stats, "POST", "/train", ok_statuses=(200, 202),
+                                data={"courseid": str(course_id), "target_column": TARGET_COLUMN,
+                                      "id_columns": ID_COLUMNS},
+                                files={"dataset_file": (os.path.basename(dataset_path), f, "text/csv")})
+
+
+async def server_counters(client):
+    """Prediction batching and prediction cache counters, where the server exposes them."""
+    counters = {}
+    try:
+        health = (await client.get("/health")).json()
+        counters["prediction_batching"] = health.get("prediction_batching")
+        cache = (await client.get("/cache/stats")).json()
+        counters["prediction_cache"] = cache.get("prediction_cache")
+        counters["model_cache"] = {key: cache.get(key) for key in ("hits", "misses", "loads", "shared_loads")}
+    except (httpx.HTTPError, ValueError):
+        pass
+    return counters
+
+
+def _cache_delta(before, after):
+    before, after = (before or {}).get("prediction_cache") or {}, (after or {}).get("prediction_cache") or {}
+    if "hits" not in after:
+        return None
+    hits = after["hits"] - before.get("hits", 0)
+    misses = after["misses"] - before.get("misses", 0)
+    return {"hits": hits, "misses": misses, "hit_ratio": round(hits / (hits + misses), 4) if hits + misses else 0.0}
+
+
+async def run(args, records, dataset_path, train_path):
+    headers = {"X-API-Key": args.api_key}
+    if not args.keep_alive:
+        headers["Connection"] = "close"
+    limits = httpx.Limits(max_connections=args.concurrency + 4)
+    async with httpx.AsyncClient(base_url=args.url.rstrip("/"), headers=headers, timeout=args.timeout,
+                                 limits=limits) as client:
+        model_id = args.model_id
+        if not model_id:
+            print(f"Training a model on {dataset_path}", file=sys.stderr)
+            with open(dataset_path, "rb") as f:
+                response = await client.post("/train", data={"courseid": str(args.course_id), "wait": "true",
+                                                             "target_column": TARGET_COLUMN, "id_columns": ID_COLUMNS},
+                                             files={"dataset_file": (os.path.basename(dataset_path), f, "text/csv")},
+                                             timeout=None)
+            response.raise_for_status()
+            model_id = response.json()["model_id"]
+
+        before = await server_counters(client)
+        stats = {"/predict": EndpointStats(), "/models/{course_id}": EndpointStats(), "/train": EndpointStats()}
+        start = time.perf_counter()
+        deadline = start + args.duration
+        # Every refresh starts at a different student
+        tasks = [refresh_loop(client, stats["/predict"], model_id, records,
+                              i * len(records) // args.concurrency, deadline) for i in range(args.concurrency)]
+        if args.list_every > 0:
+            tasks.append(admin_loop(client, stats["/models/{course_id}"], args.course_id, args.list_every, deadline))
+        if args.train_every > 0:
+            tasks.append(training_loop(client, stats["/train"], args.course_id, train_path, args.train_every, deadline))
+        await asyncio.gather(*tasks)
+        duration = time.perf_counter() - start
+        after = await server_counters(client)
+
+    endpoints = {endpoint: endpoint_stats.report(duration) for endpoint, endpoint_stats in stats.items()}
+    total = sum(report["requests"] for report in endpoints.values())
+    return {
+        "url": args.url,
+        "model_id": model_id,
+        "course_id": args.course_id,
+        "students": len(records),
+        "concurrency": args.concurrency,
+        "keep_alive": args.keep_alive,
+        "duration_seconds": round(duration, 2),
+        "requests": total,
+        "throughput_rps": round(total / duration, 2) if duration > 0 else None,
+        "endpoints": endpoints,
+        "server": {"before": before, "after": after, "prediction_cache": _cache_delta(before, after)},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay Moodle refresh traffic against a running backend')
+    parser.add_argument('--url', type=str, default="http://localhost:8000", help='Backend base URL')
+    parser.add_argument('--api-key', type=str, default=os.getenv("API_KEY", "changeme"), help='Backend API key')
+    parser.add_argument('--model-id', type=str, default="", help='Model to predict with (default: train one first)')
+    parser.add_argument('--course-id', type=int, default=1, help='Course whose models are listed and trained')
+    parser.add_argument('--dataset', type=str, default="", help='CSV of student records (default: generated)')
+    parser.add_argument('--students', type=int, default=1000, help='Student records (rows) of the generated dataset')
+    parser.add_argument('--seed', type=int, default=42, help='Seed of the generated dataset')
+    parser.add_argument('--duration', type=float, default=60, help='Seconds to generate load for')
+    parser.add_argument('--concurrency', type=int, default=8, help='Prediction refreshes running at once')
+    parser.add_argument('--list-every', type=float, default=5, help='Seconds between model listings (0: none)')
+    parser.add_argument('--train-every', type=float, default=30, help='Seconds between training uploads (0: none)')
+    parser.add_argument('--train-rows', type=int, default=2000, help='Rows of the uploaded training datasets')
+    parser.add_argument('--keep-alive', action='store_true',
+                        help='Reuse connections instead of one per request as the plugin does')
+    parser.add_argument('--timeout', type=float, default=60, help='Request timeout in seconds (the plugin uses 60)')
+    parser.add_argument('--max-error-rate', type=float, default=0.01, help='Largest tolerated error rate per endpoint')
+    parser.add_argument('--output', type=str, default="", help='Also write the report to this file')
+    args = parser.parse_args()
+    if args.concurrency < 1:
+        parser.error("--concurrency must be at least 1")
+
+    data_dir = os.path.join(tempfile.gettempdir(), "spp-benchmark-data")
+    dataset_path = args.dataset or load_dataset(args.students, args.seed, data_dir, max(args.students, 200000))
+    df = pd.read_csv(dataset_path)
+    # The plugin sends each student's features without the outcome
+    records = json.loads(df.drop(columns=[TARGET_COLUMN], errors="ignore").to_json(orient="records"))
+    train_path = dataset_path
+    if args.train_every > 0 and len(df) > args.train_rows:
+        fd, train_path = tempfile.mkstemp(prefix="load-test-", suffix=".csv")
+        os.close(fd)
+        df.head(args.train_rows).to_csv(train_path, index=False)
+
+    try:
+        report = asyncio.run(run(args, records, dataset_path, train_path))
+    finally:
+        if train_path != dataset_path:
+            os.unlink(train_path)
+    output = json.dumps(report, indent=1)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    failed = [endpoint for endpoint, endpoint_report in report["endpoints"].items()
+              if endpoint_report["error_rate"] > args.max_error_rate]
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
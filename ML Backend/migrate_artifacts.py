@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Convert model artifacts to the current artifact layout
+
+Every ``<model_id>.joblib`` artifact (version 1) under the models directory
+is rewritten as a ``<model_id>.model`` directory (see model_artifact.py) and
+checked against the original before the original is removed. The model
+registry is rebuilt afterwards, so a running server picks up the new paths.
+Prints a JSON report with the sizes and load times before and after.
+
+    python migrate_artifacts.py --models-dir models [--keep-legacy] [--dry-run]
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+
+from model_artifact import migrate_artifact
+from model_registry import COURSE_DIR_PATTERN, LEGACY_ARTIFACT_SUFFIX, ModelRegistry
+
+
+def legacy_artifacts(models_dir):
+    """Paths of the version 1 artifacts in a models directory."""
+    for course_dir in sorted(os.listdir(models_dir)) if os.path.isdir(models_dir) else []:
+        course_path = os.path.join(models_dir, course_dir)
+        if not COURSE_DIR_PATTERN.match(course_dir) or not os.path.isdir(course_path):
+            continue
+        for filename in sorted(os.listdir(course_path)):
+            if filename.endswith(LEGACY_ARTIFACT_SUFFIX):
+                yield os.path.join(course_path, filename)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert .joblib model artifacts to the current artifact layout')
+    parser.add_argument('--models-dir', type=str, default=os.getenv("MODELS_DIR", "models"),
+                        help='Models directory (default MODELS_DIR or ./models)')
+    parser.add_argument('--keep-legacy', action='store_true', help='Keep the .joblib files after converting them')
+    parser.add_argument('--dry-run', action='store_true', help='Only list the artifacts that would be converted')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    paths = list(legacy_artifacts(args.models_dir))
+    if args.dry_run:
+        print(json.dumps({"legacy_artifacts": paths}, indent=1))
+        return 0
+
+    migrated, failed = [], {}
+    for path in paths:
+        try:
+            migrated.append(migrate_artifact(path, keep_legacy=args.keep_legacy))
+        except Exception as e:
+            failed[os.path.basename(path)] = f"{type(e).__name__}: {str(e)}"
+    models_count = ModelRegistry(args.models_dir).rebuild()
+
+    print(json.dumps({
+        "migrated": migrated,
+        "failed": failed,
+        "models_count": models_count,
+        "legacy_bytes": sum(r["legacy_bytes"] for r in migrated),
+        "bytes": sum(r["bytes"] for r in migrated),
+        "serving_bytes": sum(r["serving_bytes"] for r in migrated),
+        "legacy_load_seconds": round(sum(r["legacy_load_seconds"] for r in migrated), 4),
+        "load_seconds": round(sum(r["load_seconds"] for r in migrated), 4),
+    }, indent=1))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
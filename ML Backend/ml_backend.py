@@ -11,57 +11,40 @@ import time
 import logging
 import traceback
 import tempfile
-import shutil
-import re
 from datetime import datetime
 from typing import Dict, List, Optional, Any, Tuple, Union
 
 import numpy as np
-import pandas as pd
-import joblib
+import asyncio
+import json
 from fastapi import FastAPI, HTTPException, Depends, Header, Request, status, BackgroundTasks
 from fastapi import File, UploadFile, Form
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, Field, validator
 from dotenv import load_dotenv
-from scipy import stats
-
-# ML imports
-from sklearn.preprocessing import StandardScaler, OneHotEncoder, RobustScaler
-from sklearn.compose import ColumnTransformer
-from sklearn.pipeline import Pipeline
-from sklearn.model_selection import train_test_split, cross_val_score, StratifiedKFold
-from sklearn.metrics import accuracy_score, precision_score, recall_score, f1_score, roc_auc_score, confusion_matrix
-from sklearn.ensemble import RandomForestClassifier, ExtraTreesClassifier, AdaBoostClassifier
-from sklearn.impute import SimpleImputer
-from sklearn.feature_selection import SelectFromModel
-from sklearn.calibration import CalibratedClassifierCV
-
-# Import the requested boosting algorithms
-try:
-    import xgboost as xgb
-    from xgboost import XGBClassifier
-    XGBOOST_AVAILABLE = True
-except ImportError:
-    XGBOOST_AVAILABLE = False
-    logging.warning("XGBoost not available. Install with: pip install xgboost")
-
-try:
-    import catboost
-    from catboost import CatBoostClassifier
-    CATBOOST_AVAILABLE = True
-except ImportError:
-    CATBOOST_AVAILABLE = False
-    logging.warning("CatBoost not available. Install with: pip install catboost")
-
-try:
-    import lightgbm as lgb
-    from lightgbm import LGBMClassifier
-    LIGHTGBM_AVAILABLE = True
-except ImportError:
-    LIGHTGBM_AVAILABLE = False
-    logging.warning("LightGBM not available. Install with: pip install lightgbm")
+
+from model_cache import ModelCache
+from prediction_cache import PredictionCache, row_fingerprints
+from model_artifact import load_artifact, serving_pipeline, serving_size
+from model_registry import (ModelRegistry, backfill_sidecars, read_sidecar,
+                            sidecar_from_model_data, summarize_sidecar, write_sidecar)
+
+from confidence import calculate_confidence_interval, wilson_interval_arrays
+from training_jobs import JobManager, JOB_SUCCEEDED
+from training_profile import aggregate_profiles
+from prediction_batcher import PredictionBatcher
+from input_schema import get_input_schema
+from compiled_model import get_compiled_model
+from algorithms import availability
+from ingestion import SUPPORTED_FORMATS, dataset_format, save_upload
+from dataset_registry import DatasetError, DatasetRegistry, save_hashed
+
+# Report missing boosting algorithms (they are only imported when a model needs them)
+for algorithm_name, available in availability().items():
+    if not available:
+        logging.warning(f"{algorithm_name} not available. Install with: pip install {algorithm_name}")
 
 # Load environment variables
 load_dotenv()
@@ -95,9 +78,53 @@ API_KEY = os.getenv("API_KEY", "changeme")
 # Storage paths
 MODELS_DIR = os.path.join(os.getcwd(), os.getenv("MODELS_DIR", "models"))
 os.makedirs(MODELS_DIR, exist_ok=True)
+DATASETS_DIR = os.path.join(os.getcwd(), os.getenv("DATASETS_DIR", "datasets"))
+
+# Models cache (bounded; see model_cache.py)
+MODEL_CACHE = ModelCache(
+    max_entries=int(os.getenv("MODEL_CACHE_MAX_ENTRIES", "32")),
+    max_bytes=int(float(os.getenv("MODEL_CACHE_MAX_MB", "1024")) * 1024 * 1024),
+    policy=os.getenv("MODEL_CACHE_POLICY", "lru").lower(),
+    pinned=[m.strip() for m in os.getenv("MODEL_CACHE_PINNED", "").split(",") if m.strip()]
+)
+
+# Persistent model_id -> artifact index (see model_registry.py)
+MODEL_REGISTRY = ModelRegistry(MODELS_DIR)
+MODEL_REGISTRY.load()
+
+# Background training jobs (see training_jobs.py)
+TRAINING_MODE = os.getenv("TRAINING_MODE", "standard")
+# Cores an algorithm=auto tournament may use (0 for all)
+TOURNAMENT_CPU_BUDGET = int(os.getenv("TOURNAMENT_CPU_BUDGET", "0"))
+# Default budget of a hyperparameter search (fits, and seconds with 0 for none)
+SEARCH_MAX_FITS = int(os.getenv("SEARCH_MAX_FITS", "60"))
+SEARCH_TIME_BUDGET = float(os.getenv("SEARCH_TIME_BUDGET", "0"))
+# Read training datasets with compact column dtypes (see ingestion.py)
+COMPACT_DTYPES = os.getenv("COMPACT_DTYPES", "true").lower() == "true"
+# Encoding of high-cardinality categorical columns, "target" or "frequency" (see categorical_encoding.py)
+HIGH_CARDINALITY_ENCODING = os.getenv("HIGH_CARDINALITY_ENCODING", "target").lower()
+# Content-addressed store of uploaded training datasets (see dataset_registry.py)
+DATASET_REGISTRY = DatasetRegistry(DATASETS_DIR)
+TRAINING_JOBS = JobManager(
+    max_workers=int(os.getenv("TRAINING_SLOTS", "2")),
+    start_method=os.getenv("TRAINING_START_METHOD", "spawn"),
+    on_success=lambda result: register_trained_model(result),
+    # Job status every worker can read (see gunicorn.conf.py)
+    state_dir=os.path.join(MODELS_DIR, "jobs")
+)
+
+# Compiled inference for tree ensembles (see compiled_model.py)
+COMPILE_MODELS = os.getenv("COMPILE_MODELS", "false").lower() == "true"
+USE_COMPILED_MODELS = os.getenv("USE_COMPILED_MODELS", "true").lower() == "true"
+# Larger batches go to scikit-learn, whose multithreaded predict wins there
+COMPILED_MAX_ROWS = int(os.getenv("COMPILED_MAX_ROWS", "512"))
 
-# Models cache
-MODEL_CACHE = {}
+# Per-row prediction cache (see prediction_cache.py), off with PREDICTION_CACHE_MAX_ENTRIES=0
+PREDICTION_CACHE_MAX_ENTRIES = int(os.getenv("PREDICTION_CACHE_MAX_ENTRIES", "50000"))
+PREDICTION_CACHE = PredictionCache(
+    max_entries=PREDICTION_CACHE_MAX_ENTRIES,
+    ttl_seconds=float(os.getenv("PREDICTION_CACHE_TTL", "86400"))
+) if PREDICTION_CACHE_MAX_ENTRIES > 0 else None
 
 # Pydantic models for responses
 class TrainResponse(BaseModel):
@@ -109,6 +136,8 @@ class TrainResponse(BaseModel):
     trained_at: str
     training_time_seconds: float
     model_path: Optional[str] = None
+    leaderboard: Optional[List[Dict[str, Any]]] = None
+    lineage: Optional[Dict[str, Any]] = None
 
 class PredictResponse(BaseModel):
     prediction: Any
@@ -159,9 +188,7 @@ async def health_check():
             "randomforest": True,
             "extratrees": True,
             "adaboost": True,
-            "xgboost": XGBOOST_AVAILABLE,
-            "catboost": CATBOOST_AVAILABLE,
-            "lightgbm": LIGHTGBM_AVAILABLE
+            **availability()
         }
 
         return {
@@ -169,8 +196,11 @@ async def health_check():
             "time": datetime.now().isoformat(),
             "version": "1.2.0",
             "models_dir": MODELS_DIR,
-            "models_count": len([f for f in os.listdir(MODELS_DIR) if f.endswith('.joblib')]),
+            "models_count": len(MODEL_REGISTRY),
             "available_algorithms": algorithms,
+            "preload": dict(PRELOAD_STATE),
+            "worker_pid": os.getpid(),
+            "prediction_batching": PREDICTION_BATCHER.stats() if PREDICTION_BATCHER is not None else {"enabled": False},
             "environment": {
                 "debug": os.getenv("DEBUG", "false"),
                 "api_key_configured": API_KEY != "changeme"
@@ -184,751 +214,606 @@ async def health_check():
             "time": datetime.now().isoformat()
         }
 
-def calculate_confidence_interval(prob, n=100, confidence=0.95):
-    """Calculate confidence interval for a probability using Wilson score interval."""
-    if n <= 0:
-        return {"lower": prob, "upper": prob, "confidence": confidence}
-
-    z = stats.norm.ppf((1 + confidence) / 2)
-    factor = z / np.sqrt(n)
+def find_model_path(model_id):
+    """Locate the artifact for a model ID, or return None."""
+    return MODEL_REGISTRY.path_for(model_id)
 
-    # Wilson score interval
-    denominator = 1 + z**2/n
-    center = (prob + z**2/(2*n)) / denominator
-    interval = factor * np.sqrt(prob * (1 - prob) / n + z**2/(4*n**2)) / denominator
-
-    lower = max(0, center - interval)
-    upper = min(1, center + interval)
+def _read_model(model_id):
+    """Load a model from disk and build its input schema and compiled engine, for ModelCache.load."""
+    model_path = find_model_path(model_id)
+    if not model_path:
+        logger.error(f"Model with ID {model_id} not found")
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Model with ID {model_id} not found")
+
+    logger.info(f"Loading model from {model_path}")
+    stat = os.stat(model_path)
+    model_data = load_artifact(model_path, serving_only=True)
+    # Predictions cached for another artifact of this model are not reused (see prediction_cache.py)
+    model_data["_model_id"] = model_id
+    model_data["_artifact_identity"] = (model_path, stat.st_ino, stat.st_mtime_ns)
+    # Built here so that requests waiting on this load do not each build them
+    get_input_schema(model_data)
+    if USE_COMPILED_MODELS:
+        get_compiled_model(model_data)
+    return model_data, serving_size(model_path)
+
+def load_model_data(model_id):
+    """
+    Return model data from the cache, loading it from disk on a miss.
 
-    return {
-        "lower": float(lower),
-        "upper": float(upper), 
-        "confidence": confidence
-    }
+    Concurrent misses for the same model share one load. Blocks while
+    loading; request handlers use load_model_data_async.
+    """
+    model_data = MODEL_CACHE.get(model_id)
+    if model_data is not None:
+        return model_data
+    return MODEL_CACHE.load(model_id, lambda: _read_model(model_id))
+
+async def load_model_data_async(model_id):
+    """load_model_data that loads on a worker thread, so a cold model does not stall the event loop."""
+    model_data = MODEL_CACHE.get(model_id)
+    if model_data is not None:
+        return model_data
+    return await run_in_threadpool(MODEL_CACHE.load, model_id, lambda: _read_model(model_id))
+
+# Optional startup preloading of models into the cache
+PRELOAD_MODELS = [m.strip() for m in os.getenv("PRELOAD_MODELS", "").split(",") if m.strip()]
+PRELOAD_RECENT_PER_COURSE = int(os.getenv("PRELOAD_RECENT_PER_COURSE", "0"))
+PRELOAD_STATE = {
+    "status": "loading" if PRELOAD_MODELS or PRELOAD_RECENT_PER_COURSE > 0 else "disabled",
+    "requested": 0,
+    "loaded": 0,
+    "failed": {},
+    "seconds": None,
+    # True when the models were loaded in the gunicorn master and are shared by its workers
+    "shared": False
+}
+
+def preload_models(load_estimators=False):
+    """
+    Load the configured models into the cache and warm their input schemas.
 
-def identify_leaky_features(df, target_column):
+    With load_estimators, the scikit-learn pipelines of models with a
+    compiled engine are loaded too instead of on first use. Returns the IDs
+    of the models loaded.
+    """
+    start = time.time()
+    loaded = []
+    try:
+        model_ids = list(dict.fromkeys(PRELOAD_MODELS + MODEL_REGISTRY.recent_per_course(PRELOAD_RECENT_PER_COURSE)))
+        PRELOAD_STATE["requested"] = len(model_ids)
+        if MODEL_CACHE.max_entries and len(model_ids) > MODEL_CACHE.max_entries:
+            logger.warning(f"Preloading {len(model_ids)} models into a cache of {MODEL_CACHE.max_entries} entries")
+        for model_id in model_ids:
+            try:
+                model_data = load_model_data(model_id)
+                if load_estimators:
+                    serving_pipeline(model_data)
+                loaded.append(model_id)
+                PRELOAD_STATE["loaded"] += 1
+            except Exception as e:
+                detail = e.detail if isinstance(e, HTTPException) else str(e)
+                logger.warning(f"Could not preload model {model_id}: {detail}")
+                PRELOAD_STATE["failed"][model_id] = detail
+    finally:
+        # A failed preload must not keep the instance out of rotation forever
+        PRELOAD_STATE["seconds"] = round(time.time() - start, 3)
+        PRELOAD_STATE["status"] = "ready"
+    logger.warning(f"Preloaded {PRELOAD_STATE['loaded']} of {PRELOAD_STATE['requested']} models in {PRELOAD_STATE['seconds']}s")
+    return loaded
+
+def preload_shared_models():
     """
-    Identify and filter out leaky features that could lead to data leakage.
+    Preload models in the gunicorn master, before the workers are forked (see gunicorn.conf.py).
 
-    Returns:
-        filtered_df: DataFrame with leaky features removed
-        leaky_features: List of features identified as potentially leaky
+    The workers inherit the loaded models and share their memory
+    copy-on-write, and the compiled node arrays are memory-mapped from the
+    artifacts, so workers attach to one copy instead of loading their own.
+    The models are pinned: evicting one in a worker would free nothing while
+    the master still holds it, and reloading it would make a private copy.
     """
-    leaky_features = []
-
-    # Known patterns for leaky features
-    leaky_patterns = [
-        r'final.*score',
-        r'final.*grade',
-        r'letter_grade',
-        r'pass[_\s]?fail',
-        r'outcome',
-        r'result',
-        r'grade$',
-        r'total.*grade',
-        r'overall.*score',
-        r'final.*result',
-        r'completion.*status'
-    ]
+    if PRELOAD_STATE["status"] != "loading":
+        return
+    PRELOAD_STATE["shared"] = True
+    for model_id in preload_models(load_estimators=True):
+        MODEL_CACHE.pin(model_id)
+
+@app.on_event("startup")
+async def start_preload():
+    if PRELOAD_STATE["status"] == "loading":
+        # Runs in the background so /health answers while /ready reports 503
+        asyncio.get_running_loop().run_in_executor(None, preload_models)
+
+@app.get("/ready")
+async def readiness_check():
+    """Readiness probe: 200 once configured models are preloaded, 503 while preloading."""
+    if PRELOAD_STATE["status"] == "loading":
+        return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            content={"status": "loading", "preload": dict(PRELOAD_STATE)})
+    return {"status": "ready", "preload": dict(PRELOAD_STATE)}
+
+def register_trained_model(result):
+    """Record a finished training run in the model registry."""
+    MODEL_REGISTRY.register(result["model_id"], result["courseid"], result["model_path"],
+                            metadata=summarize_sidecar(result["sidecar"]))
+
+@app.on_event("shutdown")
+def shutdown_training_jobs():
+    TRAINING_JOBS.shutdown()
+
+def _remove_file(path):
+    if os.path.exists(path):
+        os.unlink(path)
+
+def _check_dataset_format(filename):
+    if dataset_format(filename) is None:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"Unsupported file format: {os.path.splitext(filename)[1].lower()}. "
+                                   f"Supported: {', '.join(sorted(SUPPORTED_FORMATS))}")
+
+def save_dataset_upload(dataset_file):
+    """Save an uploaded dataset to a temporary file for a training worker, rejecting unknown formats."""
+    _check_dataset_format(dataset_file.filename)
+    fd, temp_filepath = tempfile.mkstemp(suffix=os.path.splitext(dataset_file.filename)[1])
+    os.close(fd)
+    return save_upload(dataset_file, temp_filepath)
+
+def _parse_dtypes(dtypes):
+    """Column -> dtype mapping from the dtypes form field (a JSON object)."""
+    if not dtypes:
+        return None
+    try:
+        mapping = json.loads(dtypes)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"dtypes must be a JSON object: {str(e)}")
+    if not isinstance(mapping, dict) or not all(isinstance(v, str) for v in mapping.values()):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="dtypes must map column names to dtype names, e.g. {\"grade\": \"float64\"}")
+    return mapping
+
+def _dataset_source(dataset_file, dataset_id):
+    """
+    Where a training job reads its data: (dataset_path, filename, dataset_id, cleanup).
 
-    # Identify features matching leaky patterns
-    for col in df.columns:
-        col_lower = col.lower()
-        if col != target_column:  # Skip target column itself
-            for pattern in leaky_patterns:
-                if re.search(pattern, col_lower):
-                    leaky_features.append(col)
-                    break
+    Exactly one of an uploaded file or a registered dataset ID must be given.
+    """
+    if (dataset_file is None) == (not dataset_id):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="Provide either dataset_file or dataset_id")
+    if dataset_id:
+        meta = _registered_dataset(dataset_id)
+        return None, meta["filename"], dataset_id, None
+    temp_filepath = save_dataset_upload(dataset_file)
+    logger.info(f"Uploaded dataset saved to temporary file: {temp_filepath}")
+    return temp_filepath, dataset_file.filename, None, lambda: _remove_file(temp_filepath)
+
+def _registered_dataset(dataset_id):
+    try:
+        meta = DATASET_REGISTRY.get(dataset_id)
+    except DatasetError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    if meta is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Dataset with ID {dataset_id} not found")
+    return meta
+
+async def _register_dataset(dataset_file, course_id, parent_id, dtypes, compact_dtypes):
+    _check_dataset_format(dataset_file.filename)
+    dtypes_map = _parse_dtypes(dtypes)
+    fd, temp_filepath = tempfile.mkstemp(suffix=os.path.splitext(dataset_file.filename)[1])
+    os.close(fd)
+    try:
+        content_hash = await run_in_threadpool(save_hashed, dataset_file, temp_filepath)
+        meta, deduplicated = await run_in_threadpool(
+            DATASET_REGISTRY.add, temp_filepath, dataset_file.filename, content_hash,
+            course_id=course_id, parent_id=parent_id, dtypes=dtypes_map,
+            compact=COMPACT_DTYPES if compact_dtypes is None else compact_dtypes
+        )
+    except DatasetError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    finally:
+        _remove_file(temp_filepath)
+    return dict(meta, deduplicated=deduplicated)
+
+@app.post("/datasets", dependencies=[Depends(verify_api_key)])
+async def upload_dataset(
+    courseid: Optional[int] = Form(None, description="Course the dataset belongs to, as sent to /train"),
+    dtypes: str = Form("", description="JSON object of explicit column dtypes, e.g. {\"grade\": \"float64\"}"),
+    compact_dtypes: Optional[bool] = Form(None, description="Read columns in compact dtypes (defaults to COMPACT_DTYPES)"),
+    dataset_file: UploadFile = File(...)
+):
+    """
+    Register a training dataset and return its ID for /train and /retrain.
 
-    logger.warning(f"Identified {len(leaky_features)} potentially leaky features: {leaky_features}")
+    Datasets are stored under the hash of their content, course and dtype
+    options: uploading the same file again with the same course and options
+    returns the existing dataset (deduplicated=true) without parsing it.
+    """
+    return await _register_dataset(dataset_file, courseid, None, dtypes, compact_dtypes)
+
+@app.post("/datasets/{dataset_id}/append", dependencies=[Depends(verify_api_key)])
+async def append_dataset(
+    dataset_id: str,
+    dtypes: str = Form("", description="JSON object of explicit column dtypes, e.g. {\"grade\": \"float64\"}"),
+    compact_dtypes: Optional[bool] = Form(None, description="Read columns in compact dtypes (defaults to COMPACT_DTYPES)"),
+    dataset_file: UploadFile = File(..., description="New rows only, with the dataset's columns")
+):
+    """
+    Append rows to a registered dataset.
 
-    # Check for high correlation with target
-    if len(df) > 10:  # Only if we have enough samples
-        try:
-            target_series = df[target_column]
-            # For non-numeric targets, convert to numeric
-            if target_series.dtype == 'object' or target_series.dtype.name == 'category':
-                target_numeric = pd.factorize(target_series)[0]
-            else:
-                target_numeric = target_series.values
-
-            remaining_cols = [c for c in df.columns if c != target_column and c not in leaky_features]
-
-            for col in remaining_cols:
-                if df[col].dtype.kind in 'ifc':  # Only numeric columns
-                    try:
-                        # Calculate correlation
-                        corr = np.corrcoef(df[col].astype(float), target_numeric)[0, 1]
-                        if abs(corr) > 0.9:  # Extremely high correlation may indicate data leakage
-                            leaky_features.append(col)
-                            logger.warning(f"Detected highly correlated feature: {col} (correlation: {corr:.4f})")
-                    except:
-                        pass  # Skip on error
-        except Exception as e:
-            logger.warning(f"Error in correlation check: {str(e)}")
+    Returns a new dataset made of the parent's rows followed by the uploaded
+    ones; the parent dataset is left unchanged.
+    """
+    _registered_dataset(dataset_id)
+    return await _register_dataset(dataset_file, None, dataset_id, dtypes, compact_dtypes)
 
-    # Return the filtered DataFrame
-    filtered_df = df.drop(columns=leaky_features)
+@app.get("/datasets", dependencies=[Depends(verify_api_key)])
+async def list_datasets(courseid: Optional[int] = None):
+    """List registered datasets, newest first"""
+    return {"datasets": await run_in_threadpool(DATASET_REGISTRY.list, courseid)}
 
-    return filtered_df, leaky_features
+@app.get("/datasets/{dataset_id}", dependencies=[Depends(verify_api_key)])
+async def get_dataset(dataset_id: str):
+    """Get the metadata of a registered dataset"""
+    return _registered_dataset(dataset_id)
 
-@app.post("/train", response_model=TrainResponse, dependencies=[Depends(verify_api_key)])
+@app.post("/train", status_code=status.HTTP_202_ACCEPTED, dependencies=[Depends(verify_api_key)])
 async def train_model(
     courseid: int = Form(...),
     algorithm: str = Form("randomforest"),
     target_column: str = Form("final_outcome", description="Name of the target column"),
     test_size: float = Form(0.2, description="Test split proportion"),
     id_columns: str = Form("", description="Comma-separated list of ID columns to ignore"),
-    dataset_file: UploadFile = File(...)
+    wait: bool = Form(False, description="Wait for training to finish and return the TrainResponse"),
+    compile_model: Optional[bool] = Form(None, description="Export the model for compiled inference (defaults to COMPILE_MODELS)"),
+    training_mode: Optional[str] = Form(None, description="'standard' or 'single_pass' (defaults to TRAINING_MODE)"),
+    candidates: str = Form("", description="Comma-separated algorithms to compare with algorithm=auto (default: all available)"),
+    cpu_budget: Optional[int] = Form(None, description="Cores a tournament or search may use (defaults to TOURNAMENT_CPU_BUDGET)"),
+    search: bool = Form(False, description="Tune hyperparameters with a budgeted successive-halving search"),
+    search_max_fits: Optional[int] = Form(None, description="Search budget in model fits (defaults to SEARCH_MAX_FITS)"),
+    search_time_budget: Optional[float] = Form(None, description="Search budget in seconds (defaults to SEARCH_TIME_BUDGET)"),
+    dtypes: str = Form("", description="JSON object of explicit column dtypes, e.g. {\"grade\": \"float64\"}"),
+    compact_dtypes: Optional[bool] = Form(None, description="Read columns in compact dtypes (defaults to COMPACT_DTYPES)"),
+    high_cardinality_encoding: Optional[str] = Form(None, description="'target' or 'frequency' encoding of categorical columns with many categories (defaults to HIGH_CARDINALITY_ENCODING)"),
+    dataset_id: Optional[str] = Form(None, description="Registered dataset to train on instead of dataset_file (see POST /datasets)"),
+    dataset_file: Optional[UploadFile] = File(None)
 ):
-    start_time = time.time()
-    logger.info(f"Training request received for course {courseid} using {algorithm}")
+    """
+    Queue a training job and return its job ID.
 
-    try:
-        id_columns_list = [col.strip() for col in id_columns.split(',')] if id_columns else []
-        with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(dataset_file.filename)[1]) as temp_file:
-            shutil.copyfileobj(dataset_file.file, temp_file)
-            temp_filepath = temp_file.name
+    Training runs in a background process pool; poll GET /jobs/{job_id} for
+    progress and the result. With wait=true the request is held open until
+    the job finishes and the TrainResponse is returned directly. The data is
+    either uploaded as dataset_file or referred to by dataset_id.
+    """
+    logger.info(f"Training request received for course {courseid} using {algorithm}")
 
-        logger.info(f"Uploaded dataset saved to temporary file: {temp_filepath}")
+    id_columns_list = [col.strip() for col in id_columns.split(',')] if id_columns else []
+    dtypes_map = _parse_dtypes(dtypes)
+    dataset_path, filename, dataset_id, cleanup = _dataset_source(dataset_file, dataset_id)
 
-        request_data = {
+    job_id = TRAINING_JOBS.submit(
+        "training:run_training",
+        {
+            "dataset_path": dataset_path,
+            "filename": filename,
             "courseid": courseid,
+            "models_dir": MODELS_DIR,
             "algorithm": algorithm,
             "target_column": target_column,
+            "test_size": test_size,
             "id_columns": id_columns_list,
-            "test_size": test_size
-        }
-
-        file_extension = os.path.splitext(dataset_file.filename)[1].lower()
-        try:
-            if file_extension == '.csv':
-                df = pd.read_csv(temp_filepath)
-            elif file_extension == '.json':
-                df = pd.read_json(temp_filepath)
-            elif file_extension in ['.xlsx', '.xls']:
-                df = pd.read_excel(temp_filepath)
-            else:
-                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Unsupported file format: {file_extension}")
-            logger.info(f"Successfully loaded dataset with {len(df)} rows and {len(df.columns)} columns")
-        except Exception as e:
-            logger.error(f"Error loading dataset: {str(e)}")
-            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Error loading dataset: {str(e)}")
-
-        os.unlink(temp_filepath)
-
-        # Data quality checks
-        if len(df) < 30:
-            logger.warning(f"Very small dataset with only {len(df)} samples. Model may not be reliable.")
-
-        # Check for missing values
-        missing_pct = df.isnull().mean() * 100
-        high_missing_cols = missing_pct[missing_pct > 50].index.tolist()
-        if high_missing_cols:
-            logger.warning(f"Columns with >50% missing values: {high_missing_cols}")
-            # Drop columns with too many missing values
-            df = df.drop(columns=high_missing_cols)
-            logger.info(f"Dropped {len(high_missing_cols)} columns with too many missing values")
-
-        # Handle target column
-        if request_data["target_column"] not in df.columns:
-            possible_targets = ['final_outcome', 'pass', 'outcome', 'grade', 'result', 'status', 'final_grade', 'passed']
-            for col in possible_targets:
-                if col in df.columns:
-                    logger.info(f"Using '{col}' as target column instead of '{request_data['target_column']}'")
-                    request_data["target_column"] = col
-                    break
-            else:
-                request_data["target_column"] = df.columns[-1]
-                logger.warning(f"Target column not found, using last column '{request_data['target_column']}' as target")
-
-        # Preprocess target - convert to binary if needed
-        y = df[request_data["target_column"]]
-
-        # Handle non-numeric targets
-        if y.dtype == 'object' or y.dtype.name == 'category':
-            logger.info(f"Converting categorical target to numeric. Original values: {y.unique()}")
-
-            # Map common passing terms to 1, failing terms to 0
-            if len(y.unique()) > 2:
-                # Try to map based on common terms
-                pass_terms = ['pass', 'passed', 'complete', 'completed', 'success', 'successful', 'satisfactory', 'yes', 'y', 'true', 't']
-                fail_terms = ['fail', 'failed', 'incomplete', 'unsatisfactory', 'no', 'n', 'false', 'f']
-
-                def map_target(val):
-                    if not isinstance(val, str):
-                        return val
-                    val_lower = str(val).lower()
-                    if any(term in val_lower for term in pass_terms):
-                        return 1
-                    if any(term in val_lower for term in fail_terms):
-                        return 0
-                    return val
-
-                y = y.apply(map_target)
-
-                # If still not binary, use label encoder
-                if len(y.unique()) > 2:
-                    from sklearn.preprocessing import LabelEncoder
-                    le = LabelEncoder()
-                    y = le.fit_transform(y)
-                    logger.info(f"Applied LabelEncoder to target. New values: {np.unique(y)}")
+            "compile_model": COMPILE_MODELS if compile_model is None else compile_model,
+            "training_mode": training_mode or TRAINING_MODE,
+            "candidates": [c.strip().lower() for c in candidates.split(",") if c.strip()] or None,
+            "cpu_budget": TOURNAMENT_CPU_BUDGET if cpu_budget is None else cpu_budget,
+            "search": search,
+            "search_max_fits": search_max_fits or SEARCH_MAX_FITS,
+            "search_time_budget": SEARCH_TIME_BUDGET if search_time_budget is None else search_time_budget,
+            "dtypes": dtypes_map,
+            "compact_dtypes": COMPACT_DTYPES if compact_dtypes is None else compact_dtypes,
+            "dataset_id": dataset_id,
+            "datasets_dir": DATASETS_DIR,
+            "high_cardinality_encoding": (high_cardinality_encoding or HIGH_CARDINALITY_ENCODING).lower()
+        },
+        description={"courseid": courseid, "algorithm": algorithm, "filename": filename, "dataset_id": dataset_id},
+        cleanup=cleanup
+    )
 
-            else:
-                # Map the two unique values to 0 and 1
-                unique_vals = y.unique()
-                mapping = {unique_vals[0]: 0, unique_vals[1]: 1}
-                y = y.map(mapping)
-                logger.info(f"Mapped target values {unique_vals} to {list(mapping.values())}")
-
-        # For regression-like targets, convert to binary based on median
-        elif len(y.unique()) > 10:
-            median = y.median()
-            logger.info(f"Converting numeric target to binary using median {median} as threshold")
-            y = (y >= median).astype(int)
-
-        # Print target distribution
-        logger.info(f"Target distribution: {pd.Series(y).value_counts().to_dict()}")
-
-        # Remove ID columns and target column
-        X = df.drop(columns=[request_data["target_column"]] + request_data["id_columns"])
-
-        # NEW: Identify and remove leaky features
-        X, leaky_features = identify_leaky_features(X, request_data["target_column"])
-        logger.warning(f"Removed {len(leaky_features)} leaky features that could cause data leakage")
-
-        # Remove constant features
-        constant_features = [col for col in X.columns if X[col].nunique() <= 1]
-        if constant_features:
-            logger.info(f"Removing {len(constant_features)} constant features")
-            X = X.drop(columns=constant_features)
-
-        # Handle highly correlated features
-        if len(X.select_dtypes(include=['number']).columns) > 10:
-            numeric_X = X.select_dtypes(include=['number'])
-            try:
-                corr_matrix = numeric_X.corr().abs()
-                upper = corr_matrix.where(np.triu(np.ones(corr_matrix.shape), k=1).astype(bool))
-                # Lower the threshold to 0.85 from 0.95 to be more conservative
-                high_corr_cols = [column for column in upper.columns if any(upper[column] > 0.85)]
-
-                if high_corr_cols:
-                    logger.info(f"Removing {len(high_corr_cols)} highly correlated features")
-                    X = X.drop(columns=high_corr_cols)
-            except Exception as e:
-                logger.warning(f"Error computing correlations: {str(e)}")
+    return await _job_response(job_id, wait)
 
-        # Check if we have enough features left
-        if X.shape[1] < 3:
-            logger.warning(f"Very few features remain ({X.shape[1]}). Model may not be effective.")
-            # Add a warning note to return to the user
-            warning_note = f"Warning: Only {X.shape[1]} features remain after filtering. Model may have limited predictive power."
-        else:
-            warning_note = None
+async def _job_response(job_id, wait):
+    """202 with the job's status URL, or with wait=true the TrainResponse once the job finishes."""
+    if not wait:
+        return {"job_id": job_id, "status": TRAINING_JOBS.get(job_id)["status"], "status_url": f"/jobs/{job_id}"}
 
-        feature_names = X.columns.tolist()
-        logger.info(f"Final feature count: {len(feature_names)}")
-        logger.info(f"Features: {feature_names[:10]}{'...' if len(feature_names) > 10 else ''}")
+    try:
+        await asyncio.wrap_future(TRAINING_JOBS.future(job_id))
+    except Exception:
+        pass  # The job record carries the error
+    # The done callback that records the outcome may still be running
+    job = TRAINING_JOBS.get(job_id)
+    while job["finished_at"] is None:
+        await asyncio.sleep(0.01)
+        job = TRAINING_JOBS.get(job_id)
+    if job["status"] != JOB_SUCCEEDED:
+        raise HTTPException(status_code=job["status_code"] or status.HTTP_409_CONFLICT, detail=job["error"])
+    return JSONResponse(status_code=status.HTTP_200_OK,
+                        content=TrainResponse(**job["result"]).model_dump())
+
+@app.post("/retrain", status_code=status.HTTP_202_ACCEPTED, dependencies=[Depends(verify_api_key)])
+async def retrain_model(
+    model_id: str = Form(..., description="Model to continue training from"),
+    target_column: str = Form("final_outcome", description="Name of the target column"),
+    test_size: float = Form(0.2, description="Test split proportion"),
+    id_columns: str = Form("", description="Comma-separated list of ID columns to ignore"),
+    added_estimators: Optional[int] = Form(None, description="Trees or boosting rounds to add (default: a quarter of the model's)"),
+    compare_full: bool = Form(False, description="Also run a full retrain to measure the speedup"),
+    wait: bool = Form(False, description="Wait for retraining to finish and return the TrainResponse"),
+    compile_model: Optional[bool] = Form(None, description="Export the model for compiled inference (defaults to COMPILE_MODELS)"),
+    dtypes: str = Form("", description="JSON object of explicit column dtypes, e.g. {\"grade\": \"float64\"}"),
+    compact_dtypes: Optional[bool] = Form(None, description="Read columns in compact dtypes (defaults to COMPACT_DTYPES)"),
+    dataset_id: Optional[str] = Form(None, description="Registered dataset to train on instead of dataset_file (see POST /datasets)"),
+    dataset_file: Optional[UploadFile] = File(None)
+):
+    """
+    Queue a job that continues an existing model on a grown course dataset.
 
-        # Prepare preprocessing pipeline
-        numeric_cols = X.select_dtypes(include=['int64', 'float64']).columns.tolist()
-        categorical_cols = X.select_dtypes(include=['object', 'category', 'bool']).columns.tolist()
+    The retrained model is saved under a new model ID with its lineage; the
+    parent model is left unchanged. Takes its data and responds like /train.
+    """
+    entry = MODEL_REGISTRY.get(model_id)
+    if not entry:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Model with ID {model_id} not found")
+    logger.info(f"Retraining request received for model {model_id} of course {entry['course_id']}")
+
+    dtypes_map = _parse_dtypes(dtypes)
+    dataset_path, filename, dataset_id, cleanup = _dataset_source(dataset_file, dataset_id)
+
+    job_id = TRAINING_JOBS.submit(
+        "retraining:run_retraining",
+        {
+            "dataset_path": dataset_path,
+            "filename": filename,
+            "parent_model_id": model_id,
+            "parent_model_path": MODEL_REGISTRY.resolve(entry),
+            "courseid": entry["course_id"],
+            "models_dir": MODELS_DIR,
+            "target_column": target_column,
+            "test_size": test_size,
+            "id_columns": [col.strip() for col in id_columns.split(',')] if id_columns else [],
+            "added_estimators": added_estimators,
+            "compile_model": COMPILE_MODELS if compile_model is None else compile_model,
+            "compare_full": compare_full,
+            "dtypes": dtypes_map,
+            "compact_dtypes": COMPACT_DTYPES if compact_dtypes is None else compact_dtypes,
+            "dataset_id": dataset_id,
+            "datasets_dir": DATASETS_DIR
+        },
+        description={"courseid": entry["course_id"], "retrain_from": model_id, "filename": filename,
+                     "dataset_id": dataset_id},
+        cleanup=cleanup
+    )
+    return await _job_response(job_id, wait)
+
+@app.get("/jobs", dependencies=[Depends(verify_api_key)])
+async def list_jobs():
+    """List recent training jobs"""
+    return {"jobs": TRAINING_JOBS.list(), **TRAINING_JOBS.stats()}
+
+@app.get("/jobs/{job_id}", dependencies=[Depends(verify_api_key)])
+async def get_job(job_id: str):
+    """Get the status, progress and result of a training job"""
+    job = TRAINING_JOBS.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Job with ID {job_id} not found")
+    return job
+
+@app.delete("/jobs/{job_id}", dependencies=[Depends(verify_api_key)])
+async def cancel_job(job_id: str):
+    """Cancel a queued or running training job"""
+    job = TRAINING_JOBS.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Job with ID {job_id} not found")
+    return job
+
+def prepare_input(model_data, records):
+    """Build the model's aligned, typed input frame from raw feature records."""
+    schema = get_input_schema(model_data)
 
-        logger.info(f"Numeric features: {len(numeric_cols)}, Categorical features: {len(categorical_cols)}")
+    try:
+        if not schema.columns:
+            raise ValueError("No valid features found in input data")
 
-        # Create robust preprocessing pipeline
-        try:
-            encoder = OneHotEncoder(drop='first', sparse_output=False, handle_unknown='ignore')
-        except TypeError:
-            # For older scikit-learn versions
-            encoder = OneHotEncoder(drop='first', sparse=False, handle_unknown='ignore')
-
-        # Use RobustScaler for better handling of outliers
-        preprocessor = ColumnTransformer(
-            transformers=[
-                ('num', Pipeline([
-                    ('imputer', SimpleImputer(strategy='median')), 
-                    ('scaler', RobustScaler())
-                ]), numeric_cols),
-                ('cat', Pipeline([
-                    ('imputer', SimpleImputer(strategy='most_frequent')), 
-                    ('encoder', encoder)
-                ]), categorical_cols)
-            ],
-            remainder='drop'
-        )
+        # Positional rows are matched to the training column order
+        records = [dict(zip(schema.columns, r)) if isinstance(r, (list, tuple)) else r for r in records]
 
-        # Handle class imbalance
-        class_counts = pd.Series(y).value_counts().to_dict()
-        if len(class_counts) > 1:
-            imbalance_ratio = max(class_counts.values()) / min(class_counts.values())
-            class_weight = 'balanced' if imbalance_ratio > 3 else None
-            if imbalance_ratio > 3:
-                logger.warning(f"Significant class imbalance detected: ratio {imbalance_ratio:.2f}. Applying class weight balancing.")
-        else:
-            logger.warning("Only one class found in target. Model will not be useful for prediction.")
-            class_weight = None
+        missing = schema.missing_columns(records)
+        if missing:
+            logger.info(f"Filling {len(missing)} missing features with defaults: {missing[:10]}")
 
-        # Train-test split with stratification when possible
-        try:
-            # NEW: Use stratified k-fold cross-validation for better evaluation
-            X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=request_data["test_size"], 
-                                                              random_state=42, stratify=y)
-        except ValueError:
-            logger.warning("Stratified split failed, falling back to random split")
-            X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=request_data["test_size"], 
-                                                              random_state=42)
-
-        # Define models with your specified algorithms
-        models = {}
-
-        # Random Forest Classifier (Always available)
-        models['randomforest'] = RandomForestClassifier(
-            n_estimators=100, 
-            max_depth=None,  # Changed from 10 to None to prevent underfitting
-            min_samples_split=5, 
-            min_samples_leaf=2, 
-            class_weight=class_weight, 
-            random_state=42,
-            n_jobs=-1  # Use all cores
-        )
+        input_df = schema.build_frame(records)
+        logger.info(f"Input data shape: {input_df.shape}")
 
-        # Extra Trees Classifier (Always available)
-        models['extratrees'] = ExtraTreesClassifier(
-            n_estimators=100, 
-            max_depth=None,  # Changed from 10 to None
-            min_samples_split=5, 
-            min_samples_leaf=2, 
-            class_weight=class_weight, 
-            random_state=42,
-            n_jobs=-1
-        )
+    except Exception as e:
+        logger.error(f"Error preparing input data: {str(e)}")
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid feature format: {str(e)}")
 
-        # AdaBoost Classifier (Always available)
-        models['adaboost'] = AdaBoostClassifier(
-            n_estimators=100, 
-            learning_rate=0.1, 
-            random_state=42
-        )
+    return input_df
 
-        # XGBoost Classifier (If available)
-        if XGBOOST_AVAILABLE:
-            models['xgboost'] = XGBClassifier(
-                n_estimators=100,
-                max_depth=6,
-                learning_rate=0.1,
-                subsample=0.8,
-                colsample_bytree=0.8,
-                random_state=42,
-                eval_metric='logloss',
-                n_jobs=-1,
-                # For newer versions
-                use_label_encoder=False if hasattr(XGBClassifier, 'use_label_encoder') else None,
-                enable_categorical=True if hasattr(XGBClassifier, 'enable_categorical') else False
-            )
-
-        # CatBoost Classifier (If available)
-        if CATBOOST_AVAILABLE:
-            models['catboost'] = CatBoostClassifier(
-                iterations=100,
-                depth=6,
-                learning_rate=0.1,
-                loss_function='Logloss',
-                verbose=0,
-                random_seed=42
-            )
-
-        # LightGBM Classifier (If available)
-        if LIGHTGBM_AVAILABLE:
-            models['lightgbm'] = LGBMClassifier(
-                n_estimators=100,
-                max_depth=6,
-                learning_rate=0.1,
-                subsample=0.8,
-                colsample_bytree=0.8,
-                random_state=42,
-                n_jobs=-1
-            )
-
-        # Select model based on algorithm parameter or fall back to RandomForest
-        if request_data["algorithm"] not in models:
-            logger.warning(f"Requested algorithm '{request_data['algorithm']}' not available, falling back to RandomForest")
-            request_data["algorithm"] = 'randomforest'
-
-        model = models[request_data["algorithm"]]
-
-        # Create pipeline with preprocessor and classifier
-        pipeline = Pipeline([
-            ('preprocessor', preprocessor), 
-            ('classifier', model)
-        ])
-
-        # Perform k-fold cross-validation (k=5)
-        logger.info("Performing 5-fold cross-validation with stratification")
-        cv = StratifiedKFold(n_splits=5, shuffle=True, random_state=42)
-        cv_scores = cross_val_score(pipeline, X, y, cv=cv, scoring='accuracy')
-        cv_accuracy, cv_std = np.mean(cv_scores), np.std(cv_scores)
-        logger.info(f"Cross-validation accuracy: {cv_accuracy:.4f} ± {cv_std:.4f}")
-
-        # Train the model
-        logger.info(f"Training {request_data['algorithm']} model")
-        pipeline.fit(X_train, y_train)
-        logger.info("Model training completed")
-
-        # Special handling for CatBoost
-        if request_data['algorithm'] == 'catboost':
-            # CatBoost doesn't work well with scikit-learn's pipeline for feature names
-            # Save categorical features for CatBoost
-            cat_features = []
-            if categorical_cols:
-                try:
-                    # Get categorical feature indices after preprocessing
-                    cat_features = list(range(len(categorical_cols)))
-                    pipeline.named_steps['classifier'].cat_features = cat_features
-                except Exception as e:
-                    logger.warning(f"Error setting cat_features for CatBoost: {e}")
-
-        # Apply probability calibration for better confidence estimates
-        # Store the original pipeline and use a separate calibrated model
-        original_pipeline = pipeline
-        calibrated_pipeline = None
-
-        if hasattr(original_pipeline, 'predict_proba'):
-            logger.info("Applying probability calibration for reliable confidence estimates")
-            try:
-                # Create a new calibrated classifier
-                calibrated_model = CalibratedClassifierCV(
-                    base_estimator=None,  # Use prefit=False to avoid the named_steps issue
-                    method='sigmoid',  # Changed from isotonic to sigmoid for smaller datasets
-                    cv=3,  # Use 3-fold CV
-                    n_jobs=-1
-                )
-
-                # Apply preprocessor to get transformed data
-                X_train_transformed = original_pipeline.named_steps['preprocessor'].transform(X_train)
-                X_test_transformed = original_pipeline.named_steps['preprocessor'].transform(X_test)
-
-                # Use the transformed data to fit the calibrator
-                calibrated_model.fit(X_train_transformed, y_train)
-
-                # Create a calibrated pipeline
-                calibrated_pipeline = Pipeline([
-                    ('preprocessor', original_pipeline.named_steps['preprocessor']),
-                    ('calibrated_classifier', calibrated_model)
-                ])
-
-                logger.info("Probability calibration completed successfully")
-            except Exception as e:
-                logger.warning(f"Probability calibration failed: {str(e)}")
-                logger.warning("Using uncalibrated model instead")
-                calibrated_pipeline = None
-
-        # Generate predictions and evaluate model
-        if calibrated_pipeline is not None:
-            # Use calibrated predictions
-            y_pred = calibrated_pipeline.predict(X_test)
-            y_pred_proba = calibrated_pipeline.predict_proba(X_test)
-
-            # Store both pipelines
-            pipeline.calibrated_pipeline = calibrated_pipeline
+def _score_frame(model_data, input_df, as_arrays):
+    logger.info("Making prediction")
+    try:
+        compiled = get_compiled_model(model_data) if USE_COMPILED_MODELS and len(input_df) <= COMPILED_MAX_ROWS else None
+        if compiled is not None:
+            # Exported at training time and checked against the pipeline it replaces
+            estimator = compiled
         else:
-            # Use the regular pipeline
-            y_pred = pipeline.predict(X_test)
-            y_pred_proba = pipeline.predict_proba(X_test)
-            pipeline.calibrated_pipeline = None
-
-        # ================================================================= #
-        # NEW: ADDED CODE FOR TEST DATA CONFIDENCE ANALYSIS                 #
-        # ================================================================= #
-        try:
-            # Get the confidence score for each prediction (the max probability in each row)
-            confidence_scores = np.max(y_pred_proba, axis=1)
-
-            # Create a DataFrame to analyze the results
-            results_df = pd.DataFrame({
-                'true_label': y_test,
-                'predicted_label': y_pred,
-                'confidence': confidence_scores
-            })
-
-            # Add a column to see if the prediction was correct
-            results_df['is_correct'] = (results_df['true_label'] == results_df['predicted_label'])
-
-            # Log the analysis to the console
-            logger.info("Confidence score analysis for the test set:")
-            if not results_df[results_df['is_correct']].empty:
-                logger.info("Scores for CORRECT predictions:\n" + str(results_df[results_df['is_correct']]['confidence'].describe()))
-            if not results_df[~results_df['is_correct']].empty:
-                logger.info("Scores for INCORRECT predictions (borderline cases):\n" + str(results_df[~results_df['is_correct']]['confidence'].describe()))
-        except Exception as e:
-            logger.warning(f"Could not perform confidence analysis on test data: {str(e)}")
-        # ================================================================= #
-        # END OF NEW CODE                                                   #
-        # ================================================================= #
-
-        # Calculate comprehensive metrics
-        metrics = {
-            "accuracy": float(accuracy_score(y_test, y_pred)),
-            "cv_accuracy": float(cv_accuracy),
-            "cv_std": float(cv_std),
-            "precision": float(precision_score(y_test, y_pred, average='weighted', zero_division=0)),
-            "recall": float(recall_score(y_test, y_pred, average='weighted', zero_division=0)),
-            "f1": float(f1_score(y_test, y_pred, average='weighted', zero_division=0)),
-            "k_folds": 5,  # Explicitly record k value used for cross-validation
-            "removed_leaky_features": leaky_features  # Add the leaky features to metrics
-        }
-
-        # Add warning if necessary
-        if warning_note:
-            metrics["warning"] = warning_note
+            # The calibrated pipeline if the model has one (see model_artifact.py)
+            logger.info("Using scikit-learn pipeline for prediction")
+            estimator = serving_pipeline(model_data)
 
-        # Compute ROC AUC for binary classification
-        if len(np.unique(y)) == 2:
-            try:
-                metrics["roc_auc"] = float(roc_auc_score(y_test, y_pred_proba[:, 1]))
-            except (ValueError, IndexError) as e:
-                logger.warning(f"ROC AUC calculation failed: {str(e)}")
-                metrics["roc_auc"] = None
-
-        # Check for overfitting
-        train_acc = accuracy_score(y_train, pipeline.predict(X_train))
-        test_acc = metrics["accuracy"]
-        overfitting_ratio = train_acc / max(test_acc, 0.001)
-        metrics["overfitting_warning"] = overfitting_ratio > 1.2
-        metrics["overfitting_ratio"] = float(overfitting_ratio)
-        metrics["train_accuracy"] = float(train_acc)
-        metrics["test_accuracy"] = float(test_acc)
-
-        if metrics["overfitting_warning"]:
-            logger.warning(f"Model may be overfitting: train accuracy={train_acc:.4f}, test accuracy={test_acc:.4f}")
-
-        # Extract feature importance if available
-        feature_importance = None
-
-        # Method to get feature importance from different model types
-        if hasattr(pipeline.named_steps['classifier'], 'feature_importances_'):
-            # Random Forest, XGBoost, LightGBM, etc.
-            feature_importance = pipeline.named_steps['classifier'].feature_importances_
-        elif hasattr(pipeline.named_steps['classifier'], 'coef_'):
-            # Linear models
-            feature_importance = np.abs(pipeline.named_steps['classifier'].coef_[0])
-        elif hasattr(pipeline.named_steps['classifier'], 'feature_importance_'):
-            # CatBoost
-            feature_importance = pipeline.named_steps['classifier'].feature_importance_
-
-        if feature_importance is not None:
-            try:
-                # Get transformed feature names if possible
-                feature_names_out = []
-
-                # Try to get column names after preprocessing
-                try:
-                    # For newer scikit-learn versions
-                    if hasattr(pipeline.named_steps['preprocessor'], 'get_feature_names_out'):
-                        feature_names_out = pipeline.named_steps['preprocessor'].get_feature_names_out()
-                    # For older scikit-learn versions
-                    elif hasattr(pipeline.named_steps['preprocessor'], 'get_feature_names'):
-                        feature_names_out = pipeline.named_steps['preprocessor'].get_feature_names()
-                    else:
-                        # Create generic feature names
-                        feature_names_out = [f"feature_{i}" for i in range(len(feature_importance))]
-                except Exception as e:
-                    logger.warning(f"Error getting transformed feature names: {str(e)}")
-                    feature_names_out = [f"feature_{i}" for i in range(len(feature_importance))]
-
-                # Ensure lengths match
-                if len(feature_names_out) == len(feature_importance):
-                    importance_dict = dict(zip(feature_names_out, feature_importance))
-                    sorted_features = sorted(importance_dict.items(), key=lambda x: x[1], reverse=True)
-                    metrics["top_features"] = {str(k): float(v) for k, v in sorted_features[:10]}
-                else:
-                    logger.warning(f"Feature name length mismatch: {len(feature_names_out)} names, {len(feature_importance)} importances")
-                    # Use generic feature names
-                    top_indices = np.argsort(feature_importance)[-10:][::-1]
-                    metrics["top_features"] = {f"feature_{i}": float(feature_importance[i]) for i in top_indices}
-            except Exception as e:
-                logger.warning(f"Error extracting feature importance: {str(e)}")
-                metrics["top_features"] = {}
+        probabilities = estimator.predict_proba(input_df)
+        if as_arrays:
+            predictions = estimator.classes_[np.argmax(probabilities, axis=1)]
         else:
-            logger.info("Model does not support feature importance")
-            metrics["top_features"] = {}
+            predictions = estimator.predict(input_df)
 
-        # Add confusion matrix
-        try:
-            cm = confusion_matrix(y_test, y_pred)
-            metrics["confusion_matrix"] = cm.tolist()
-        except Exception as e:
-            logger.warning(f"Error computing confusion matrix: {str(e)}")
-
-        # Calculate confidence intervals for predictions
-        # Use the effective sample size for confidence intervals
-        effective_n = min(len(X_test), 100)  # Cap at 100 to avoid overconfidence
-        metrics["confidence_interval"] = calculate_confidence_interval(
-            metrics["accuracy"], 
-            n=effective_n, 
-            confidence=0.95
-        )
+        logger.info(f"Prediction successful")
+    except Exception as e:
+        logger.error(f"Error during prediction: {str(e)}")
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Error during prediction: {str(e)}")
 
-        # Generate unique model ID and save the model
-        model_id = str(uuid.uuid4())
-        course_models_dir = os.path.join(MODELS_DIR, f"course_{request_data['courseid']}")
-        os.makedirs(course_models_dir, exist_ok=True)
-        model_path = os.path.join(course_models_dir, f"{model_id}.joblib")
-
-        # Store model metadata
-        model_data = {
-            'pipeline': pipeline,
-            'feature_names': feature_names,
-            'algorithm': request_data["algorithm"],
-            'trained_at': datetime.now().isoformat(),
-            'target_classes': list(np.unique(y)),
-            'metrics': metrics,
-            'cv_scores': cv_scores.tolist(),
-            'effective_sample_size': effective_n,
-            'leaky_features': leaky_features  # Store the leaky features for reference
-        }
+    return predictions, probabilities
 
-        # Save model to disk and cache
-        joblib.dump(model_data, model_path)
-        MODEL_CACHE[model_id] = model_data
-        logger.info(f"Model saved to {model_path}")
+def score_records(model_data, records, as_arrays=False):
+    """
+    Score a list of feature records, taking the rows scored before from the prediction cache.
 
-        # Calculate training time
-        training_time = time.time() - start_time
-        logger.info(f"Training completed in {training_time:.2f} seconds")
+    Returns (predictions, probabilities, cache_hits); see predict_records.
+    Only the rows that miss the cache are scored.
+    """
+    input_df = prepare_input(model_data, records)
+    model_id = model_data.get("_model_id")
+    if PREDICTION_CACHE is None or model_id is None:
+        predictions, probabilities = _score_frame(model_data, input_df, as_arrays)
+        hits = 0
+    else:
+        version = model_data["_artifact_identity"]
+        fingerprints = row_fingerprints(input_df)
+        cached = PREDICTION_CACHE.get_many(model_id, version, fingerprints)
+        misses = [i for i, entry in enumerate(cached) if entry is None]
+        hits = len(cached) - len(misses)
+        if misses:
+            miss_df = input_df.iloc[misses] if hits else input_df
+            scored_predictions, scored_probabilities = _score_frame(model_data, miss_df, as_arrays)
+            PREDICTION_CACHE.put_many(model_id, version, fingerprints[misses],
+                                      scored_predictions, scored_probabilities)
+        if not hits:
+            predictions, probabilities = scored_predictions, scored_probabilities
+        else:
+            # Cached rows and freshly scored rows back in the input order
+            if misses:
+                for i, prediction, row in zip(misses, scored_predictions, scored_probabilities):
+                    cached[i] = (prediction, row)
+            predictions = np.array([entry[0] for entry in cached])
+            probabilities = np.vstack([entry[1] for entry in cached])
+            logger.info(f"Prediction cache: {hits} of {len(cached)} rows")
+
+    if not as_arrays:
+        return predictions.tolist(), probabilities.tolist(), hits
+    return predictions, probabilities, hits
+
+def predict_records(model_data, records, as_arrays=False):
+    """
+    Score a list of feature records.
 
-        # Return comprehensive model information
-        return {
-            "model_id": model_id,
-            "algorithm": request_data["algorithm"],
-            "metrics": metrics,
-            "feature_names": [str(f) for f in feature_names],
-            "target_classes": [int(c) if isinstance(c, (np.integer, np.int64, np.int32)) else c for c in np.unique(y)],
-            "trained_at": datetime.now().isoformat(),
-            "training_time_seconds": training_time,
-            "model_path": model_path
-        }
-    except HTTPException:
-        raise
-    except Exception as e:
-        logger.exception(f"Error training model: {str(e)}")
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Error training model: {str(e)}")
+    Returns (predictions, probabilities) as lists, or as NumPy arrays with
+    as_arrays=True, in which case predictions are derived from a single
+    predict_proba pass instead of a separate predict call.
+    """
+    predictions, probabilities, _ = score_records(model_data, records, as_arrays)
+    return predictions, probabilities
+
+def positive_class_probabilities(target_classes, probabilities):
+    """Positive-class column for binary models, otherwise the highest class probability per row."""
+    if len(target_classes) == 2:
+        # Find the positive class index (usually 1 in binary classification)
+        positive_class_idx = 1 if 1 in target_classes else 0
+        return probabilities[:, positive_class_idx]
+    return probabilities.max(axis=1)
+
+# Optional micro-batching of concurrent single-row predictions (see prediction_batcher.py)
+PREDICTION_BATCHER = PredictionBatcher(
+    predict_records,
+    window_ms=float(os.getenv("PREDICT_BATCH_WINDOW_MS", "5")),
+    max_batch_size=int(os.getenv("PREDICT_BATCH_MAX_SIZE", "64"))
+) if os.getenv("PREDICT_BATCHING", "false").lower() == "true" else None
+
+@app.on_event("shutdown")
+def shutdown_prediction_batcher():
+    if PREDICTION_BATCHER is not None:
+        PREDICTION_BATCHER.shutdown()
+
+def _prediction_cache_report(hits, rows):
+    """Rows of this request served from the prediction cache, and the cache's hit ratio so far."""
+    if PREDICTION_CACHE is None:
+        return None
+    return {
+        "hits": hits,
+        "rows": rows,
+        "hit_ratio": round(PREDICTION_CACHE.hit_ratio(), 4)
+    }
 
 @app.post("/predict", dependencies=[Depends(verify_api_key)])
 async def predict(request: dict):
     try:
         model_id = request.get("model_id")
         features = request.get("features")
+        layout = request.get("layout", "rows")
 
         if not model_id:
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="model_id is required")
         if not features:
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="features are required")
+        if layout not in ("rows", "columns"):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="layout must be 'rows' or 'columns'")
 
         is_batch = isinstance(features, list) and len(features) > 0 and isinstance(features[0], (list, dict))
         logger.info(f"Prediction request for model {model_id} ({'batch' if is_batch else 'single'})")
 
         # Load model from cache or disk
-        model_data = MODEL_CACHE.get(model_id)
-        if not model_data:
-            found = False
-            for root, _, files in os.walk(MODELS_DIR):
-                if f"{model_id}.joblib" in files:
-                    model_path = os.path.join(root, f"{model_id}.joblib")
-                    logger.info(f"Loading model from {model_path}")
-                    model_data = joblib.load(model_path)
-                    MODEL_CACHE[model_id] = model_data
-                    found = True
-                    break
-            if not found:
-                logger.error(f"Model with ID {model_id} not found")
-                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Model with ID {model_id} not found")
+        model_data = await load_model_data_async(model_id)
 
-        pipeline = model_data['pipeline']
-        feature_names = model_data['feature_names']
         effective_n = model_data.get('effective_sample_size', 50)  # Default to 50 if not stored
         algorithm = model_data.get('algorithm', 'unknown')
-        leaky_features = model_data.get('leaky_features', [])
 
         logger.info(f"Model algorithm: {algorithm}")
-        logger.info(f"Model feature names: {len(feature_names)} features")
-
-        # Prepare input data
-        try:
-            input_df = pd.DataFrame([features] if not is_batch else features)
-
-            # Remove any leaky features from input data
-            for lf in leaky_features:
-                if lf in input_df.columns:
-                    logger.info(f"Removing leaky feature {lf} from prediction input")
-                    input_df = input_df.drop(columns=[lf])
-
-            # Handle missing columns
-            for feat in feature_names:
-                if feat not in input_df.columns:
-                    logger.info(f"Adding missing feature {feat} with default value 0")
-                    input_df[feat] = 0
-
-            # Select only columns that match the model's feature names
-            valid_features = [f for f in feature_names if f in input_df.columns]
-            input_df = input_df[valid_features]
-
-            # Log shape info for debugging
-            logger.info(f"Input data shape: {input_df.shape}")
-
-            # Additional validation to ensure data matches model expectations
-            if input_df.shape[1] == 0:
-                raise ValueError("No valid features found in input data")
-
-        except Exception as e:
-            logger.error(f"Error preparing input data: {str(e)}")
-            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid feature format: {str(e)}")
 
         # Make prediction
-        logger.info("Making prediction")
-        try:
-            # Check if we should use calibrated pipeline
-            if hasattr(pipeline, 'calibrated_pipeline') and pipeline.calibrated_pipeline is not None:
-                logger.info("Using calibrated pipeline for prediction")
-                calibrated_pipeline = pipeline.calibrated_pipeline
-                predictions = calibrated_pipeline.predict(input_df).tolist()
-                probabilities = calibrated_pipeline.predict_proba(input_df).tolist()
-            else:
-                # Use regular pipeline
-                logger.info("Using regular pipeline for prediction")
-                predictions = pipeline.predict(input_df).tolist()
-                probabilities = pipeline.predict_proba(input_df).tolist()
-
-            logger.info(f"Prediction successful")
-        except Exception as e:
-            logger.error(f"Error during prediction: {str(e)}")
-            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Error during prediction: {str(e)}")
+        if is_batch:
+            predictions, probabilities, cache_hits = score_records(model_data, features, as_arrays=True)
+        elif PREDICTION_BATCHER is not None:
+            # Coalesce with concurrent single-row requests for the same model
+            prediction, row_probabilities = await PREDICTION_BATCHER.submit(model_id, model_data, features)
+            predictions, probabilities = [prediction], [row_probabilities]
+            # Looked up for the whole micro-batch
+            cache_hits = None
+        else:
+            predictions, probabilities, cache_hits = score_records(model_data, [features])
+        cache_report = _prediction_cache_report(cache_hits, len(predictions))
 
         # Process results based on batch or single prediction
         if is_batch:
             # For batch predictions, get probability of positive class
             target_classes = model_data['target_classes']
+            # Get probabilities for the positive class and their intervals in one pass
+            positive_probs = positive_class_probabilities(target_classes, probabilities)
+            lower, upper = wilson_interval_arrays(positive_probs, n=effective_n, confidence=0.95)
 
-            # Find the positive class index (usually 1 in binary classification)
-            positive_class_idx = 1 if len(target_classes) == 2 and 1 in target_classes else 0
-
-            # Get probabilities for the positive class
-            positive_probs = [probs[positive_class_idx] for probs in probabilities] if len(target_classes) == 2 else [max(probs) for probs in probabilities]
-
-            # Calculate confidence intervals for each prediction
-            confidence_intervals = [
-                calculate_confidence_interval(prob, n=effective_n) for prob in positive_probs
-            ]
-
-            return {
-                "predictions": predictions,
-                "probabilities": positive_probs,
-                "confidence_intervals": confidence_intervals,
+            response = {
+                "predictions": predictions.tolist(),
+                "probabilities": positive_probs.tolist(),
                 "model_id": model_id,
                 "algorithm": algorithm,
                 "prediction_time": datetime.now().isoformat(),
                 "features": features  # Return the batch of features
             }
+            if cache_report is not None:
+                response["prediction_cache"] = cache_report
+            if layout == "columns":
+                # Parallel arrays instead of one dict per row
+                response["confidence_intervals"] = {
+                    "lower": lower.tolist(),
+                    "upper": upper.tolist(),
+                    "confidence": 0.95
+                }
+                response["layout"] = "columns"
+            else:
+                response["confidence_intervals"] = [
+                    {"lower": lo, "upper": hi, "confidence": 0.95}
+                    for lo, hi in zip(lower.tolist(), upper.tolist())
+                ]
+            return response
         else:
             # For single prediction
             prediction = predictions[0]
@@ -954,7 +839,7 @@ async def predict(request: dict):
             confidence_interval = calculate_confidence_interval(probability, n=effective_n)
 
             # Enhanced prediction response with confidence interval
-            return {
+            response = {
                 "prediction": prediction,
                 "probability": probability,
                 "probabilities": probabilities[0],
@@ -964,6 +849,9 @@ async def predict(request: dict):
                 "prediction_time": datetime.now().isoformat(),
                 "features": features  # Return the input features
             }
+            if cache_report is not None:
+                response["prediction_cache"] = cache_report
+            return response
 
     except HTTPException:
         raise
@@ -971,40 +859,266 @@ async def predict(request: dict):
         logger.exception(f"Unhandled error in prediction: {str(e)}")
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Error making prediction: {str(e)}")
 
+def load_model_metadata(model_id, model_path, course_id=None):
+    """
+    Return the metadata sidecar for a model.
+
+    Artifacts trained before sidecars existed are loaded once and backfilled.
+    """
+    sidecar = read_sidecar(model_path)
+    if sidecar is None:
+        logger.info(f"Backfilling metadata sidecar for model {model_id}")
+        sidecar = sidecar_from_model_data(model_id, course_id, load_artifact(model_path))
+        write_sidecar(model_path, sidecar)
+    return sidecar
+
+BULK_PREDICT_CHUNK_SIZE = int(os.getenv("BULK_PREDICT_CHUNK_SIZE", "500"))
+BULK_PREDICT_MAX_CHUNK_SIZE = 5000
+
+def _bulk_row(row):
+    """Split a bulk input row into (userid, features)."""
+    if not isinstance(row, dict):
+        raise ValueError("each row must be an object with userid and features")
+    userid = row.get("userid", row.get("user_id"))
+    features = row.get("features")
+    if not isinstance(features, dict):
+        raise ValueError("features must be an object")
+    return userid, features
+
+def score_bulk_chunk(model_data, chunk):
+    """Score one chunk of (userid, features) rows and return the NDJSON records for it."""
+    effective_n = model_data.get('effective_sample_size', 50)
+    try:
+        predictions, probabilities = predict_records(model_data, [features for _, features in chunk], as_arrays=True)
+    except HTTPException:
+        if len(chunk) == 1:
+            raise
+        # Isolate the rows that cannot be scored instead of failing the whole chunk
+        records = []
+        for row in chunk:
+            try:
+                records.extend(score_bulk_chunk(model_data, [row]))
+            except HTTPException as e:
+                records.append({"userid": row[0], "error": e.detail})
+        return records
+
+    positive_probs = positive_class_probabilities(model_data['target_classes'], probabilities)
+    lower, upper = wilson_interval_arrays(positive_probs, n=effective_n, confidence=0.95)
+    return [
+        {
+            "userid": userid,
+            "prediction": prediction,
+            "probability": probability,
+            "probabilities": row_probabilities,
+            "confidence_interval": {"lower": lo, "upper": hi, "confidence": 0.95}
+        }
+        for (userid, _), prediction, probability, row_probabilities, lo, hi in zip(
+            chunk, predictions.tolist(), positive_probs.tolist(), probabilities.tolist(),
+            lower.tolist(), upper.tolist()
+        )
+    ]
+
+async def _ndjson_lines(request):
+    """Non-blank lines of an NDJSON request body, as they arrive."""
+    buffer = b""
+    async for chunk in request.stream():
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield line
+    if buffer.strip():
+        yield buffer
+
+async def _ndjson_rows(lines):
+    """Parsed rows of the remaining NDJSON lines; a line that is not JSON is yielded as its ValueError."""
+    async for line in lines:
+        try:
+            yield json.loads(line)
+        except ValueError as e:
+            yield ValueError(f"invalid JSON line: {str(e)}")
+
+async def _list_rows(rows):
+    for row in rows:
+        yield row
+
+async def _read_bulk_request(request):
+    """
+    Read the header of a bulk prediction request.
+
+    Accepts either a JSON body {"model_id", "rows": [...], "chunk_size"} or an
+    NDJSON body whose first line holds {"model_id", "chunk_size"} and whose
+    remaining lines are rows. Returns the header and an async iterator of the
+    rows. For NDJSON only the first line has been read; the rows are read and
+    parsed as they are iterated.
+    """
+    if "ndjson" not in request.headers.get("content-type", ""):
+        body = await request.json()
+        if not isinstance(body, dict):
+            raise ValueError("request body must be a JSON object")
+        return body, _list_rows(body.get("rows") or [])
+
+    lines = _ndjson_lines(request)
+    header = None
+    async for line in lines:
+        header = json.loads(line)
+        break
+    if not isinstance(header, dict):
+        raise ValueError("the first NDJSON line must be an object with model_id")
+    return header, _ndjson_rows(lines)
+
+async def _bulk_chunks(rows, chunk_size):
+    """Lists of up to ``chunk_size`` rows, each yielded as soon as it is complete."""
+    chunk = []
+    async for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+async def _score_bulk_rows(model_data, rows):
+    """NDJSON output records of one chunk of bulk input rows, in input order."""
+    # Malformed rows get an error line in place
+    lines, chunk, positions = [], [], []
+    for row in rows:
+        try:
+            if isinstance(row, ValueError):
+                raise row
+            chunk.append(_bulk_row(row))
+            positions.append(len(lines))
+            lines.append(None)
+        except ValueError as e:
+            userid = row.get("userid", row.get("user_id")) if isinstance(row, dict) else None
+            lines.append({"userid": userid, "error": str(e)})
+    if chunk:
+        try:
+            scored_lines = await run_in_threadpool(score_bulk_chunk, model_data, chunk)
+        except HTTPException as e:
+            scored_lines = [{"userid": userid, "error": e.detail} for userid, _ in chunk]
+        for position, line in zip(positions, scored_lines):
+            lines[position] = line
+    return lines
+
+class _DuplexStreamingResponse(StreamingResponse):
+    """
+    A StreamingResponse whose endpoint keeps reading the request body while it streams.
+
+    Under ASGI servers older than spec 2.4 (uvicorn among them),
+    StreamingResponse reads the receive channel itself to watch for a
+    disconnect and would take body messages away from the endpoint. Here the
+    endpoint's own reads notice a disconnect instead.
+    """
+
+    async def listen_for_disconnect(self, receive):
+        await asyncio.Event().wait()
+
+@app.post("/predict/bulk", dependencies=[Depends(verify_api_key)])
+async def predict_bulk(request: Request):
+    """
+    Score many students in one request and stream the results as NDJSON.
+
+    Rows are scored in fixed-size chunks off the event loop as they arrive, so
+    at most one chunk of input rows is held in memory; each output line is
+    {"userid", "prediction", "probability", "probabilities", "confidence_interval"}
+    or {"userid", "error"}, followed by a final {"summary": ...} line.
+    """
+    try:
+        header, rows = await _read_bulk_request(request)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid bulk request: {str(e)}")
+
+    model_id = header.get("model_id")
+    if not model_id:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="model_id is required")
+    try:
+        chunk_size = int(header.get("chunk_size") or BULK_PREDICT_CHUNK_SIZE)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="chunk_size must be an integer")
+    chunk_size = min(max(chunk_size, 1), BULK_PREDICT_MAX_CHUNK_SIZE)
+
+    model_data = await load_model_data_async(model_id)
+    logger.info(f"Bulk prediction request for model {model_id} in chunks of {chunk_size}")
+
+    async def score_chunks(output):
+        # Reading and scoring do not wait for the client to read the output,
+        # so clients that send the whole body before reading do not deadlock.
+        # Only output lines are buffered for them.
+        try:
+            async for chunk in _bulk_chunks(rows, chunk_size):
+                output.put_nowait((len(chunk), await _score_bulk_rows(model_data, chunk)))
+        except Exception as e:
+            logger.warning(f"Bulk prediction request for model {model_id} stopped: {str(e)}")
+            output.put_nowait((0, [{"error": f"Reading the request failed: {str(e) or type(e).__name__}"}]))
+        finally:
+            output.put_nowait(None)
+
+    async def generate():
+        start = time.time()
+        received, scored, errors, chunks = 0, 0, 0, 0
+        output = asyncio.Queue()
+        producer = asyncio.ensure_future(score_chunks(output))
+        try:
+            while True:
+                item = await output.get()
+                if item is None:
+                    break
+                count, lines = item
+                received += count
+                chunks += 1 if count else 0
+                for line in lines:
+                    if "error" in line:
+                        errors += 1
+                    else:
+                        scored += 1
+                yield "".join(json.dumps(line, default=str) + "\n" for line in lines)
+        finally:
+            producer.cancel()
+
+        yield json.dumps({"summary": {
+            "model_id": model_id,
+            "algorithm": model_data.get('algorithm', 'unknown'),
+            "rows": received,
+            "scored": scored,
+            "errors": errors,
+            "chunks": chunks,
+            "chunk_size": chunk_size,
+            "elapsed_seconds": round(time.time() - start, 4),
+            "prediction_cache_hit_ratio": round(PREDICTION_CACHE.hit_ratio(), 4) if PREDICTION_CACHE is not None else None,
+            "prediction_time": datetime.now().isoformat()
+        }}) + "\n"
+
+    return _DuplexStreamingResponse(generate(), media_type="application/x-ndjson")
+
 @app.get("/models/{course_id}", dependencies=[Depends(verify_api_key)])
 async def list_models(course_id: int):
     """List all trained models for a specific course"""
-    course_models_dir = os.path.join(MODELS_DIR, f"course_{course_id}")
-
-    if not os.path.exists(course_models_dir):
-        return {"models": []}
-
     models = []
-    for filename in os.listdir(course_models_dir):
-        if filename.endswith('.joblib'):
-            model_id = filename.split('.')[0]
-            model_path = os.path.join(course_models_dir, filename)
+    for entry in MODEL_REGISTRY.for_course(course_id):
+        model_id = entry['model_id']
+        model_path = MODEL_REGISTRY.resolve(entry)
 
-            try:
-                # Load model metadata without loading the full model
-                model_data = joblib.load(model_path)
-
-                models.append({
-                    "model_id": model_id,
-                    "algorithm": model_data.get('algorithm', 'unknown'),
-                    "accuracy": model_data.get('metrics', {}).get('accuracy', 0),
-                    "cv_accuracy": model_data.get('metrics', {}).get('cv_accuracy', 0),
-                    "trained_at": model_data.get('trained_at', ''),
-                    "file_size_mb": round(os.path.getsize(model_path) / (1024 * 1024), 2),
-                    "removed_leaky_features": model_data.get('leaky_features', [])
-                })
-            except Exception as e:
-                logger.error(f"Error loading model {model_id}: {str(e)}")
-                models.append({
-                    "model_id": model_id,
-                    "error": str(e),
-                    "file_path": model_path
-                })
+        try:
+            # Read the metadata sidecar without loading the full model
+            metadata = load_model_metadata(model_id, model_path, course_id)
+
+            models.append({
+                "model_id": model_id,
+                "algorithm": metadata.get('algorithm', 'unknown'),
+                "accuracy": (metadata.get('metrics') or {}).get('accuracy', 0),
+                "cv_accuracy": (metadata.get('metrics') or {}).get('cv_accuracy', 0),
+                "trained_at": metadata.get('trained_at', ''),
+                "file_size_mb": round(entry['size_bytes'] / (1024 * 1024), 2),
+                "removed_leaky_features": metadata.get('leaky_features', [])
+            })
+        except Exception as e:
+            logger.error(f"Error loading model {model_id}: {str(e)}")
+            models.append({
+                "model_id": model_id,
+                "error": str(e),
+                "file_path": model_path
+            })
 
     return {"models": models}
 
@@ -1012,36 +1126,108 @@ async def list_models(course_id: int):
 async def get_model_details(model_id: str):
     """Get detailed information about a specific model"""
 
-    # Try to find the model file
-    model_path = None
-    for root, _, files in os.walk(MODELS_DIR):
-        if f"{model_id}.joblib" in files:
-            model_path = os.path.join(root, f"{model_id}.joblib")
-            break
-
-    if not model_path:
+    # Look up the model file in the registry
+    entry = MODEL_REGISTRY.get(model_id)
+    if not entry:
         raise HTTPException(status_code=404, detail=f"Model with ID {model_id} not found")
+    model_path = MODEL_REGISTRY.resolve(entry)
 
     try:
-        # Load model metadata
-        model_data = joblib.load(model_path)
+        # Read the metadata sidecar, not the actual model pipeline
+        metadata = load_model_metadata(model_id, model_path, entry['course_id'])
 
-        # Extract key information, but not the actual model pipeline
         return {
             "model_id": model_id,
-            "algorithm": model_data.get('algorithm', 'unknown'),
-            "metrics": model_data.get('metrics', {}),
-            "feature_names": model_data.get('feature_names', []),
-            "target_classes": model_data.get('target_classes', []),
-            "trained_at": model_data.get('trained_at', ''),
+            "algorithm": metadata.get('algorithm', 'unknown'),
+            "metrics": metadata.get('metrics', {}),
+            "feature_names": metadata.get('feature_names', []),
+            "input_schema": metadata.get('input_schema'),
+            "compiled_inference": metadata.get('compiled_parity'),
+            "leaderboard": metadata.get('leaderboard'),
+            "lineage": metadata.get('lineage'),
+            "target_classes": metadata.get('target_classes', []),
+            "trained_at": metadata.get('trained_at', ''),
             "file_path": model_path,
-            "file_size_mb": round(os.path.getsize(model_path) / (1024 * 1024), 2),
-            "removed_leaky_features": model_data.get('leaky_features', [])
+            "file_size_mb": round(entry['size_bytes'] / (1024 * 1024), 2),
+            "removed_leaky_features": metadata.get('leaky_features', [])
         }
     except Exception as e:
         logger.error(f"Error loading model {model_id}: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error loading model: {str(e)}")
 
+def _training_profiles(course_id=None):
+    """Training profiles recorded in the metadata sidecars of registered models."""
+    entries = MODEL_REGISTRY.for_course(course_id) if course_id is not None else [
+        dict(entry, model_id=model_id) for model_id, entry in MODEL_REGISTRY.all().items()
+    ]
+    for entry in entries:
+        sidecar = read_sidecar(MODEL_REGISTRY.resolve(entry)) or {}
+        profile = (sidecar.get("metrics") or {}).get("profile")
+        if profile:
+            yield dict(profile, model_id=entry["model_id"], course_id=entry["course_id"])
+
+@app.get("/training/profile", dependencies=[Depends(verify_api_key)])
+async def training_profile(course_id: Optional[int] = None):
+    """Per-stage training time, CPU and peak memory aggregated over all models, or one course's"""
+    result = await run_in_threadpool(lambda: aggregate_profiles(_training_profiles(course_id)))
+    return dict(result, course_id=course_id)
+
+@app.post("/registry/rebuild", dependencies=[Depends(verify_api_key)])
+async def rebuild_registry(backfill_metadata: bool = False):
+    """Rebuild the model registry, optionally writing missing metadata sidecars first"""
+    result = {"status": "rebuilt"}
+    if backfill_metadata:
+        written, errors = backfill_sidecars(MODELS_DIR, load_artifact)
+        result["backfilled"] = written
+        result["backfill_errors"] = errors
+    result["models_count"] = MODEL_REGISTRY.rebuild()
+    return result
+
+@app.get("/cache/stats", dependencies=[Depends(verify_api_key)])
+async def cache_stats():
+    """Report model cache usage, hit/miss/eviction counters and cached models"""
+    stats = MODEL_CACHE.stats()
+    stats["prediction_cache"] = PREDICTION_CACHE.stats() if PREDICTION_CACHE is not None else {"enabled": False}
+    return stats
+
+@app.delete("/cache/predictions/{model_id}", dependencies=[Depends(verify_api_key)])
+async def clear_cached_predictions(model_id: str):
+    """Drop the cached predictions of a model"""
+    dropped = PREDICTION_CACHE.invalidate(model_id) if PREDICTION_CACHE is not None else 0
+    return {"model_id": model_id, "dropped": dropped}
+
+@app.post("/cache/pin/{model_id}", dependencies=[Depends(verify_api_key)])
+async def pin_model(model_id: str):
+    """Load a model if needed and keep it in the cache until it is unpinned"""
+    MODEL_CACHE.pin(model_id)
+    try:
+        await load_model_data_async(model_id)
+    except HTTPException:
+        MODEL_CACHE.unpin(model_id)
+        raise
+    return {"model_id": model_id, "pinned": True}
+
+@app.post("/cache/warm/{model_id}", dependencies=[Depends(verify_api_key)])
+async def warm_model(model_id: str):
+    """
+    Load a model into the cache before traffic for it arrives.
+
+    Called by the Moodle plugin when a model is activated, before it queues
+    the course's prediction refresh, so the refresh's first requests do not
+    all miss the cache. Requests arriving during the load wait for it
+    instead of loading the model again.
+    """
+    cached = model_id in MODEL_CACHE
+    start = time.time()
+    await load_model_data_async(model_id)
+    return {"model_id": model_id, "cached": cached, "seconds": round(time.time() - start, 3)}
+
+@app.delete("/cache/pin/{model_id}", dependencies=[Depends(verify_api_key)])
+async def unpin_model(model_id: str):
+    """Allow a pinned model to be evicted again"""
+    MODEL_CACHE.unpin(model_id)
+    return {"model_id": model_id, "pinned": False}
+
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("PORT", 8000))
@@ -0,0 +1,270 @@
+"""
+Model artifacts for the Student Performance Predictor API
+
+A version 1 artifact is one ``<model_id>.joblib`` pickle of the whole
+model_data dict. That is the training pipeline, its calibrated copy and all
+of the training metadata, and every load deserializes all of it. A version 2
+artifact is a directory that keeps what serving needs apart from the rest::
+
+    <model_id>.model/
+        manifest.json      artifact version, parts and arrays with their sizes
+        serving.joblib     classes, feature names, input schema, compiled preprocessor
+        estimator.joblib   the scikit-learn pipeline predictions are made with
+        training.joblib    compressed: the uncalibrated pipeline, metrics, CV scores,
+                           leaderboard, lineage (read by /retrain and backfills only)
+        arrays/<name>.npy  the compiled model's node arrays, memory-mapped on load
+
+The parts are written to a temporary directory that is renamed into place
+once the manifest is in it. Models with a compiled engine are served from
+memory-mapped arrays without unpickling any trees. Their estimator is only
+loaded for batches the compiled engine does not take (see serving_pipeline).
+Models without a compiled engine (the default) have no arrays: their
+estimator part is unpickled whole, and scikit-learn copies tree nodes into
+its own buffers on unpickling, so memory-mapping it would not share them.
+For those models the layout only saves reading the training part.
+Version 1 artifacts still load; migrate_artifact converts them.
+"""
+
+import copy
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+from datetime import datetime
+from typing import Any, Dict
+
+import joblib
+import numpy as np
+
+from compiled_model import PARITY_TOLERANCE, CompiledModel, get_compiled_model
+from input_schema import InputSchema
+from model_registry import (ARTIFACT_SUFFIX, artifact_model_id, artifact_size, atomic_write_json,
+                            sidecar_from_model_data, sidecar_path, to_jsonable, write_sidecar)
+
+logger = logging.getLogger(__name__)
+
+ARTIFACT_VERSION = 2
+MANIFEST_FILENAME = "manifest.json"
+SERVING_FILENAME = "serving.joblib"
+ESTIMATOR_FILENAME = "estimator.joblib"
+TRAINING_FILENAME = "training.joblib"
+ARRAYS_DIRNAME = "arrays"
+# The training part is rarely read, so it is stored compressed
+TRAINING_COMPRESSION = 3
+# Rows scored by the old and the new artifact when migrating
+MIGRATION_CHECK_ROWS = 8
+
+# model_data keys stored in the serving part; every other key goes to the training part
+SERVING_KEYS = (
+    "algorithm", "trained_at", "feature_names", "target_classes",
+    "effective_sample_size", "input_schema", "compiled_model"
+)
+
+
+class ArtifactError(ValueError):
+    """An artifact that is incomplete or was written by an unknown artifact version."""
+
+
+def _dump(value: Any, directory: str, filename: str, compress: int = 0) -> Dict[str, Any]:
+    path = os.path.join(directory, filename)
+    joblib.dump(value, path, compress=compress)
+    return {"file": filename, "bytes": os.path.getsize(path)}
+
+
+def save_artifact(model_path: str, model_data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Write ``model_data`` as a version 2 artifact directory at ``model_path``.
+
+    Keys starting with an underscore (state derived after loading) are not
+    stored. Returns the manifest.
+    """
+    pipeline = model_data["pipeline"]
+    calibrated = getattr(pipeline, "calibrated_pipeline", None)
+    serving = {key: model_data[key] for key in SERVING_KEYS if key in model_data}
+    training = {key: value for key, value in model_data.items()
+                if key not in SERVING_KEYS and key != "pipeline" and not key.startswith("_")}
+    if calibrated is not None:
+        # Only needed to continue training; predictions use the calibrated pipeline
+        training_pipeline = copy.copy(pipeline)
+        training_pipeline.calibrated_pipeline = None
+        training["pipeline"] = training_pipeline
+    estimator = calibrated if calibrated is not None else pipeline
+
+    arrays = {}
+    compiled = serving.get("compiled_model")
+    if compiled:
+        compiled = CompiledModel.from_dict(compiled).to_dict()
+        arrays = {f"compiled.{name}": np.ascontiguousarray(array) for name, array in compiled["nodes"].items()}
+        serving["compiled_model"] = dict(compiled, nodes=None)
+
+    directory = os.path.dirname(model_path)
+    tmp_path = tempfile.mkdtemp(dir=directory, prefix=".tmp-", suffix=ARTIFACT_SUFFIX)
+    try:
+        parts = {
+            "serving": _dump(serving, tmp_path, SERVING_FILENAME),
+            "estimator": _dump(estimator, tmp_path, ESTIMATOR_FILENAME),
+            "training": _dump(training, tmp_path, TRAINING_FILENAME, compress=TRAINING_COMPRESSION),
+        }
+        array_index = {}
+        if arrays:
+            os.makedirs(os.path.join(tmp_path, ARRAYS_DIRNAME))
+        for name, array in arrays.items():
+            filename = os.path.join(ARRAYS_DIRNAME, f"{name}.npy")
+            np.save(os.path.join(tmp_path, filename), array, allow_pickle=False)
+            array_index[name] = {"file": filename, "dtype": str(array.dtype), "shape": list(array.shape),
+                                 "bytes": os.path.getsize(os.path.join(tmp_path, filename))}
+        manifest = {
+            "artifact_version": ARTIFACT_VERSION,
+            "model_id": artifact_model_id(os.path.basename(model_path)),
+            "written_at": datetime.now().isoformat(),
+            "calibrated": calibrated is not None,
+            "compiled": bool(arrays),
+            "parts": parts,
+            "arrays": array_index,
+        }
+        atomic_write_json(os.path.join(tmp_path, MANIFEST_FILENAME), to_jsonable(manifest), indent=1)
+        os.chmod(tmp_path, 0o755)
+        os.rename(tmp_path, model_path)
+    except Exception:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+    return manifest
+
+
+def read_manifest(model_path: str) -> Dict[str, Any]:
+    try:
+        with open(os.path.join(model_path, MANIFEST_FILENAME), "r") as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        raise ArtifactError(f"Artifact {model_path} has no manifest")
+    if manifest.get("artifact_version") != ARTIFACT_VERSION:
+        raise ArtifactError(f"Unsupported artifact version {manifest.get('artifact_version')} in {model_path}")
+    return manifest
+
+
+def _load_part(model_path: str, manifest: Dict[str, Any], part: str) -> Any:
+    return joblib.load(os.path.join(model_path, manifest["parts"][part]["file"]))
+
+
+def load_artifact(model_path: str, serving_only: bool = False, mmap: bool = True) -> Dict[str, Any]:
+    """
+    Load the model_data dict of an artifact of any version.
+
+    With ``serving_only`` a version 2 artifact only loads what predictions
+    need, and the estimator too is left for serving_pipeline to load when
+    the model has a compiled engine. Otherwise the result is the full dict a
+    version 1 artifact holds, with ``pipeline`` carrying its
+    ``calibrated_pipeline``. The compiled node arrays are memory-mapped
+    read-only unless ``mmap`` is false.
+    """
+    if not os.path.isdir(model_path):
+        return joblib.load(model_path)
+    manifest = read_manifest(model_path)
+    model_data = _load_part(model_path, manifest, "serving")
+    compiled = model_data.get("compiled_model")
+    if compiled:
+        prefix = "compiled."
+        compiled["nodes"] = {
+            name[len(prefix):]: np.load(os.path.join(model_path, spec["file"]),
+                                        mmap_mode="r" if mmap else None, allow_pickle=False)
+            for name, spec in manifest["arrays"].items() if name.startswith(prefix)
+        }
+    model_data["_artifact_path"] = model_path
+    if not serving_only or not compiled:
+        model_data["_serving_pipeline"] = _load_part(model_path, manifest, "estimator")
+    if not serving_only:
+        training = _load_part(model_path, manifest, "training")
+        pipeline = training.pop("pipeline", None)
+        model_data.update(training)
+        if pipeline is None:
+            pipeline = model_data["_serving_pipeline"]
+        else:
+            pipeline.calibrated_pipeline = model_data["_serving_pipeline"]
+        model_data["pipeline"] = pipeline
+    return model_data
+
+
+def serving_pipeline(model_data: Dict[str, Any]) -> Any:
+    """
+    The scikit-learn pipeline predictions are made with: the calibrated pipeline if the model has one.
+
+    A version 2 artifact loaded for serving reads its estimator part on first use.
+    """
+    if "_serving_pipeline" not in model_data:
+        model_path = model_data.get("_artifact_path")
+        if model_path is not None:
+            logger.info(f"Loading estimator of {model_path}")
+            model_data["_serving_pipeline"] = _load_part(model_path, read_manifest(model_path), "estimator")
+        else:
+            pipeline = model_data["pipeline"]
+            model_data["_serving_pipeline"] = getattr(pipeline, "calibrated_pipeline", None) or pipeline
+    return model_data["_serving_pipeline"]
+
+
+def serving_size(model_path: str) -> int:
+    """Bytes of an artifact that serving reads: all of a version 1 pickle, or everything but the training part."""
+    if not os.path.isdir(model_path):
+        return os.path.getsize(model_path)
+    manifest = read_manifest(model_path)
+    parts = [spec for name, spec in manifest["parts"].items() if name != "training"]
+    return sum(spec["bytes"] for spec in parts) + sum(spec["bytes"] for spec in manifest["arrays"].values())
+
+
+def migrate_artifact(legacy_path: str, keep_legacy: bool = False,
+                     check_rows: int = MIGRATION_CHECK_ROWS) -> Dict[str, Any]:
+    """
+    Convert a version 1 ``.joblib`` artifact to a version 2 directory next to it.
+
+    The new artifact must give the old one's probabilities, from its
+    estimator and from its compiled engine if it has one, on rows built from
+    the input schema's defaults. The old file is removed afterwards unless
+    ``keep_legacy``. A sidecar is written if there is none. Returns the sizes
+    and serving load times of both artifacts.
+    """
+    model_id = artifact_model_id(os.path.basename(legacy_path))
+    model_path = os.path.join(os.path.dirname(legacy_path), f"{model_id}{ARTIFACT_SUFFIX}")
+    start = time.perf_counter()
+    model_data = joblib.load(legacy_path)
+    legacy_load_seconds = time.perf_counter() - start
+
+    schema = InputSchema.from_model_data(model_data)
+    # Stored so serving never needs the training pipeline to infer it
+    model_data["input_schema"] = schema.to_dict()
+    if not os.path.exists(model_path):
+        save_artifact(model_path, model_data)
+    try:
+        start = time.perf_counter()
+        migrated = load_artifact(model_path, serving_only=True)
+        load_seconds = time.perf_counter() - start
+        X_check = schema.build_frame([{}] * check_rows)
+        expected = serving_pipeline(model_data).predict_proba(X_check)
+        actual = serving_pipeline(migrated).predict_proba(X_check)
+        max_abs_diff = float(np.max(np.abs(expected - actual)))
+        compiled = get_compiled_model(migrated)
+        if compiled is not None:
+            max_abs_diff = max(max_abs_diff, float(np.max(np.abs(expected - compiled.predict_proba(X_check)))))
+        if not max_abs_diff <= PARITY_TOLERANCE:
+            raise ArtifactError(f"Migrated artifact differs from the original (max abs diff {max_abs_diff:.3g})")
+    except Exception:
+        shutil.rmtree(model_path, ignore_errors=True)
+        raise
+
+    if not os.path.exists(sidecar_path(model_path)):
+        course = os.path.basename(os.path.dirname(legacy_path))
+        course_id = int(course[len("course_"):]) if course.startswith("course_") else None
+        write_sidecar(model_path, sidecar_from_model_data(model_id, course_id, model_data))
+    report = {
+        "model_id": model_id,
+        "legacy_bytes": os.path.getsize(legacy_path),
+        "bytes": artifact_size(model_path),
+        "serving_bytes": serving_size(model_path),
+        "legacy_load_seconds": round(legacy_load_seconds, 4),
+        "load_seconds": round(load_seconds, 4),
+        "compiled": compiled is not None,
+        "max_abs_diff": max_abs_diff,
+    }
+    if not keep_legacy:
+        os.unlink(legacy_path)
+    return report
@@ -0,0 +1,248 @@
+"""
+Model cache for the Student Performance Predictor API
+
+A bounded in-memory cache for loaded model artifacts. Entries are evicted
+by least-recently-used order or by a cost-aware policy once the configured
+entry count or byte budget is exceeded. Pinned models are never evicted.
+Concurrent misses for the same model share a single load (see ModelCache.load).
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+EVICTION_POLICIES = ("lru", "cost")
+
+
+class _CacheEntry:
+    __slots__ = ("value", "size_bytes", "load_seconds", "hits", "priority", "added_at")
+
+    def __init__(self, value: Any, size_bytes: int, load_seconds: float):
+        self.value = value
+        self.size_bytes = size_bytes
+        self.load_seconds = load_seconds
+        self.hits = 0
+        self.priority = 0.0
+        self.added_at = time.time()
+
+
+class _Flight:
+    """A load in progress, awaited by the misses that arrive while it runs."""
+    __slots__ = ("done", "value", "error", "waiters")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+        self.waiters = 0
+
+
+class ModelCache:
+    """
+    Thread-safe model cache with an entry and byte budget.
+
+    The "lru" policy evicts the least recently used entry. The "cost" policy
+    uses GreedyDual-Size: every entry gets a priority of
+    ``inflation + load_seconds / size_mb`` that is refreshed on each hit, and
+    the lowest priority entry is evicted first, so large models that are
+    cheap to reload go before small models that are expensive to reload.
+    """
+
+    def __init__(self, max_entries: int = 32, max_bytes: int = 0, policy: str = "lru",
+                 pinned: Optional[Iterable[str]] = None):
+        if policy not in EVICTION_POLICIES:
+            raise ValueError(f"Unknown cache eviction policy '{policy}', expected one of {EVICTION_POLICIES}")
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self._entries: "OrderedDict[str, _CacheEntry]" = OrderedDict()
+        self._pinned = set(pinned or [])
+        self._lock = threading.RLock()
+        self._flights: Dict[str, _Flight] = {}
+        self._inflation = 0.0
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.evicted_bytes = 0
+        self.loads = 0
+        self.shared_loads = 0
+
+    def __contains__(self, model_id: str) -> bool:
+        with self._lock:
+            return model_id in self._entries
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def get(self, model_id: str, default: Any = None) -> Any:
+        """Return a cached model and record a hit or a miss."""
+        with self._lock:
+            entry = self._entries.get(model_id)
+            if entry is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            entry.hits += 1
+            self._entries.move_to_end(model_id)
+            if self.policy == "cost":
+                entry.priority = self._priority(entry)
+            return entry.value
+
+    def put(self, model_id: str, value: Any, size_bytes: int = 0, load_seconds: float = 0.0) -> None:
+        """Insert or replace a model and evict until the cache fits its budget."""
+        with self._lock:
+            self._discard(model_id)
+            entry = _CacheEntry(value, max(int(size_bytes), 0), max(float(load_seconds), 0.0))
+            entry.priority = self._priority(entry)
+            self._entries[model_id] = entry
+            self._bytes += entry.size_bytes
+            self._evict(protect=model_id)
+
+    def load(self, model_id: str, loader: Callable[[], Tuple[Any, int]]) -> Any:
+        """
+        Return a cached model, or load it with ``loader`` and cache it.
+
+        ``loader`` returns the model and its size in bytes. It runs once per
+        model at a time: a miss that arrives while another thread is loading
+        the same model waits for that load and gets its result, or its
+        exception. Does not count a hit or a miss; callers check ``get`` first.
+        """
+        with self._lock:
+            entry = self._entries.get(model_id)
+            if entry is not None:
+                return entry.value
+            flight = self._flights.get(model_id)
+            leader = flight is None
+            if leader:
+                flight = self._flights[model_id] = _Flight()
+            else:
+                flight.waiters += 1
+                self.shared_loads += 1
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        start = time.time()
+        try:
+            value, size_bytes = loader()
+            with self._lock:
+                self.put(model_id, value, size_bytes=size_bytes, load_seconds=time.time() - start)
+                self.loads += 1
+            flight.value = value
+            return value
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[model_id]
+            if flight.waiters:
+                logger.info(f"Load of model {model_id} was shared with {flight.waiters} concurrent requests")
+            flight.done.set()
+
+    def pop(self, model_id: str, default: Any = None) -> Any:
+        """Remove a model from the cache without counting it as an eviction."""
+        with self._lock:
+            entry = self._discard(model_id)
+            return entry.value if entry is not None else default
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self._inflation = 0.0
+
+    def pin(self, model_id: str) -> None:
+        """Keep a model in memory regardless of eviction pressure."""
+        with self._lock:
+            self._pinned.add(model_id)
+
+    def unpin(self, model_id: str) -> None:
+        with self._lock:
+            self._pinned.discard(model_id)
+            self._evict()
+
+    def is_pinned(self, model_id: str) -> bool:
+        with self._lock:
+            return model_id in self._pinned
+
+    def stats(self) -> Dict[str, Any]:
+        """Return counters and per-entry details for the API."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "policy": self.policy,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "evicted_bytes": self.evicted_bytes,
+                "loads": self.loads,
+                "shared_loads": self.shared_loads,
+                "loading": sorted(self._flights),
+                "pinned": sorted(self._pinned),
+                "models": [
+                    {
+                        "model_id": model_id,
+                        "size_bytes": entry.size_bytes,
+                        "load_seconds": round(entry.load_seconds, 4),
+                        "hits": entry.hits,
+                        "pinned": model_id in self._pinned,
+                        "cached_at": entry.added_at,
+                    }
+                    for model_id, entry in self._entries.items()
+                ],
+            }
+
+    def _priority(self, entry: _CacheEntry) -> float:
+        size_mb = max(entry.size_bytes, 1) / (1024 * 1024)
+        return self._inflation + max(entry.load_seconds, 0.001) / size_mb
+
+    def _discard(self, model_id: str) -> Optional[_CacheEntry]:
+        entry = self._entries.pop(model_id, None)
+        if entry is not None:
+            self._bytes -= entry.size_bytes
+        return entry
+
+    def _over_budget(self) -> bool:
+        if self.max_entries and len(self._entries) > self.max_entries:
+            return True
+        if self.max_bytes and self._bytes > self.max_bytes:
+            return True
+        return False
+
+    def _victims(self, protect: Optional[str]) -> List[str]:
+        candidates = [m for m in self._entries if m not in self._pinned and m != protect]
+        if self.policy == "cost":
+            candidates.sort(key=lambda m: self._entries[m].priority)
+        return candidates
+
+    def _evict(self, protect: Optional[str] = None) -> None:
+        if not self._over_budget():
+            return
+        for model_id in self._victims(protect):
+            if not self._over_budget():
+                break
+            entry = self._discard(model_id)
+            if self.policy == "cost":
+                self._inflation = entry.priority
+            self.evictions += 1
+            self.evicted_bytes += entry.size_bytes
+            logger.info(f"Evicted model {model_id} from cache ({entry.size_bytes} bytes)")
+        if self._over_budget():
+            logger.warning(
+                f"Model cache over budget with only pinned or in-use models left: "
+                f"{len(self._entries)} entries, {self._bytes} bytes"
+            )
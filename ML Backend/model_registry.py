@@ -0,0 +1,389 @@
+"""
+Model registry for the Student Performance Predictor API
+
+A persistent index mapping model IDs to their course, artifact path, size
+and summary metadata, so artifacts can be found without walking MODELS_DIR.
+The index lives in a JSON file inside MODELS_DIR and can always be rebuilt
+from the directory tree. Every change to it re-reads and rewrites the file
+under an exclusive ``flock`` on a lock file next to it, so the workers of a
+multi-worker server do not drop each other's models (on Windows, which only
+runs the single-process server, a thread lock is enough); a model missing
+from the index is still found by looking for its artifact on disk.
+
+Every artifact also gets a small JSON metadata sidecar (``<model_id>.meta.json``)
+so listings and model details never have to unpickle a full pipeline.
+
+Artifacts are either a single ``<model_id>.joblib`` pickle (artifact version 1)
+or a ``<model_id>.model`` directory (version 2 and later, see model_artifact.py).
+"""
+
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: only the single-process development server runs there
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+REGISTRY_FILENAME = "registry.json"
+LOCK_SUFFIX = ".lock"
+REGISTRY_VERSION = 1
+COURSE_DIR_PATTERN = re.compile(r"^course_(\d+)$")
+SIDECAR_SUFFIX = ".meta.json"
+SIDECAR_VERSION = 1
+LEGACY_ARTIFACT_SUFFIX = ".joblib"
+ARTIFACT_SUFFIX = ".model"
+
+# Keys of the stored model_data dict that are safe and small enough for a sidecar
+SIDECAR_KEYS = (
+    "algorithm", "trained_at", "feature_names", "target_classes", "metrics",
+    "cv_scores", "effective_sample_size", "leaky_features", "input_schema",
+    "compiled_parity", "leaderboard", "lineage"
+)
+# Sidecar keys copied into the registry index for quick summaries
+SUMMARY_KEYS = ("algorithm", "trained_at")
+
+
+def to_jsonable(value: Any) -> Any:
+    """Convert numpy values in nested dicts and lists to plain JSON types."""
+    if isinstance(value, dict):
+        return {str(k): to_jsonable(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_jsonable(v) for v in value]
+    if isinstance(value, np.ndarray):
+        return to_jsonable(value.tolist())
+    if isinstance(value, np.integer):
+        return int(value)
+    if isinstance(value, np.floating):
+        return float(value)
+    if isinstance(value, np.bool_):
+        return bool(value)
+    return value
+
+
+def atomic_write_json(path: str, data: Any, indent: Optional[int] = None) -> None:
+    """Write JSON to a temporary file in the same directory and move it into place."""
+    directory = os.path.dirname(path)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=".json")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f, indent=indent, default=str)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def artifact_model_id(filename: str) -> Optional[str]:
+    """Model ID of an artifact file or directory name, or None if it is not an artifact."""
+    for suffix in (ARTIFACT_SUFFIX, LEGACY_ARTIFACT_SUFFIX):
+        if filename.endswith(suffix) and not filename.startswith("."):
+            return filename[:-len(suffix)]
+    return None
+
+
+def artifact_size(model_path: str) -> int:
+    """Bytes on disk of an artifact file or directory."""
+    if not os.path.isdir(model_path):
+        return os.path.getsize(model_path)
+    return sum(os.path.getsize(os.path.join(root, name))
+               for root, _, names in os.walk(model_path) for name in names)
+
+
+def _course_artifacts(course_path: str) -> Dict[str, str]:
+    """model_id -> artifact path in a course directory, preferring the newer layout."""
+    artifacts = {}
+    for filename in sorted(os.listdir(course_path)):
+        model_id = artifact_model_id(filename)
+        if model_id is None:
+            continue
+        if model_id not in artifacts or filename.endswith(ARTIFACT_SUFFIX):
+            artifacts[model_id] = os.path.join(course_path, filename)
+    return artifacts
+
+
+def sidecar_path(model_path: str) -> str:
+    """Metadata sidecar path for an artifact path."""
+    base, _ = os.path.splitext(model_path)
+    return base + SIDECAR_SUFFIX
+
+
+def sidecar_from_model_data(model_id: str, course_id: Optional[int], model_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Build sidecar metadata from a stored model_data dict, leaving out the pipeline."""
+    sidecar = {key: to_jsonable(model_data[key]) for key in SIDECAR_KEYS if key in model_data}
+    sidecar.update({"sidecar_version": SIDECAR_VERSION, "model_id": model_id, "course_id": course_id})
+    return sidecar
+
+
+def write_sidecar(model_path: str, metadata: Dict[str, Any]) -> str:
+    """Atomically write the metadata sidecar next to an artifact."""
+    path = sidecar_path(model_path)
+    atomic_write_json(path, to_jsonable(metadata))
+    return path
+
+
+def read_sidecar(model_path: str) -> Optional[Dict[str, Any]]:
+    """Read the metadata sidecar for an artifact, or None if there is none."""
+    try:
+        with open(sidecar_path(model_path), "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning(f"Unreadable metadata sidecar for {model_path}: {str(e)}")
+        return None
+
+
+def summarize_sidecar(sidecar: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Registry summary metadata taken from a sidecar."""
+    if not sidecar:
+        return {}
+    summary = {key: sidecar.get(key) for key in SUMMARY_KEYS}
+    metrics = sidecar.get("metrics") or {}
+    summary["accuracy"] = metrics.get("accuracy")
+    summary["cv_accuracy"] = metrics.get("cv_accuracy")
+    return summary
+
+
+def backfill_sidecars(models_dir: str, loader: Callable[[str], Any]) -> Tuple[List[str], Dict[str, str]]:
+    """
+    Write sidecars for artifacts that do not have one yet.
+
+    Each artifact without a sidecar is loaded once with ``loader``. Returns the
+    model IDs that were backfilled and a model_id -> error map for artifacts
+    that could not be loaded.
+    """
+    written, errors = [], {}
+    for course_dir in sorted(os.listdir(models_dir)) if os.path.isdir(models_dir) else []:
+        match = COURSE_DIR_PATTERN.match(course_dir)
+        course_path = os.path.join(models_dir, course_dir)
+        if not match or not os.path.isdir(course_path):
+            continue
+        for model_id, model_path in _course_artifacts(course_path).items():
+            if os.path.exists(sidecar_path(model_path)):
+                continue
+            try:
+                model_data = loader(model_path)
+                write_sidecar(model_path, sidecar_from_model_data(model_id, int(match.group(1)), model_data))
+                written.append(model_id)
+            except Exception as e:
+                logger.warning(f"Could not backfill metadata for model {model_id}: {str(e)}")
+                errors[model_id] = str(e)
+    return written, errors
+
+
+class ModelRegistry:
+    """Thread- and process-safe model_id -> artifact index backed by a JSON file."""
+
+    def __init__(self, models_dir: str, filename: str = REGISTRY_FILENAME):
+        self.models_dir = models_dir
+        self.index_path = os.path.join(models_dir, filename)
+        self.lock_path = self.index_path + LOCK_SUFFIX
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._mtime = None
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def __contains__(self, model_id: str) -> bool:
+        return self.get(model_id) is not None
+
+    def load(self) -> None:
+        """Load the index from disk, rebuilding it if it is missing or unreadable."""
+        with self._lock:
+            if not os.path.exists(self.index_path):
+                logger.info("Model registry not found, rebuilding from directory tree")
+                self.rebuild()
+                return
+            try:
+                self._read()
+            except (OSError, ValueError) as e:
+                logger.warning(f"Model registry unreadable ({str(e)}), rebuilding from directory tree")
+                self.rebuild()
+
+    def rebuild(self) -> int:
+        """Scan MODELS_DIR for artifacts and rewrite the index. Returns the model count."""
+        with self._lock, self._file_lock():
+            previous = self._entries
+            entries = {}
+            for course_dir in sorted(os.listdir(self.models_dir)) if os.path.isdir(self.models_dir) else []:
+                match = COURSE_DIR_PATTERN.match(course_dir)
+                course_path = os.path.join(self.models_dir, course_dir)
+                if not match or not os.path.isdir(course_path):
+                    continue
+                for model_id, model_path in _course_artifacts(course_path).items():
+                    entry = self._make_entry(int(match.group(1)), model_path)
+                    # Prefer the sidecar, then whatever was recorded at training time
+                    entry["metadata"] = (summarize_sidecar(read_sidecar(model_path))
+                                         or previous.get(model_id, {}).get("metadata", {}))
+                    entries[model_id] = entry
+            self._entries = entries
+            self._write()
+            logger.info(f"Model registry rebuilt with {len(entries)} models")
+            return len(entries)
+
+    def get(self, model_id: str) -> Optional[Dict[str, Any]]:
+        """Return the registry entry for a model, or None if it is unknown or gone."""
+        with self._lock:
+            entry = self._entries.get(model_id)
+            if entry is None and self._changed_on_disk():
+                # Another worker may have registered it since we last read the index
+                self._read()
+                entry = self._entries.get(model_id)
+            if entry is None:
+                entry = self._recover(model_id)
+            if entry is not None and not os.path.exists(self.resolve(entry)) and self._changed_on_disk():
+                # The artifact may have been moved, e.g. migrated to a newer layout
+                self._read()
+                entry = self._entries.get(model_id)
+            if entry is None:
+                return None
+            if not os.path.exists(self.resolve(entry)):
+                logger.warning(f"Artifact for model {model_id} is missing, removing it from the registry")
+                with self._file_lock():
+                    self._read_if_exists()
+                    current = self._entries.get(model_id)
+                    if current is not None and not os.path.exists(self.resolve(current)):
+                        self._entries.pop(model_id)
+                        self._write()
+                return None
+            return dict(entry)
+
+    def resolve(self, entry: Dict[str, Any]) -> str:
+        """Absolute artifact path for an entry."""
+        return os.path.join(self.models_dir, entry["path"])
+
+    def path_for(self, model_id: str) -> Optional[str]:
+        entry = self.get(model_id)
+        return self.resolve(entry) if entry else None
+
+    def register(self, model_id: str, course_id: int, model_path: str,
+                 metadata: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Add or replace a model entry and persist the index."""
+        with self._lock, self._file_lock():
+            self._read_if_exists()
+            entry = self._make_entry(course_id, model_path)
+            entry["metadata"] = metadata or {}
+            self._entries[model_id] = entry
+            self._write()
+            return dict(entry)
+
+    def unregister(self, model_id: str) -> bool:
+        with self._lock, self._file_lock():
+            self._read_if_exists()
+            removed = self._entries.pop(model_id, None) is not None
+            if removed:
+                self._write()
+            return removed
+
+    def for_course(self, course_id: int) -> List[Dict[str, Any]]:
+        """Entries for one course, each including its model_id."""
+        with self._lock:
+            if self._changed_on_disk():
+                self._read()
+            return [
+                dict(entry, model_id=model_id)
+                for model_id, entry in self._entries.items()
+                if entry["course_id"] == course_id
+            ]
+
+    def recent_per_course(self, per_course: int) -> List[str]:
+        """IDs of the ``per_course`` most recently trained models of every course, newest first."""
+        by_course: Dict[int, List[Tuple[str, str]]] = {}
+        for model_id, entry in self.all().items():
+            trained_at = (entry.get("metadata") or {}).get("trained_at") or entry["registered_at"]
+            by_course.setdefault(entry["course_id"], []).append((trained_at, model_id))
+        selected = []
+        for course_id in sorted(by_course):
+            selected.extend(model_id for _, model_id in sorted(by_course[course_id], reverse=True)[:per_course])
+        return selected
+
+    def all(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            if self._changed_on_disk():
+                self._read()
+            return {model_id: dict(entry) for model_id, entry in self._entries.items()}
+
+    def _make_entry(self, course_id: int, model_path: str) -> Dict[str, Any]:
+        return {
+            "course_id": int(course_id),
+            "path": os.path.relpath(model_path, self.models_dir),
+            "size_bytes": artifact_size(model_path),
+            "registered_at": datetime.now().isoformat(),
+        }
+
+    def _recover(self, model_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Register an artifact that is on disk but not in the index.
+
+        Covers indexes written before registry updates were locked, and
+        artifacts copied into MODELS_DIR by hand.
+        """
+        if not model_id or os.path.basename(model_id) != model_id or model_id.startswith("."):
+            return None
+        for course_dir in sorted(os.listdir(self.models_dir)) if os.path.isdir(self.models_dir) else []:
+            match = COURSE_DIR_PATTERN.match(course_dir)
+            if not match:
+                continue
+            for suffix in (ARTIFACT_SUFFIX, LEGACY_ARTIFACT_SUFFIX):
+                model_path = os.path.join(self.models_dir, course_dir, model_id + suffix)
+                if os.path.exists(model_path):
+                    logger.warning(f"Model {model_id} was missing from the registry, registering {model_path}")
+                    return self.register(model_id, int(match.group(1)), model_path,
+                                         summarize_sidecar(read_sidecar(model_path)))
+        return None
+
+    @contextmanager
+    def _file_lock(self) -> Iterator[None]:
+        """Exclusive lock on the index across processes, held while it is re-read, changed and written.
+
+        Without fcntl (Windows) only the in-process lock the callers hold applies.
+        """
+        if fcntl is None:
+            yield
+            return
+        os.makedirs(self.models_dir, exist_ok=True)
+        with open(self.lock_path, "a") as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def _changed_on_disk(self) -> bool:
+        try:
+            return os.path.getmtime(self.index_path) != self._mtime
+        except OSError:
+            return False
+
+    def _read_if_exists(self) -> None:
+        # Always re-read under the file lock: the mtime may not have moved
+        # if another worker wrote within the filesystem's timestamp resolution
+        if os.path.exists(self.index_path):
+            self._read()
+
+    def _read(self) -> None:
+        with open(self.index_path, "r") as f:
+            data = json.load(f)
+        self._entries = data.get("models", {})
+        self._mtime = os.path.getmtime(self.index_path)
+
+    def _write(self) -> None:
+        os.makedirs(self.models_dir, exist_ok=True)
+        atomic_write_json(self.index_path, {"version": REGISTRY_VERSION, "models": self._entries}, indent=1)
+        self._mtime = os.path.getmtime(self.index_path)
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Parity check of the compiled inference engine against scikit-learn
+
+Trains the pipelines training.py builds for the compiled algorithms
+(Random Forest and Extra Trees, with target and frequency encoding of
+high-cardinality columns, binary and multiclass targets, standard
+calibration and single-pass fold ensembles) on a fixed synthetic dataset,
+compiles each one and compares its probabilities with the scikit-learn
+pipeline's on check rows the training run's own X_test never covers:
+missing values in every column, categories unseen in training, rows that
+are entirely missing, and ordinary rows. The check rows are sent as
+request records through the model's input schema, as /predict aligns them.
+
+Exits with code 1 if a pipeline does not compile or differs by more than
+the tolerance on any row, so it can run before a deploy or in CI.
+
+    python parity_check.py
+    python parity_check.py --rows 5000 --tolerance 1e-9
+"""
+
+import argparse
+import json
+import sys
+
+import numpy as np
+import pandas as pd
+from sklearn.calibration import CalibratedClassifierCV
+from sklearn.pipeline import Pipeline
+
+from categorical_encoding import HIGH_CARDINALITY_ENCODINGS, ONEHOT_MAX_CATEGORIES, build_preprocessor
+from compiled_model import PARITY_TOLERANCE, export_compiled_model
+from input_schema import InputSchema
+from training import build_classifier, fit_single_pass, training_matrix
+
+ALGORITHMS = ("randomforest", "extratrees")
+NUMERIC_COLUMNS = ["grade", "logins", "forum_posts", "assignments_submitted"]
+ONEHOT_COLUMNS = ["program", "cohort"]
+HIGH_CARDINALITY_COLUMNS = ["tutor", "school"]
+# Share of training values left missing in every column
+MISSING_FRACTION = 0.1
+
+
+def generate_dataset(rows, seed, n_classes):
+    """A fixed mix of numeric, low- and high-cardinality categorical columns with missing values."""
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        "grade": rng.normal(65, 15, rows),
+        "logins": rng.poisson(30, rows).astype(float),
+        "forum_posts": rng.exponential(5, rows),
+        "assignments_submitted": rng.integers(0, 12, rows).astype(float),
+        "program": rng.choice(["arts", "science", "engineering", "business"], rows),
+        "cohort": rng.choice(["2022", "2023", "2024"], rows),
+        "tutor": rng.choice([f"tutor_{i}" for i in range(ONEHOT_MAX_CATEGORIES * 3)], rows),
+        "school": rng.choice([f"school_{i}" for i in range(ONEHOT_MAX_CATEGORIES * 2)], rows),
+    })
+    score = (df["grade"] / 15 + df["logins"] / 10 + df["assignments_submitted"] / 3
+             + df["tutor"].str.len() % 3 + rng.normal(0, 1, rows))
+    labels = np.quantile(score, np.linspace(0, 1, n_classes + 1)[1:-1])
+    y = pd.Series(np.digitize(score, labels), name="outcome")
+    for col in df.columns:
+        # As read from a file
+        df.loc[rng.random(rows) < MISSING_FRACTION, col] = np.nan
+    return df, y
+
+
+def check_records(X_train, seed):
+    """Request records with missing values, unseen categories and both, next to ordinary ones."""
+    rng = np.random.default_rng(seed + 1)
+    base = [{col: (None if pd.isna(value) else value) for col, value in record.items()}
+            for record in X_train.sample(n=50, random_state=seed).to_dict(orient="records")]
+    categorical = ONEHOT_COLUMNS + HIGH_CARDINALITY_COLUMNS
+    unseen = [dict(record, **{col: f"unseen_{col}_{i}" for col in categorical}) for i, record in enumerate(base)]
+    # Missing features are sent as null or left out
+    missing = [{col: value for col, value in record.items() if rng.random() >= 0.25}
+               for record in base]
+    missing = [dict(record, **{col: None for col in record if rng.random() < 0.25}) for record in missing]
+    mixed = [dict(record, **{col: None for col in NUMERIC_COLUMNS}) for record in unseen]
+    empty = [{}, {col: None for col in X_train.columns}]
+    return {"ordinary": base, "unseen_categories": unseen, "missing_values": missing,
+            "unseen_and_missing": mixed, "all_missing": empty}
+
+
+def build_pipeline(algorithm, encoding, mode, X_train, y_train):
+    """A fitted pipeline as training.py builds it, with its calibrated_pipeline attribute."""
+    preprocessor = build_preprocessor(NUMERIC_COLUMNS, ONEHOT_COLUMNS, HIGH_CARDINALITY_COLUMNS, encoding)
+    model = build_classifier(algorithm)
+    if mode == "single_pass":
+        single_pass = fit_single_pass(preprocessor, model, X_train, y_train)
+        pipeline = Pipeline([('preprocessor', single_pass["preprocessor"]),
+                             ('classifier', single_pass["calibrated_model"])])
+        pipeline.calibrated_pipeline = Pipeline([('preprocessor', single_pass["preprocessor"]),
+                                                 ('calibrated_classifier', single_pass["calibrated_model"])])
+        return pipeline
+    pipeline = Pipeline([('preprocessor', preprocessor), ('classifier', model)])
+    pipeline.fit(X_train, y_train)
+    calibrated_model = CalibratedClassifierCV(estimator=build_classifier(algorithm), method='sigmoid', cv=3)
+    calibrated_model.fit(training_matrix(preprocessor, X_train, y_train), y_train)
+    pipeline.calibrated_pipeline = Pipeline([('preprocessor', preprocessor),
+                                             ('calibrated_classifier', calibrated_model)])
+    return pipeline
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check compiled inference against the scikit-learn pipelines')
+    parser.add_argument('--rows', type=int, default=2000, help='Training rows of the synthetic dataset')
+    parser.add_argument('--seed', type=int, default=42, help='Seed of the synthetic dataset')
+    parser.add_argument('--tolerance', type=float, default=PARITY_TOLERANCE,
+                        help='Largest tolerated absolute difference of a probability')
+    parser.add_argument('--output', type=str, default="", help='Also write the report to this file')
+    args = parser.parse_args()
+
+    cases = {}
+    for n_classes in (2, 3):
+        X_train, y_train = generate_dataset(args.rows, args.seed, n_classes)
+        schema = InputSchema.from_training_frame(X_train, NUMERIC_COLUMNS, ONEHOT_COLUMNS + HIGH_CARDINALITY_COLUMNS)
+        checks = {name: schema.build_frame(records) for name, records in check_records(X_train, args.seed).items()}
+        for algorithm in ALGORITHMS:
+            for encoding in HIGH_CARDINALITY_ENCODINGS:
+                for mode in ("standard", "single_pass"):
+                    case = f"{n_classes}-class/{algorithm}/{encoding}/{mode}"
+                    print(f"Checking {case}", file=sys.stderr)
+                    pipeline = build_pipeline(algorithm, encoding, mode, X_train, y_train)
+                    results = {}
+                    for name, X_check in checks.items():
+                        compiled, report = export_compiled_model(pipeline, X_check, tolerance=args.tolerance)
+                        results[name] = {"passed": compiled is not None, "rows": report["rows_checked"],
+                                         "max_abs_diff": report.get("max_abs_diff"), "reason": report.get("reason")}
+                    cases[case] = results
+
+    failures = [f"{case}: {name} ({result['reason']}, max abs diff {result['max_abs_diff']})"
+                for case, results in cases.items() for name, result in results.items() if not result["passed"]]
+    report = {"rows": args.rows, "seed": args.seed, "tolerance": args.tolerance, "cases": cases,
+              "failures": failures}
+    output = json.dumps(report, indent=1)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(json.dumps({"cases": len(cases), "checks": sum(len(results) for results in cases.values()),
+                      "failures": failures}, indent=1))
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
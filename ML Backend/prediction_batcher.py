@@ -0,0 +1,122 @@
+"""
+Micro-batching for single-row predictions
+
+Concurrent single-row /predict calls for the same model are collected for a
+short window (or until the batch is full), scored as one matrix in a worker
+thread, and the rows are handed back to the waiting requests.
+"""
+
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# predict_fn(model_data, records) -> (predictions, probabilities), one entry per record
+PredictFn = Callable[[Any, List[Dict[str, Any]]], Tuple[List[Any], List[List[float]]]]
+
+
+class _PendingBatch:
+    __slots__ = ("model_data", "records", "futures", "timer")
+
+    def __init__(self, model_data: Any):
+        self.model_data = model_data
+        self.records: List[Dict[str, Any]] = []
+        self.futures: List[asyncio.Future] = []
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+
+class PredictionBatcher:
+    """Coalesces concurrent single-row predictions per model_id."""
+
+    def __init__(self, predict_fn: PredictFn, window_ms: float = 5.0, max_batch_size: int = 64,
+                 max_workers: int = 4):
+        self.predict_fn = predict_fn
+        self.window = max(float(window_ms), 0.0) / 1000.0
+        self.max_batch_size = max(int(max_batch_size), 1)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="predict-batch")
+        self._pending: Dict[str, _PendingBatch] = {}
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.rows = 0
+        self.largest_batch = 0
+        self.fallbacks = 0
+
+    async def submit(self, model_id: str, model_data: Any, record: Dict[str, Any]) -> Tuple[Any, List[float]]:
+        """Queue one feature record and wait for its (prediction, probabilities)."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        batch = self._pending.get(model_id)
+        if batch is None:
+            batch = self._pending[model_id] = _PendingBatch(model_data)
+            batch.timer = loop.call_later(self.window, self._flush, model_id)
+        batch.records.append(record)
+        batch.futures.append(future)
+        if len(batch.records) >= self.max_batch_size:
+            self._flush(model_id)
+        return await future
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": True,
+                "window_ms": self.window * 1000.0,
+                "max_batch_size": self.max_batch_size,
+                "batches": self.batches,
+                "rows": self.rows,
+                "average_batch_size": self.rows / self.batches if self.batches else 0.0,
+                "largest_batch": self.largest_batch,
+                "fallbacks": self.fallbacks,
+            }
+
+    def _flush(self, model_id: str) -> None:
+        batch = self._pending.pop(model_id, None)
+        if batch is None:
+            return
+        if batch.timer is not None:
+            batch.timer.cancel()
+        asyncio.ensure_future(self._run(batch))
+
+    async def _run(self, batch: _PendingBatch) -> None:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            self.batches += 1
+            self.rows += len(batch.records)
+            self.largest_batch = max(self.largest_batch, len(batch.records))
+        try:
+            predictions, probabilities = await loop.run_in_executor(
+                self._executor, self.predict_fn, batch.model_data, batch.records
+            )
+            results = list(zip(predictions, probabilities))
+        except Exception as e:
+            if len(batch.records) == 1:
+                self._resolve(batch.futures, [e])
+                return
+            # One bad row should not fail the whole batch: score rows individually
+            logger.warning(f"Batched prediction failed ({str(e)}), retrying {len(batch.records)} rows one by one")
+            with self._lock:
+                self.fallbacks += 1
+            results = await asyncio.gather(*[
+                loop.run_in_executor(self._executor, self._predict_one, batch.model_data, record)
+                for record in batch.records
+            ], return_exceptions=True)
+        self._resolve(batch.futures, results)
+
+    def _predict_one(self, model_data: Any, record: Dict[str, Any]) -> Tuple[Any, List[float]]:
+        predictions, probabilities = self.predict_fn(model_data, [record])
+        return predictions[0], probabilities[0]
+
+    @staticmethod
+    def _resolve(futures: List[asyncio.Future], results: List[Any]) -> None:
+        for future, result in zip(futures, results):
+            if future.done():
+                continue
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False)
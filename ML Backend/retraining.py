@@ -0,0 +1,462 @@
+"""
+Incremental retraining for the Student Performance Predictor API
+
+The pipeline behind /retrain. Instead of training from scratch, a stored
+model is continued on the course's grown dataset: Random Forest and Extra
+Trees get extra trees through warm starts, XGBoost, LightGBM and CatBoost
+continue boosting from the saved booster, and other models are refitted with
+the parent's hyperparameters. The parent's fitted preprocessor is reused
+unchanged and only the probability calibrator is refitted, on a held-out
+slice of the training split.
+
+Every retrained artifact records its lineage (parent, root model, the
+root's training mode and generation) and reports its fit time against a full retrain.
+"""
+
+import copy
+import logging
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+from sklearn.base import clone
+from sklearn.calibration import CalibratedClassifierCV
+from sklearn.metrics import confusion_matrix
+from sklearn.model_selection import train_test_split
+from sklearn.pipeline import Pipeline
+
+from compiled_model import export_compiled_model
+from confidence import calculate_confidence_interval
+from hyperparameter_search import resource_param
+from input_schema import InputSchema
+from model_artifact import load_artifact, save_artifact
+from model_registry import ARTIFACT_SUFFIX, sidecar_from_model_data, write_sidecar
+from dataset_registry import DatasetRegistry
+from training import holdout_metrics, load_dataset, load_registered_dataset, prepare_target, run_training
+from training_jobs import TrainingCancelled, TrainingError
+from training_profile import TrainingProfile
+
+logger = logging.getLogger(__name__)
+
+WARM_START = "warm_start"
+CONTINUED_BOOSTING = "continued_boosting"
+REFIT = "refit"
+
+BOOSTING_ALGORITHMS = ("xgboost", "lightgbm", "catboost")
+# Share of the training split held out to refit the calibrator
+CALIBRATION_FRACTION = 0.25
+# Trees (or boosting rounds) added by default, relative to the parent model
+DEFAULT_ADDED_FRACTION = 0.25
+# Appended rows needed to hold out test and calibration rows from them alone
+MIN_NEW_ROWS = 20
+
+
+def _split(indices, y, fraction):
+    """Split row indices into (kept, held out), stratified on their targets in ``y`` when possible."""
+    try:
+        return train_test_split(indices, test_size=fraction, random_state=42, stratify=y[indices])
+    except ValueError:
+        return train_test_split(indices, test_size=fraction, random_state=42)
+
+
+def _frozen_calibrator(fitted_model):
+    """Sigmoid calibrator around an already fitted model, which it does not refit."""
+    try:
+        from sklearn.frozen import FrozenEstimator
+        return CalibratedClassifierCV(estimator=FrozenEstimator(fitted_model), method='sigmoid')
+    except ImportError:
+        # For older scikit-learn versions
+        return CalibratedClassifierCV(fitted_model, method='sigmoid', cv='prefit')
+
+
+def retrain_strategy(algorithm: str, classifier: Any) -> str:
+    """How a parent classifier is continued: warm start, continued boosting or refit."""
+    if isinstance(classifier, CalibratedClassifierCV):
+        # Single-pass models average calibrated fold models; there is no single model to continue
+        return REFIT
+    if algorithm in BOOSTING_ALGORITHMS:
+        return CONTINUED_BOOSTING
+    if "warm_start" in classifier.get_params():
+        return WARM_START
+    return REFIT
+
+
+def continue_classifier(algorithm: str, classifier: Any, strategy: str, added: int, X, y):
+    """
+    Fit ``added`` more trees or boosting rounds on top of a fitted classifier.
+
+    Returns the continued classifier; the parent is left untouched. With the
+    refit strategy a fresh copy with the parent's hyperparameters is fitted.
+    """
+    resource = resource_param(algorithm)
+    if strategy == WARM_START:
+        model = copy.deepcopy(classifier)
+        model.set_params(warm_start=True, **{resource: classifier.get_params()[resource] + added})
+        model.fit(X, y)
+        model.set_params(warm_start=False)
+        return model
+    if strategy == CONTINUED_BOOSTING:
+        model = clone(classifier).set_params(**{resource: added})
+        if algorithm == 'catboost':
+            model.fit(X, y, init_model=classifier)
+            return model
+        if algorithm == 'xgboost':
+            model.fit(X, y, xgb_model=classifier.get_booster())
+        else:
+            model.fit(X, y, init_model=classifier.booster_)
+        # The continued booster holds the parent's rounds too
+        model.set_params(**{resource: classifier.get_params()[resource] + added})
+        return model
+    if isinstance(classifier, CalibratedClassifierCV):
+        member = classifier.calibrated_classifiers_[0]
+        classifier = getattr(member, 'estimator', None) or getattr(member, 'base_estimator', None)
+    model = clone(classifier)
+    model.fit(X, y)
+    return model
+
+
+def _estimator_count(algorithm: str, classifier: Any) -> Optional[int]:
+    if isinstance(classifier, CalibratedClassifierCV):
+        member = classifier.calibrated_classifiers_[0]
+        classifier = getattr(member, 'estimator', None) or getattr(member, 'base_estimator', None)
+    value = classifier.get_params().get(resource_param(algorithm))
+    return int(value) if value is not None else None
+
+
+def _root_training_mode(parent: Dict[str, Any]) -> str:
+    """The training_mode the lineage's root model was trained with, for a full retrain of it."""
+    mode = (parent.get('lineage') or {}).get("training_mode")
+    if mode:
+        return mode
+    mode = ((parent.get('metrics') or {}).get("training_timing") or {}).get("mode")
+    # Retrained parents from before the mode was kept in the lineage
+    return mode if mode and mode != "retrain" else "standard"
+
+
+def _full_retrain_estimate(parent_metrics: Dict[str, Any], rows: int) -> Optional[float]:
+    """Seconds a full retrain would take, scaled from the parent's recorded fit stages."""
+    timing = parent_metrics.get("training_timing") or {}
+    if timing.get("mode") == "retrain":
+        # A retrained parent carries the full-retrain baseline forward
+        seconds = ((parent_metrics.get("retraining") or {}).get("full_retrain") or {}).get("seconds")
+    else:
+        # Tournament and search are selection work a retrain with known settings would not repeat
+        stages = timing.get("stage_seconds") or {}
+        seconds = sum(v for k, v in stages.items() if k not in ("evaluating", "tournament", "search"))
+    if not seconds:
+        return None
+    if timing.get("rows"):
+        seconds *= rows / timing["rows"]
+    return seconds
+
+
+def run_retraining(
+    dataset_path: Optional[str],
+    filename: str,
+    parent_model_id: str,
+    parent_model_path: str,
+    courseid: int,
+    models_dir: str,
+    target_column: str = "final_outcome",
+    test_size: float = 0.2,
+    id_columns: Optional[List[str]] = None,
+    added_estimators: Optional[int] = None,
+    compile_model: bool = False,
+    compare_full: bool = False,
+    dtypes: Optional[Dict[str, str]] = None,
+    compact_dtypes: bool = True,
+    dataset_id: Optional[str] = None,
+    datasets_dir: Optional[str] = None,
+    progress: Optional[Callable[[str, float], None]] = None
+) -> Dict[str, Any]:
+    """
+    Continue a stored model on a grown dataset and save the result as a new model.
+
+    The dataset is aligned to the parent's input schema and split like /train
+    does. ``added_estimators`` trees or boosting rounds (default: a quarter of
+    the parent's) are fitted on the training split minus a calibration slice,
+    and the calibrator is refitted on that slice. With ``compare_full`` a full
+    retrain with the parent's settings is also run (and discarded) to measure
+    the speedup; otherwise it is estimated from the parent's recorded timing.
+    ``dtypes`` and ``compact_dtypes`` control ingestion, and ``dataset_id``
+    reads a registered dataset instead of a file, as in run_training.
+    Stages are profiled like in run_training. Returns the TrainResponse
+    fields plus the metadata sidecar under "sidecar".
+    """
+    profile = TrainingProfile()
+
+    def report(stage, fraction):
+        profile.start(stage)
+        if progress is not None:
+            progress(stage, fraction)
+
+    start_time = time.time()
+    logger.info(f"Retraining request received for model {parent_model_id} of course {courseid}")
+
+    comparison_path = None
+    try:
+        report("loading", 0.0)
+        try:
+            parent = load_artifact(parent_model_path)
+        except Exception as e:
+            raise TrainingError(404, f"Could not load model {parent_model_id}: {str(e)}")
+        if compare_full and not dataset_id:
+            # run_training deletes its dataset file, so the comparison gets its own copy
+            fd, comparison_path = tempfile.mkstemp(suffix=os.path.splitext(filename)[1])
+            os.close(fd)
+            shutil.copyfile(dataset_path, comparison_path)
+        if dataset_id:
+            df, ingestion = load_registered_dataset(DatasetRegistry(datasets_dir), dataset_id)
+        else:
+            df, ingestion = load_dataset(dataset_path, filename, dtypes=dtypes, compact=compact_dtypes)
+
+        report("preparing", 0.1)
+        algorithm = parent['algorithm']
+        target_column, y = prepare_target(df, target_column)
+        y = np.asarray(y)
+        parent_classes = set(np.asarray(parent['target_classes']).tolist())
+        new_classes = set(np.unique(y).tolist())
+        if not new_classes <= parent_classes:
+            raise TrainingError(400, f"Dataset has target classes {sorted(new_classes - parent_classes, key=str)} "
+                                     f"the model was not trained on; use /train instead")
+
+        schema = InputSchema.from_model_data(parent)
+        missing = [col for col in schema.columns if col not in df.columns]
+        if len(missing) == len(schema.columns):
+            raise TrainingError(400, "Dataset has none of the model's feature columns")
+        if missing:
+            logger.warning(f"Filling {len(missing)} features missing from the dataset with defaults: {missing[:10]}")
+        X = schema.align_frame(df)
+
+        # Evaluate and calibrate on rows appended since the parent, which no tree has seen
+        parent_metrics = parent.get('metrics') or {}
+        parent_rows = (parent_metrics.get("training_timing") or {}).get("rows")
+        if parent_rows and len(X) - parent_rows >= MIN_NEW_ROWS:
+            holdout = "new_rows"
+            new_idx = np.arange(parent_rows, len(X))
+            test_idx = _split(new_idx, y, test_size)[1]
+            calibration_idx = _split(np.setdiff1d(new_idx, test_idx), y, CALIBRATION_FRACTION)[1]
+        else:
+            holdout = "random"
+            logger.warning("No new rows recognised since the parent model, the hold-out split may include rows it was trained on")
+            test_idx = _split(np.arange(len(X)), y, test_size)[1]
+            calibration_idx = _split(np.setdiff1d(np.arange(len(X)), test_idx), y, CALIBRATION_FRACTION)[1]
+        fit_idx = np.setdiff1d(np.arange(len(X)), np.concatenate([test_idx, calibration_idx]))
+        train_idx = np.setdiff1d(np.arange(len(X)), test_idx)
+        X_train, y_train = X.iloc[train_idx], y[train_idx]
+        X_test, y_test = X.iloc[test_idx], y[test_idx]
+        X_fit, y_fit = X.iloc[fit_idx], y[fit_idx]
+        X_calibration, y_calibration = X.iloc[calibration_idx], y[calibration_idx]
+
+        # The parent's fitted preprocessor is kept so continued trees see the same features
+        parent_pipeline = parent['pipeline']
+        preprocessor = parent_pipeline.named_steps['preprocessor']
+        parent_classifier = parent_pipeline.named_steps['classifier']
+        strategy = retrain_strategy(algorithm, parent_classifier)
+        parent_estimators = _estimator_count(algorithm, parent_classifier)
+        if strategy == REFIT:
+            added = 0
+        elif added_estimators:
+            added = int(added_estimators)
+        else:
+            added = max(1, round((parent_estimators or 100) * DEFAULT_ADDED_FRACTION))
+        logger.info(f"Retraining {algorithm} model with strategy {strategy}, adding {added} estimators")
+
+        stage_seconds = {}
+        report("fitting", 0.3)
+        stage_start = time.time()
+        X_fit_transformed = preprocessor.transform(X_fit)
+        try:
+            model = continue_classifier(algorithm, parent_classifier, strategy, added, X_fit_transformed, y_fit)
+        except Exception as e:
+            logger.warning(f"{strategy} failed ({str(e)}), refitting with the parent's hyperparameters")
+            strategy, added = REFIT, 0
+            model = continue_classifier(algorithm, parent_classifier, REFIT, 0, X_fit_transformed, y_fit)
+        stage_seconds["fitting"] = time.time() - stage_start
+
+        report("calibrating", 0.6)
+        stage_start = time.time()
+        pipeline = Pipeline([('preprocessor', preprocessor), ('classifier', model)])
+        try:
+            calibrated_model = _frozen_calibrator(model)
+            calibrated_model.fit(preprocessor.transform(X_calibration), y_calibration)
+            pipeline.calibrated_pipeline = Pipeline([
+                ('preprocessor', preprocessor),
+                ('calibrated_classifier', calibrated_model)
+            ])
+        except Exception as e:
+            logger.warning(f"Probability calibration failed: {str(e)}")
+            logger.warning("Using uncalibrated model instead")
+            pipeline.calibrated_pipeline = None
+        stage_seconds["calibrating"] = time.time() - stage_start
+
+        report("evaluating", 0.75)
+        evaluator = pipeline.calibrated_pipeline or pipeline
+        y_pred = evaluator.predict(X_test)
+        y_pred_proba = evaluator.predict_proba(X_test)
+        binary = len(np.unique(y)) == 2
+        metrics = holdout_metrics(y_test, y_pred, y_pred_proba, binary)
+        # Cross-validation is skipped to keep retraining cheap; the parent's scores are carried over
+        metrics.update({
+            "cv_accuracy": parent_metrics.get("cv_accuracy"),
+            "cv_std": parent_metrics.get("cv_std"),
+            "cv_source": f"parent model {parent_model_id}",
+            "k_folds": parent_metrics.get("k_folds"),
+            "cv_preprocessing": parent_metrics.get("cv_preprocessing"),
+            "cv_optimistic": parent_metrics.get("cv_optimistic"),
+            "removed_leaky_features": parent.get('leaky_features', []),
+            "train_accuracy": float(np.mean(pipeline.predict(X_train) == y_train)),
+            "test_accuracy": metrics["accuracy"],
+        })
+        metrics["overfitting_ratio"] = metrics["train_accuracy"] / max(metrics["accuracy"], 0.001)
+        metrics["overfitting_warning"] = metrics["overfitting_ratio"] > 1.2
+        if missing:
+            metrics["warning"] = f"Warning: {len(missing)} model features were missing from the dataset and filled with defaults."
+        elif holdout == "random":
+            metrics["warning"] = "Warning: test rows may include rows the parent model was trained on."
+        try:
+            metrics["confusion_matrix"] = confusion_matrix(y_test, y_pred).tolist()
+        except Exception as e:
+            logger.warning(f"Error computing confusion matrix: {str(e)}")
+        if hasattr(model, 'feature_importances_'):
+            try:
+                names = preprocessor.get_feature_names_out()
+                ranked = sorted(zip(names, model.feature_importances_), key=lambda x: x[1], reverse=True)
+                metrics["top_features"] = {str(k): float(v) for k, v in ranked[:10]}
+            except Exception as e:
+                logger.warning(f"Error extracting feature importance: {str(e)}")
+                metrics["top_features"] = {}
+        effective_n = min(len(X_test), 100)  # Cap at 100 to avoid overconfidence
+        metrics["confidence_interval"] = calculate_confidence_interval(metrics["accuracy"], n=effective_n, confidence=0.95)
+
+        retrain_seconds = stage_seconds["fitting"] + stage_seconds["calibrating"]
+        full_retrain = None
+        if compare_full:
+            report("full_retrain_comparison", 0.8)
+            comparison_dir = tempfile.mkdtemp(prefix="retrain-comparison-")
+            try:
+                full_result = run_training(
+                    comparison_path, filename, courseid, comparison_dir, algorithm, target_column, test_size,
+                    id_columns, training_mode=_root_training_mode(parent),
+                    dtypes=dtypes, compact_dtypes=compact_dtypes, dataset_id=dataset_id, datasets_dir=datasets_dir,
+                    high_cardinality_encoding=(parent_metrics.get("encoding") or {}).get("high_cardinality_encoding") or "target"
+                )
+                full_timing = full_result["metrics"]["training_timing"]
+                full_retrain = {
+                    "seconds": round(sum(v for k, v in full_timing["stage_seconds"].items() if k != "evaluating"), 3),
+                    "measured": True
+                }
+            finally:
+                comparison_path = None
+                shutil.rmtree(comparison_dir, ignore_errors=True)
+        else:
+            estimate = _full_retrain_estimate(parent_metrics, len(X))
+            if estimate is not None:
+                full_retrain = {"seconds": round(estimate, 3), "measured": False}
+
+        metrics["training_timing"] = {
+            "mode": "retrain",
+            "model_fits": 1,
+            "rows": int(len(X)),
+            "stage_seconds": {stage: round(seconds, 3) for stage, seconds in stage_seconds.items()},
+            "fit_seconds": round(retrain_seconds, 3)
+        }
+        metrics["ingestion"] = ingestion
+        if parent_metrics.get("encoding"):
+            # The parent's fitted encoders are reused as they are
+            metrics["encoding"] = parent_metrics["encoding"]
+        metrics["retraining"] = {
+            "strategy": strategy,
+            "parent_estimators": parent_estimators,
+            "added_estimators": added,
+            "holdout": holdout,
+            "new_rows": int(len(X) - parent_rows) if parent_rows else None,
+            "test_rows": int(len(X_test)),
+            "calibration_rows": int(len(X_calibration)),
+            "retrain_seconds": round(retrain_seconds, 3),
+            "full_retrain": full_retrain,
+            "speedup": round(full_retrain["seconds"] / retrain_seconds, 2) if full_retrain and retrain_seconds else None
+        }
+
+        compiled_model, compiled_parity = None, None
+        if compile_model:
+            profile.start("compiling")
+            try:
+                compiled_model, compiled_parity = export_compiled_model(pipeline, X_test)
+            except Exception as e:
+                logger.warning(f"Compiled model export failed: {str(e)}")
+                compiled_parity = {"compiled": False, "reason": str(e)}
+
+        model_id = str(uuid.uuid4())
+        course_models_dir = os.path.join(models_dir, f"course_{courseid}")
+        os.makedirs(course_models_dir, exist_ok=True)
+        model_path = os.path.join(course_models_dir, f"{model_id}{ARTIFACT_SUFFIX}")
+
+        parent_lineage = parent.get('lineage') or {}
+        lineage = {
+            "parent_model_id": parent_model_id,
+            "root_model_id": parent_lineage.get("root_model_id", parent_model_id),
+            "training_mode": _root_training_mode(parent),
+            "generation": parent_lineage.get("generation", 0) + 1,
+            "strategy": strategy,
+            "added_estimators": added,
+            "total_estimators": _estimator_count(algorithm, model),
+            "rows": int(len(X))
+        }
+        model_data = {
+            'pipeline': pipeline,
+            'feature_names': schema.columns,
+            'algorithm': algorithm,
+            'trained_at': datetime.now().isoformat(),
+            'target_classes': list(parent['target_classes']),
+            'metrics': metrics,
+            'cv_scores': list(parent.get('cv_scores', [])),
+            'effective_sample_size': effective_n,
+            'leaky_features': parent.get('leaky_features', []),
+            'input_schema': schema.to_dict(),
+            'lineage': lineage
+        }
+        if compiled_parity is not None:
+            model_data['compiled_model'] = compiled_model
+            model_data['compiled_parity'] = compiled_parity
+
+        report("saving", 0.95)
+        metrics["profile"] = profile.to_dict()
+        save_artifact(model_path, model_data)
+        profile.stop()
+        metrics["profile"] = profile.to_dict()
+        sidecar = sidecar_from_model_data(model_id, courseid, model_data)
+        write_sidecar(model_path, sidecar)
+        logger.info(f"Retrained model saved to {model_path}")
+
+        training_time = time.time() - start_time
+        logger.info(f"Retraining completed in {training_time:.2f} seconds "
+                    f"(speedup {metrics['retraining']['speedup']}x over a full retrain)")
+
+        return {
+            "model_id": model_id,
+            "algorithm": algorithm,
+            "metrics": metrics,
+            "feature_names": [str(f) for f in schema.columns],
+            "target_classes": [int(c) if isinstance(c, np.integer) else c for c in parent['target_classes']],
+            "trained_at": model_data['trained_at'],
+            "training_time_seconds": training_time,
+            "model_path": model_path,
+            "lineage": lineage,
+            "courseid": courseid,
+            "sidecar": sidecar
+        }
+    except (TrainingError, TrainingCancelled):
+        raise
+    except Exception as e:
+        logger.exception(f"Error retraining model: {str(e)}")
+        raise TrainingError(500, f"Error retraining model: {str(e)}")
+    finally:
+        profile.stop()
+        if comparison_path is not None and os.path.exists(comparison_path):
+            os.unlink(comparison_path)
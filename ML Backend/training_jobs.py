@@ -0,0 +1,344 @@
+"""
+Background training jobs for the Student Performance Predictor API
+
+/train hands its work to a JobManager, which runs it in a bounded process
+pool so the API event loop keeps serving /predict and /health while models
+train. Progress and cancellation requests are shared with the worker
+processes through a multiprocessing manager.
+
+With a ``state_dir``, every job is also written to ``<state_dir>/<job_id>.json``
+and its training process writes its progress next to it, so every API worker
+of a multi-worker server can report and cancel jobs that another one runs.
+"""
+
+import importlib
+import json
+import logging
+import multiprocessing
+import os
+import socket
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import CancelledError, Future, ProcessPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Union
+
+from model_registry import atomic_write_json, to_jsonable
+
+logger = logging.getLogger(__name__)
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+FINISHED_STATES = (JOB_SUCCEEDED, JOB_FAILED, JOB_CANCELLED)
+PROGRESS_SUFFIX = ".progress.json"
+CANCEL_SUFFIX = ".cancel"
+
+
+class TrainingError(Exception):
+    """A training failure that maps to an HTTP status code."""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(status_code, detail)
+        self.status_code = status_code
+        self.detail = detail
+
+    def __str__(self):
+        return self.detail
+
+
+class TrainingCancelled(Exception):
+    """Raised at a stage boundary when the job was cancelled."""
+
+
+def _init_worker(log_level: int) -> None:
+    logging.basicConfig(
+        level=log_level,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+
+def _resolve_target(target: Union[str, Callable[..., Dict[str, Any]]]) -> Callable[..., Dict[str, Any]]:
+    if callable(target):
+        return target
+    module_name, _, function_name = target.partition(":")
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+def _run_job(job_id: str, state: Any, target: Union[str, Callable[..., Dict[str, Any]]],
+             kwargs: Dict[str, Any], state_dir: Optional[str] = None) -> Dict[str, Any]:
+    """Worker-process entry point: run ``target`` with progress/cancellation wired to ``state``."""
+    def progress(stage: str, fraction: float) -> None:
+        if state.get(f"{job_id}:cancel") or (
+                state_dir is not None and os.path.exists(os.path.join(state_dir, job_id + CANCEL_SUFFIX))):
+            raise TrainingCancelled(f"Job {job_id} cancelled during {stage}")
+        update = {"stage": stage, "progress": round(float(fraction), 3), "updated_at": time.time()}
+        state[job_id] = update
+        if state_dir is not None:
+            atomic_write_json(os.path.join(state_dir, job_id + PROGRESS_SUFFIX), update)
+
+    progress("started", 0.0)
+    return _resolve_target(target)(progress=progress, **kwargs)
+
+
+class JobManager:
+    """Queue of training jobs executed in a bounded process pool."""
+
+    def __init__(self, max_workers: int = 2, history: int = 200, start_method: str = "spawn",
+                 on_success: Optional[Callable[[Dict[str, Any]], None]] = None,
+                 state_dir: Optional[str] = None):
+        self.max_workers = max(1, int(max_workers))
+        self.history = history
+        self.start_method = start_method
+        self.on_success = on_success
+        self.state_dir = state_dir
+        if state_dir is not None:
+            os.makedirs(state_dir, exist_ok=True)
+        self._jobs: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._futures: Dict[str, Future] = {}
+        self._lock = threading.RLock()
+        self._executor = None
+        self._manager = None
+        self._state = None
+
+    def _ensure_started(self) -> None:
+        if self._executor is not None:
+            return
+        context = multiprocessing.get_context(self.start_method)
+        self._manager = context.Manager()
+        self._state = self._manager.dict()
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=context,
+            initializer=_init_worker,
+            initargs=(logging.getLogger().getEffectiveLevel(),)
+        )
+        logger.info(f"Started training pool with {self.max_workers} slots ({self.start_method})")
+
+    def submit(self, target: Union[str, Callable[..., Dict[str, Any]]], kwargs: Dict[str, Any],
+               description: Optional[Dict[str, Any]] = None,
+               cleanup: Optional[Callable[[], None]] = None) -> str:
+        """
+        Queue ``target(**kwargs)`` and return the new job ID.
+
+        ``target`` may be given as a "module:function" string so the API
+        process never has to import the training code itself.
+        """
+        job_id = str(uuid.uuid4())
+        with self._lock:
+            self._ensure_started()
+            self._jobs[job_id] = {
+                "job_id": job_id,
+                "status": JOB_QUEUED,
+                "stage": None,
+                "progress": 0.0,
+                "params": description or {},
+                "created_at": datetime.now().isoformat(),
+                "started_at": None,
+                "finished_at": None,
+                "result": None,
+                "error": None,
+                "status_code": None,
+                "worker": {"host": socket.gethostname(), "pid": os.getpid()},
+            }
+            self._persist(self._jobs[job_id])
+            future = self._executor.submit(_run_job, job_id, self._state, target, kwargs, self.state_dir)
+            self._futures[job_id] = future
+        future.add_done_callback(lambda f: self._finish(job_id, f, cleanup))
+        self._trim_history()
+        return job_id
+
+    def future(self, job_id: str) -> Optional[Future]:
+        with self._lock:
+            return self._futures.get(job_id)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Current status, progress and (when finished) result of a job."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return self._read_shared(job_id)
+            if job["status"] in (JOB_QUEUED, JOB_RUNNING):
+                self._refresh(job)
+            return dict(job)
+
+    def list(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            job_ids = list(self._jobs)
+            if self.state_dir is not None:
+                job_ids = list(dict.fromkeys(job_ids + self._shared_job_ids()))
+            jobs = [job for job in (self.get(job_id) for job_id in job_ids) if job is not None]
+            return sorted(jobs, key=lambda job: job["created_at"])
+
+    def cancel(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Cancel a job.
+
+        Queued jobs are dropped immediately. Running jobs are flagged and stop
+        at their next stage boundary.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                # Another worker's job: flag it for its training process
+                job = self._read_shared(job_id)
+                if job is not None and job["status"] not in FINISHED_STATES:
+                    open(os.path.join(self.state_dir, job_id + CANCEL_SUFFIX), "a").close()
+                    job["cancel_requested"] = True
+                return job
+            if job["status"] in FINISHED_STATES:
+                return dict(job)
+            future = self._futures.get(job_id)
+            if future is not None and future.cancel():
+                return self.get(job_id)
+            self._state[f"{job_id}:cancel"] = True
+            job["cancel_requested"] = True
+            self._persist(job)
+            return self.get(job_id)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = {}
+            for job in self.list():
+                counts[job["status"]] = counts.get(job["status"], 0) + 1
+            return {"slots": self.max_workers, "counts": counts}
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+            if self._manager is not None:
+                self._manager.shutdown()
+                self._manager = None
+
+    def _refresh(self, job: Dict[str, Any]) -> None:
+        try:
+            state = self._state.get(job["job_id"]) if self._state is not None else None
+        except (EOFError, OSError):
+            state = None
+        if state:
+            job["status"] = JOB_RUNNING
+            job["stage"] = state["stage"]
+            job["progress"] = state["progress"]
+            if job["started_at"] is None:
+                job["started_at"] = datetime.now().isoformat()
+                self._persist(job)
+
+    def _finish(self, job_id: str, future: Future, cleanup: Optional[Callable[[], None]]) -> None:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            self._refresh(job)
+            job["finished_at"] = datetime.now().isoformat()
+            try:
+                result = future.result()
+                if self.on_success is not None:
+                    self.on_success(result)
+                job.update(status=JOB_SUCCEEDED, stage="done", progress=1.0,
+                           result={k: v for k, v in result.items() if k != "sidecar"})
+            except (CancelledError, TrainingCancelled):
+                job.update(status=JOB_CANCELLED, error="Job cancelled")
+            except TrainingError as e:
+                job.update(status=JOB_FAILED, error=e.detail, status_code=e.status_code)
+            except Exception as e:
+                logger.error(f"Training job {job_id} failed: {str(e)}")
+                job.update(status=JOB_FAILED, error=str(e), status_code=500)
+            self._persist(job)
+            self._remove_files(job_id, PROGRESS_SUFFIX, CANCEL_SUFFIX)
+            if self._state is not None:
+                try:
+                    self._state.pop(job_id, None)
+                    self._state.pop(f"{job_id}:cancel", None)
+                except (EOFError, OSError):
+                    pass
+        if cleanup is not None:
+            cleanup()
+
+    def _trim_history(self) -> None:
+        with self._lock:
+            finished = [j for j, job in self._jobs.items() if job["status"] in FINISHED_STATES]
+            for job_id in finished[:max(0, len(finished) - self.history)]:
+                self._jobs.pop(job_id, None)
+                self._futures.pop(job_id, None)
+            if self.state_dir is None:
+                return
+            # Every worker's finished jobs share the one history
+            shared = [job for job in (self._read_job_file(j) for j in self._shared_job_ids())
+                      if job is not None and job["status"] in FINISHED_STATES]
+            shared.sort(key=lambda job: job["finished_at"] or job["created_at"])
+            for job in shared[:max(0, len(shared) - self.history)]:
+                self._remove_files(job["job_id"], ".json")
+
+    def _persist(self, job: Dict[str, Any]) -> None:
+        if self.state_dir is None:
+            return
+        try:
+            atomic_write_json(os.path.join(self.state_dir, job["job_id"] + ".json"), to_jsonable(job))
+        except OSError as e:
+            logger.warning(f"Could not write the state of job {job['job_id']}: {str(e)}")
+
+    def _shared_job_ids(self) -> List[str]:
+        try:
+            filenames = os.listdir(self.state_dir)
+        except OSError:
+            return []
+        return [name[:-len(".json")] for name in filenames
+                if name.endswith(".json") and not name.endswith(PROGRESS_SUFFIX) and not name.startswith(".")]
+
+    def _read_job_file(self, job_id: str, suffix: str = ".json") -> Optional[Dict[str, Any]]:
+        if self.state_dir is None or os.path.basename(job_id) != job_id or job_id.startswith("."):
+            return None
+        try:
+            with open(os.path.join(self.state_dir, job_id + suffix), "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Unreadable state of job {job_id}: {str(e)}")
+            return None
+
+    def _read_shared(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """A job of another worker, with its training process's progress."""
+        job = self._read_job_file(job_id)
+        if job is None or job["status"] in FINISHED_STATES:
+            return job
+        if not self._worker_alive(job.get("worker") or {}):
+            job.update(status=JOB_FAILED, error="The worker running the job exited", status_code=500)
+            return job
+        state = self._read_job_file(job_id, PROGRESS_SUFFIX)
+        if state:
+            job.update(status=JOB_RUNNING, stage=state["stage"], progress=state["progress"])
+        if os.path.exists(os.path.join(self.state_dir, job_id + CANCEL_SUFFIX)):
+            job["cancel_requested"] = True
+        return job
+
+    @staticmethod
+    def _worker_alive(worker: Dict[str, Any]) -> bool:
+        # Only processes on this host can be checked, and only on POSIX, where
+        # signal 0 is a probe rather than a termination
+        if os.name != "posix" or worker.get("host") != socket.gethostname() or not worker.get("pid"):
+            return True
+        try:
+            os.kill(worker["pid"], 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    def _remove_files(self, job_id: str, *suffixes: str) -> None:
+        if self.state_dir is None:
+            return
+        for suffix in suffixes:
+            try:
+                os.unlink(os.path.join(self.state_dir, job_id + suffix))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f"Could not remove {job_id}{suffix}: {str(e)}")
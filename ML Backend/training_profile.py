@@ -0,0 +1,166 @@
+"""
+Per-stage training profiles for the Student Performance Predictor API
+
+A training run is a sequence of stages (loading, screening, cross-validation,
+fitting, calibration, evaluation, saving, ...). TrainingProfile records the
+wall time, CPU time and peak resident memory of each stage, so a slow run
+can be traced to the stage responsible. Profiles are returned in the
+training metrics, stored in the model metadata, and can be aggregated
+across models to find the stages that are slow everywhere.
+"""
+
+import os
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+
+from ingestion import current_rss
+
+PROFILE_VERSION = 1
+
+
+def _cpu_seconds() -> float:
+    # This process, all of its threads, and worker processes it has waited for
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+def _mb(size: Optional[int]) -> Optional[float]:
+    return round(size / (1024 * 1024), 2) if size is not None else None
+
+
+class TrainingProfile:
+    """
+    Wall time, CPU time and peak RSS of each stage of a training run.
+
+    ``start(stage)`` ends the current stage and starts the next one; a stage
+    that is started again accumulates. A background thread samples the RSS
+    every ``interval`` seconds while the profile runs, and ``stop()`` ends it.
+    """
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.stages: Dict[str, Dict[str, Any]] = {}
+        self._current = None
+        self._started = time.perf_counter()
+        self._cpu_started = _cpu_seconds()
+        self._finished = None
+        self._cpu_finished = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        if current_rss() is not None:
+            self._thread = threading.Thread(target=self._sample, name="training-profile", daemon=True)
+            self._thread.start()
+
+    def start(self, stage: str) -> None:
+        now, cpu, rss = time.perf_counter(), _cpu_seconds(), current_rss()
+        with self._lock:
+            self._close(now, cpu, rss)
+            self._current = {"stage": stage, "wall": now, "cpu": cpu, "rss": rss, "peak": rss}
+
+    def stop(self) -> None:
+        """End the current stage and the RSS sampling."""
+        now, cpu, rss = time.perf_counter(), _cpu_seconds(), current_rss()
+        with self._lock:
+            self._close(now, cpu, rss)
+            if self._finished is None:
+                self._finished, self._cpu_finished = now, cpu
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def _sample(self) -> None:
+        while not self._stop.wait(self.interval):
+            rss = current_rss()
+            with self._lock:
+                current = self._current
+                if current is not None and rss is not None and (current["peak"] is None or rss > current["peak"]):
+                    current["peak"] = rss
+
+    def _close(self, now: float, cpu: float, rss: Optional[int]) -> None:
+        current, self._current = self._current, None
+        if current is None:
+            return
+        samples = [p for p in (current["peak"], rss) if p is not None]
+        peak = max(samples) if samples else None
+        stage = self.stages.setdefault(current["stage"], {"wall_seconds": 0.0, "cpu_seconds": 0.0,
+                                                         "peak_rss_mb": None, "rss_increase_mb": None})
+        stage["wall_seconds"] += now - current["wall"]
+        stage["cpu_seconds"] += cpu - current["cpu"]
+        if peak is not None:
+            stage["peak_rss_mb"] = max(stage["peak_rss_mb"] or 0.0, _mb(peak))
+            if current["rss"] is not None:
+                stage["rss_increase_mb"] = max(stage["rss_increase_mb"] or 0.0, _mb(peak - current["rss"]))
+
+    def to_dict(self) -> Dict[str, Any]:
+        """The profile so far, with per-stage and total wall time, CPU time and peak RSS."""
+        with self._lock:
+            now = self._finished if self._finished is not None else time.perf_counter()
+            cpu = self._cpu_finished if self._cpu_finished is not None else _cpu_seconds()
+            stages = {}
+            for name, stage in self.stages.items():
+                wall = stage["wall_seconds"]
+                stages[name] = {
+                    "wall_seconds": round(wall, 4),
+                    "cpu_seconds": round(stage["cpu_seconds"], 4),
+                    # Above 1 when the stage ran on several cores
+                    "cpu_utilization": round(stage["cpu_seconds"] / wall, 2) if wall > 0 else None,
+                    "peak_rss_mb": stage["peak_rss_mb"],
+                    "rss_increase_mb": stage["rss_increase_mb"],
+                }
+        peaks = [s["peak_rss_mb"] for s in stages.values() if s["peak_rss_mb"] is not None]
+        return {
+            "version": PROFILE_VERSION,
+            "stages": stages,
+            "wall_seconds": round(now - self._started, 4),
+            "cpu_seconds": round(cpu - self._cpu_started, 4),
+            "peak_rss_mb": max(peaks) if peaks else None,
+            "slowest_stage": max(stages, key=lambda s: stages[s]["wall_seconds"]) if stages else None,
+        }
+
+
+def aggregate_profiles(profiles: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Summarize training profiles of many models per stage.
+
+    Each item is a profile (as from TrainingProfile.to_dict) with the
+    ``model_id`` and ``course_id`` it belongs to. Returns, per stage, how
+    many runs had it, the mean, median, p95 and maximum wall time, the mean
+    CPU time, the largest peak RSS, its share of all profiled wall time and
+    the slowest runs; stages are ordered by total wall time.
+    """
+    walls: Dict[str, List[float]] = {}
+    cpus: Dict[str, List[float]] = {}
+    peaks: Dict[str, List[float]] = {}
+    slowest: Dict[str, List[Dict[str, Any]]] = {}
+    runs, total_wall = 0, 0.0
+    for profile in profiles:
+        runs += 1
+        total_wall += profile.get("wall_seconds") or 0.0
+        for name, stage in (profile.get("stages") or {}).items():
+            walls.setdefault(name, []).append(stage["wall_seconds"])
+            cpus.setdefault(name, []).append(stage["cpu_seconds"])
+            if stage.get("peak_rss_mb") is not None:
+                peaks.setdefault(name, []).append(stage["peak_rss_mb"])
+            slowest.setdefault(name, []).append({"model_id": profile.get("model_id"),
+                                                 "course_id": profile.get("course_id"),
+                                                 "wall_seconds": stage["wall_seconds"]})
+
+    stages = {}
+    for name in sorted(walls, key=lambda n: sum(walls[n]), reverse=True):
+        wall = np.asarray(walls[name])
+        stages[name] = {
+            "runs": len(wall),
+            "mean_wall_seconds": round(float(wall.mean()), 4),
+            "median_wall_seconds": round(float(np.median(wall)), 4),
+            "p95_wall_seconds": round(float(np.percentile(wall, 95)), 4),
+            "max_wall_seconds": round(float(wall.max()), 4),
+            "mean_cpu_seconds": round(float(np.mean(cpus[name])), 4),
+            "max_peak_rss_mb": max(peaks[name]) if name in peaks else None,
+            "share_of_wall_time": round(float(wall.sum()) / total_wall, 4) if total_wall > 0 else None,
+            "slowest_runs": sorted(slowest[name], key=lambda r: r["wall_seconds"], reverse=True)[:5],
+        }
+    return {"profiled_runs": runs, "total_wall_seconds": round(total_wall, 3), "stages": stages}
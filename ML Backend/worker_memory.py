@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+Per-worker memory of multi-worker serving
+
+Starts gunicorn (see gunicorn.conf.py) with 1, 2, 4, ... workers in three
+modes and reports the memory of the master and every worker after the
+models are preloaded and every worker has served predictions with them:
+
+- ``empty``: no models preloaded, the cost of a worker by itself;
+- ``private``: SHARED_MODELS=false, every worker loads its own models;
+- ``shared``: SHARED_MODELS=true, the models are loaded once in the master.
+
+The app itself is imported in the master in every mode.
+
+Memory is read from /proc/<pid>/smaps_rollup (Linux), once when the workers
+are ready and again after they have served. RSS counts shared pages in full
+in every process, so the totals are PSS, which splits shared pages between
+the processes that map them, and the per-process private memory is USS.
+
+A worker's first requests cost it memory whatever the mode (connections,
+buffers, the scikit-learn and thread pool state set up on first use), so
+the models are judged in two steps, per added worker:
+
+- model memory: the growth of the total PSS when ready, beyond the ``empty``
+  mode's. In private mode that is what a copy of the models costs;
+- serving memory: the further growth after serving. Serving from shared
+  models writes into their pages (reference counts), so the pages touched
+  are copied into the worker.
+
+The check fails (exit code 1) if in shared mode either the model memory or
+the serving memory beyond private mode's exceeds ``--max-model-fraction``
+of the private mode model memory.
+
+    python worker_memory.py --models-dir models --workers 1,2,4
+"""
+
+import argparse
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+
+from model_artifact import serving_size
+from model_registry import ModelRegistry, read_sidecar
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+API_KEY = "worker-memory"
+MODES = ("empty", "private", "shared")
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def process_memory(pid):
+    """RSS, PSS and USS of a process in MB."""
+    fields = {}
+    with open(f"/proc/{pid}/smaps_rollup", "r") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                fields[parts[0].rstrip(":")] = int(parts[1]) / 1024
+    return {
+        "rss_mb": round(fields.get("Rss", 0.0), 1),
+        "pss_mb": round(fields.get("Pss", 0.0), 1),
+        "uss_mb": round(fields.get("Private_Clean", 0.0) + fields.get("Private_Dirty", 0.0), 1),
+    }
+
+
+def _children(pid):
+    with open(f"/proc/{pid}/task/{pid}/children", "r") as f:
+        return [int(child) for child in f.read().split()]
+
+
+def _wait_ready(log_path, workers, preloads, timeout):
+    """Wait until every worker has started and the expected number of preloads has finished."""
+    deadline = time.time() + timeout
+    while True:
+        with open(log_path, "r") as f:
+            log = f.read()
+        started, preloaded = log.count("Application startup complete"), log.count("Preloaded ")
+        if started >= workers and preloaded >= preloads:
+            return
+        if time.time() > deadline:
+            raise TimeoutError(f"{started} of {workers} workers started, {preloaded} of {preloads} preloads finished")
+        time.sleep(0.2)
+
+
+def _serve(base_url, models, requests, batch_rows, concurrency):
+    """
+    Single-row, small-batch and large-batch predictions with every model.
+
+    Requests are sent concurrently on fresh connections: a worker busy
+    scoring does not accept, so the others get connections too.
+    """
+    headers = {"X-API-Key": API_KEY}
+    calls = [(model_id, features) for _ in range(requests) for model_id, record in models.items()
+             for features in (record, [record] * 8, [record] * batch_rows)]
+
+    def call(item):
+        model_id, features = item
+        with httpx.Client(base_url=base_url, timeout=120) as client:
+            response = client.post("/predict", headers=headers, json={"model_id": model_id, "features": features})
+        return response.status_code != 200
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return sum(executor.map(call, calls))
+
+
+def _snapshot(server_pid):
+    processes = {"master": process_memory(server_pid)}
+    for i, pid in enumerate(sorted(_children(server_pid))):
+        processes[f"worker_{i}"] = process_memory(pid)
+    worker_stats = [stats for name, stats in processes.items() if name != "master"]
+    return {
+        "total_rss_mb": round(sum(p["rss_mb"] for p in processes.values()), 1),
+        "total_pss_mb": round(sum(p["pss_mb"] for p in processes.values()), 1),
+        "mean_worker_uss_mb": round(sum(p["uss_mb"] for p in worker_stats) / max(len(worker_stats), 1), 1),
+        "processes": processes,
+    }
+
+
+def measure(mode, workers, models_dir, models, requests, batch_rows, timeout):
+    """Start gunicorn, preload and exercise the models, and return the memory of its processes before and after."""
+    port = _free_port()
+    env = dict(os.environ, PORT=str(port), WEB_CONCURRENCY=str(workers), MODELS_DIR=os.path.abspath(models_dir),
+               API_KEY=API_KEY, SHARED_MODELS="true" if mode == "shared" else "false",
+               PRELOAD_MODELS="" if mode == "empty" else ",".join(models), PRELOAD_RECENT_PER_COURSE="0",
+               COMPILED_MAX_ROWS=str(batch_rows - 1))
+    log_path = os.path.join(tempfile.gettempdir(), f"worker-memory-{port}.log")
+    with open(log_path, "w") as log:
+        server = subprocess.Popen([sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "ml_backend:app"],
+                                  cwd=BACKEND_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+    try:
+        # Shared mode preloads once in the master, private mode once per worker
+        preloads = {"empty": 0, "shared": 1, "private": workers}[mode]
+        _wait_ready(log_path, workers, preloads, timeout)
+        ready = _snapshot(server.pid)
+        errors = 0
+        if mode != "empty":
+            errors = _serve(f"http://127.0.0.1:{port}", models, requests, batch_rows, concurrency=2 * workers)
+        served = _snapshot(server.pid) if mode != "empty" else ready
+    finally:
+        server.send_signal(signal.SIGTERM)
+        try:
+            server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+        os.unlink(log_path)
+    return {"mode": mode, "workers": workers, "errors": errors, "ready": ready, "served": served}
+
+
+def _growth_per_worker(runs, stage):
+    first, last = runs[0], runs[-1]
+    if last["workers"] == first["workers"]:
+        return None
+    return (last[stage]["total_pss_mb"] - first[stage]["total_pss_mb"]) / (last["workers"] - first["workers"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure per-worker memory of multi-worker serving')
+    parser.add_argument('--models-dir', type=str, default=os.getenv("MODELS_DIR", "models"), help='Models directory')
+    parser.add_argument('--models', type=str, default="", help='Comma-separated model IDs (default: all registered)')
+    parser.add_argument('--workers', type=str, default="1,2,4", help='Comma-separated worker counts')
+    parser.add_argument('--modes', type=str, default=",".join(MODES), help='Comma-separated modes to run')
+    parser.add_argument('--requests', type=int, default=5, help='Rounds of predictions per model')
+    parser.add_argument('--batch-rows', type=int, default=600, help='Rows of the large batch, scored by scikit-learn')
+    parser.add_argument('--max-model-fraction', type=float, default=0.2,
+                        help='Largest share of a private copy of the models an added shared-mode worker may cost')
+    parser.add_argument('--timeout', type=float, default=300, help='Seconds to wait for the workers to be ready')
+    args = parser.parse_args()
+
+    registry = ModelRegistry(args.models_dir)
+    registry.load()
+    model_ids = [m.strip() for m in args.models.split(",") if m.strip()] or sorted(registry.all())
+    if not model_ids:
+        parser.error(f"No models registered in {args.models_dir}")
+    models_mb = sum(serving_size(registry.path_for(model_id)) for model_id in model_ids) / (1024 * 1024)
+    # One record of the input schema's defaults per model
+    models = {model_id: (read_sidecar(registry.path_for(model_id)) or {}).get("input_schema", {}).get("defaults") or {"_": None}
+              for model_id in model_ids}
+    worker_counts = sorted(int(n) for n in args.workers.split(","))
+    modes = [m.strip() for m in args.modes.split(",") if m.strip()]
+
+    runs = {mode: [measure(mode, n, args.models_dir, models, args.requests, args.batch_rows, args.timeout)
+                   for n in worker_counts] for mode in modes}
+    growth = {stage: {mode: _growth_per_worker(mode_runs, stage) for mode, mode_runs in runs.items()}
+              for stage in ("ready", "served")}
+    report = {
+        "models": len(model_ids),
+        "models_serving_mb": round(models_mb, 1),
+        "runs": runs,
+        "pss_growth_per_worker_mb": {stage: {mode: round(g, 1) if g is not None else None for mode, g in by_mode.items()}
+                                     for stage, by_mode in growth.items()},
+    }
+    passed = True
+    ready, served = growth["ready"], growth["served"]
+    if all(ready.get(mode) is not None for mode in MODES):
+        model_memory = {mode: ready[mode] - ready["empty"] for mode in ("shared", "private")}
+        serving_memory = {mode: served[mode] - ready[mode] for mode in ("shared", "private")}
+        limit = args.max_model_fraction * model_memory["private"]
+        report["per_added_worker_mb"] = {
+            "model_memory": {mode: round(mb, 1) for mode, mb in model_memory.items()},
+            "serving_memory": {mode: round(mb, 1) for mode, mb in serving_memory.items()},
+            "limit": round(limit, 1),
+        }
+        passed = (model_memory["shared"] <= limit
+                  and serving_memory["shared"] - serving_memory["private"] <= limit)
+        report["passed"] = passed
+    errors = sum(run["errors"] for mode_runs in runs.values() for run in mode_runs)
+    report["errors"] = errors
+    print(json.dumps(report, indent=1))
+    return 0 if passed and not errors else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
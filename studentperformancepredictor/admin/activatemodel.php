@@ -90,6 +90,11 @@ if ($modelid && $deactivate === 0) { // Activate a model
         }
 
         $transaction->allow_commit();
+
+        // Load the model in the backend before the queued refresh runs, so it does not start on a
+        // cold cache. After the commit, so the transaction is not held open while the backend loads.
+        block_studentperformancepredictor_warm_backend_model($model);
+
         \core\notification::success(get_string('modelactivated', 'block_studentperformancepredictor'));
 
     } catch (Exception $e) {
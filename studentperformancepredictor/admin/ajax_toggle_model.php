@@ -100,6 +100,11 @@ if ($success) {
     }
     // Commit transaction
     $transaction->allow_commit();
+    if ($active) {
+        // Load the model in the backend before the queued refresh runs, so it does not start on a
+        // cold cache. After the commit, so the transaction is not held open while the backend loads.
+        block_studentperformancepredictor_warm_backend_model($model);
+    }
     $response['success'] = true;
     if ($active) {
         $response['message'] = get_string('modelactivated', 'block_studentperformancepredictor');
@@ -336,6 +336,23 @@ function block_studentperformancepredictor_trigger_prediction_refresh($courseid,
     return \core\task\manager::queue_adhoc_task($task, true);
 }
 
+/**
+ * Ask the backend to load a model into its cache before predictions for it are requested.
+ *
+ * Called when a model is activated, once the activation is committed and before the queued
+ * prediction refresh runs. Blocks until the backend has loaded the model.
+ *
+ * @param stdClass $model Model record from block_spp_models
+ * @return bool Success
+ */
+function block_studentperformancepredictor_warm_backend_model($model) {
+    if (empty($model->modelid)) {
+        return false;
+    }
+    $result = block_studentperformancepredictor_call_backend_api('/cache/warm/' . rawurlencode($model->modelid), []);
+    return $result !== false;
+}
+
 /**
  * Call the Python backend API with improved error handling.
  *